@@ -0,0 +1,81 @@
+"""Decoding/encoding of A2S messages: field-by-field vs compiled codec (and lazy decoding)
+
+Uses responses of real game servers from tests fixtures.
+
+Usage:
+    python -m benchmarks.bench_codec [--number 20000]
+"""
+import argparse
+import timeit
+
+from source_query_proxy.source import codec
+from source_query_proxy.source import messages
+from tests.fixtures.responses import RUST_INFO_RESPONSE
+from tests.fixtures.responses import RUST_PLAYERS_RESPONSE
+from tests.fixtures.responses import RUST_RULES_RESPONSE
+
+HEADER_SIZE = 4
+
+FULL_SERVER_PLAYERS = b'D\x40' + b''.join(
+    bytes([index]) + f'Player {index}'.encode() + b'\x00' + bytes(8) for index in range(64)
+)
+
+DECODE_CASES = [
+    ('A2S_INFO', messages.InfoResponse, RUST_INFO_RESPONSE[HEADER_SIZE:]),
+    ('A2S_PLAYERS', messages.PlayersResponse, RUST_PLAYERS_RESPONSE[HEADER_SIZE:]),
+    ('A2S_PLAYERS x64', messages.PlayersResponse, FULL_SERVER_PLAYERS),
+    ('A2S_RULES', messages.RulesResponse, RUST_RULES_RESPONSE[HEADER_SIZE:]),
+    ('request', messages.PlayersRequest, messages.PlayersRequest(challenge=0xBEEF).encode()[HEADER_SIZE:]),
+]
+
+ENCODE_CASES = [
+    ('request', messages.PlayersRequest, {'challenge': 0xBEEF}),
+    ('challenge', messages.GetChallengeResponse, {'challenge': 0xBEEF}),
+    ('fragment', messages.Fragment, {'message_id': 1, 'fragment_count': 4, 'fragment_id': 0, 'mtu': 1200}),
+]
+
+
+def report(name, reference, compiled, number):
+    reference_time = min(timeit.repeat(reference, number=number, repeat=3)) / number
+    compiled_time = min(timeit.repeat(compiled, number=number, repeat=3)) / number
+    print(  # noqa: T001
+        f'{name:>20}: {reference_time * 1e6:8.2f}us -> {compiled_time * 1e6:8.2f}us'
+        f' (x{reference_time / compiled_time:.1f})'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    for name, cls, packet in DECODE_CASES:
+        assert cls.decode(packet) == codec.reference_decode(cls, packet)
+        report(
+            f'decode {name}',
+            lambda: codec.reference_decode(cls, packet),
+            lambda: cls.decode(packet),
+            args.number,
+        )
+
+    for name, cls, packet in DECODE_CASES:
+        report(
+            f'validate {name}',
+            lambda: cls.decode(packet),
+            lambda: cls.decode(packet, lazy=True),
+            args.number,
+        )
+
+    for name, cls, values in ENCODE_CASES:
+        compiled = codec.get_codec(cls)
+        assert compiled.encode(values) == codec.reference_encode(cls, values)
+        report(
+            f'encode {name}',
+            lambda: codec.reference_encode(cls, values),
+            lambda: compiled.encode(values),
+            args.number,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Plain vs bz2 compressed split of A2S_RULES responses
+
+Reports packets and bytes sent per response, time to compress on store
+and time to decompress on client side.
+
+Usage:
+    python -m benchmarks.bench_compression [--iterations 100]
+"""
+import argparse
+import bz2
+import os
+import timeit
+import zlib
+
+from source_query_proxy.source import messages
+from source_query_proxy.transport import split_compressed_packet
+from source_query_proxy.transport import split_packet
+from tests.fixtures.responses import CSS_RULES_RESPONSE_FRAGMENT_COMPRESSED
+from tests.fixtures.responses import RUST_RULES_RESPONSE
+
+
+def _rules_response(rules):
+    body = b''.join(name.encode() + b'\x00' + value.encode() + b'\x00' for name, value in rules.items())
+    return b'\xff\xff\xff\xffE' + len(rules).to_bytes(2, 'little') + body
+
+
+def payloads():
+    css = messages.CompressedFragment.decode(CSS_RULES_RESPONSE_FRAGMENT_COMPRESSED, messages.HEADER_SIZE).content
+    # modded server with lots of plugins, names and values mostly unique
+    modded = {f'sm_plugin_{index}_{os.urandom(4).hex()}': os.urandom(6).hex() for index in range(400)}
+    return [
+        ('rust', RUST_RULES_RESPONSE),
+        ('css (decompressed)', css),
+        ('modded (synthetic)', _rules_response(modded)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    for name, response in payloads():
+        plain = split_packet(response)
+        compressed = split_compressed_packet(response)
+
+        compress_time = timeit.timeit(lambda: split_compressed_packet(response), number=args.iterations)
+        data = bz2.compress(response)  # same payload as in fragments
+        crc = zlib.crc32(response)
+        decompress_time = timeit.timeit(
+            lambda: messages.decompress(data, len(response), crc), number=args.iterations
+        )
+
+        print(f'{name} ({len(response)} bytes):')  # noqa: T001
+        print(f'{"plain":>12}: {len(plain)} packets, {sum(map(len, plain))} bytes')  # noqa: T001
+        print(  # noqa: T001
+            f'{"compressed":>12}: {len(compressed)} packets, {sum(map(len, compressed))} bytes, '
+            f'compress {compress_time / args.iterations * 1e6:.0f} us, '
+            f'decompress {decompress_time / args.iterations * 1e6:.0f} us'
+        )
+
+
+if __name__ == '__main__':
+    main()
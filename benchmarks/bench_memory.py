@@ -0,0 +1,61 @@
+"""Memory held by decoded state of game servers (A2S_INFO, A2S_PLAYERS, A2S_RULES)
+
+Full server (64 players) and rules of real Rust server from tests fixtures.
+
+Usage:
+    python -m benchmarks.bench_memory [--servers 1000]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from source_query_proxy.source import codec
+from source_query_proxy.source import messages
+from tests.fixtures.responses import RUST_INFO_RESPONSE
+from tests.fixtures.responses import RUST_RULES_RESPONSE
+
+PLAYERS_RESPONSE = b'\xff\xff\xff\xffD\x40' + b''.join(
+    bytes([index]) + f'Player {index}'.encode() + b'\x00' + bytes(8) for index in range(64)
+)
+
+RESPONSES = [
+    (messages.InfoResponse, RUST_INFO_RESPONSE),
+    (messages.PlayersResponse, PLAYERS_RESPONSE),
+    (messages.RulesResponse, RUST_RULES_RESPONSE),
+]
+
+
+def decode_state(decode):
+    # every server has own copy of responses, like received from network
+    return [decode(cls, bytes(bytearray(packet))) for cls, packet in RESPONSES]
+
+
+def measure(decode, servers):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = [decode_state(decode) for _ in range(servers)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert len(state) == servers
+    return (after - before) / servers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', type=int, default=1000)
+    args = parser.parse_args()
+
+    modes = [
+        ('field-by-field', lambda cls, packet: codec.reference_decode(cls, packet[messages.HEADER_SIZE :])),
+        ('codec', lambda cls, packet: cls.decode(packet, messages.HEADER_SIZE)),
+        ('lazy', lambda cls, packet: cls.decode(packet, messages.HEADER_SIZE, lazy=True)),
+    ]
+    for name, decode in modes:
+        per_server = measure(decode, args.servers)
+        print(f'{name:>15}: {per_server:,.0f} bytes per server')  # noqa: T001
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Throughput of listening socket: default asyncio transport vs batched (recvmmsg/sendmmsg),
+requests queued and answered by coroutine vs answered right in datagram protocol
+
+Server answers every A2S_PLAYERS request with small cached reply,
+like `QueryProxy` do. Client runs in separate process and keeps `--window` requests in flight.
+
+Usage:
+    python -m benchmarks.bench_transport [--requests 200000] [--window 256]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+import uvloop
+
+from source_query_proxy import mmsg
+from source_query_proxy.source import messages
+from source_query_proxy.transport import bind
+from source_query_proxy.transport import bind_answering
+
+REQUEST = messages.PlayersRequest(challenge=0xBEEF).encode()
+RESPONSE = b'\xff\xff\xff\xffD\x01\x00MyHangryLord\x00\x00\x00\x00\x00\x17\\LD'
+
+
+def run_client(port, requests, window, result):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.settimeout(1)
+    sock.connect(('127.0.0.1', port))
+
+    sent = received = 0
+    start = time.perf_counter()
+    while sent < requests:
+        burst = min(window, requests - sent)
+        for _ in range(burst):
+            sock.send(REQUEST)
+        sent += burst
+
+        try:
+            for _ in range(burst):
+                sock.recv(2048)
+                received += 1
+        except socket.timeout:
+            pass
+
+    result.put((received, time.perf_counter() - start))
+
+
+async def serve(batched):
+    server = await bind(('127.0.0.1', 0), batched=batched)
+    server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+    async def answer():
+        while True:
+            data, addr = await server.recv_raw_packet()
+            await server.send_packet(RESPONSE, addr=addr)
+
+    task = asyncio.ensure_future(answer())
+    return server.sockname[1], lambda: (task.cancel(), server.close())
+
+
+async def serve_in_protocol(batched):
+    transport, protocol = await bind_answering(('127.0.0.1', 0), lambda data, addr: RESPONSE, batched=batched)
+    transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    return transport.get_extra_info('sockname')[1], transport.close
+
+
+async def bench(serve_func, batched, requests, window):
+    port, stop = await serve_func(batched)
+    result = multiprocessing.Queue()
+    client = multiprocessing.Process(target=run_client, args=(port, requests, window, result))
+    client.start()
+
+    loop = asyncio.get_running_loop()
+    received, elapsed = await loop.run_in_executor(None, result.get)
+    client.join()
+
+    stop()
+    return received, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--window', type=int, default=256)
+    args = parser.parse_args()
+
+    uvloop.install()
+    modes = [('default', serve, False), ('in-protocol', serve_in_protocol, False)]
+    if mmsg.is_available():
+        modes += [('batched', serve, True), ('batched in-protocol', serve_in_protocol, True)]
+
+    for name, serve_func, batched in modes:
+        received, elapsed = asyncio.run(bench(serve_func, batched, args.requests, args.window))
+        print(  # noqa: T001
+            f'{name:>20}: {received}/{args.requests} answered in {elapsed:.2f}s, {received / elapsed:,.0f} pps'
+        )
+
+
+if __name__ == '__main__':
+    main()
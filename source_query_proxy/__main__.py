@@ -1,5 +1,7 @@
 import asyncio
+import functools
 import logging
+import signal
 import sys
 from contextlib import suppress
 
@@ -7,28 +9,55 @@ import uvloop
 from pid.decorator import pidfile
 
 from . import config
+from . import metrics
+from .acl import AccessListSource
 from .epbf import run_ebpf_redirection
+from .heavyhitters import BanFeed
+from .overload import LoadShedder
+from .overload import LoopLagMonitor
+from .poller import BackendPoller
 from .proxy import QueryProxy
+from .scheduler import PollScheduler
+from .shm import SharedResponseStore
+from .workers import Supervisor
+from .workers import WorkerContext
 
 logger = logging.getLogger('sqproxy')
 
 
 @pidfile('sqproxy', piddir=config.settings.piddir)
-def run():
+def run(workers: int = 1):
     with suppress(KeyboardInterrupt, SystemExit):
-        if sys.version_info >= (3, 11):
-            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
-                runner.run(main())
+        if workers > 1:
+            if not config.servers:
+                logger.warning('No one server to run. Please check config')
+                return
+            # created before fork, so all workers (even restarted) share the same memory
+            response_store = SharedResponseStore([name for name, _ in config.servers])
+            Supervisor(workers, target=functools.partial(run_worker, response_store=response_store)).run()
         else:
-            uvloop.install()
-            asyncio.run(main())
+            _run_loop(main())
 
 
-async def main():
-    await _run_servers()
+def run_worker(worker: WorkerContext, response_store: SharedResponseStore):
+    with suppress(KeyboardInterrupt, SystemExit):
+        _run_loop(main(worker, response_store))
+
+
+def _run_loop(coro):
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(coro)
+    else:
+        uvloop.install()
+        asyncio.run(coro)
+
+
+async def main(worker: WorkerContext = None, response_store: SharedResponseStore = None):
+    await _run_servers(worker, response_store)
 
 
-async def _run_servers():
+async def _run_servers(worker: WorkerContext = None, response_store: SharedResponseStore = None):
     if not config.servers:
         logger.warning('No one server to run. Please check config')
         return
@@ -43,9 +72,53 @@ async def _run_servers():
         proxy = entrypoint(server, name=name)
         proxies.append(proxy)
 
-    futures = [asyncio.ensure_future(proxy.run()) for proxy in proxies]
-
-    if config.ebpf and config.ebpf.enabled:
+    if worker is not None:
+        _setup_worker(worker, response_store, proxies)
+
+    asyncio.get_event_loop().add_signal_handler(signal.SIGUSR1, log_top_talkers, proxies)
+
+    registry = metrics.MetricsRegistry()
+    for proxy in proxies:
+        registry.register(functools.partial(metrics.collect_proxy, proxy))
+
+    futures = []
+    if config.acl is not None:
+        global_acl = AccessListSource.from_model(config.acl)
+        for proxy in proxies:
+            proxy.global_acl = global_acl
+        if global_acl.reloadable:
+            futures.append(asyncio.ensure_future(global_acl.run()))
+
+    if config.overload.enabled:
+        lag_monitor = LoopLagMonitor(interval=config.overload.check_interval)
+        for proxy in proxies:
+            shedder = LoadShedder(config.overload.lag_thresholds, config.overload.queue_thresholds)
+            proxy.use_load_shedder(shedder)
+            lag_monitor.add(shedder)
+        registry.register(functools.partial(metrics.collect_lag_monitor, lag_monitor))
+        futures.append(asyncio.ensure_future(lag_monitor.run()))
+    if worker is None or worker.is_polling:
+        # all game servers polled through the single socket by the single scheduler
+        poller = BackendPoller()
+        await poller.start()
+        scheduler = PollScheduler(jitter=config.scheduler.jitter, max_in_flight=config.scheduler.max_in_flight)
+        futures.append(asyncio.ensure_future(scheduler.run()))
+        registry.register(functools.partial(metrics.collect_scheduler, scheduler))
+        registry.register(functools.partial(metrics.collect_poller, poller))
+        for proxy in proxies:
+            proxy.use_poller(poller)
+            proxy.use_scheduler(scheduler)
+
+    futures += [asyncio.ensure_future(proxy.run()) for proxy in proxies]
+
+    if config.metrics.enabled:
+        port = config.metrics.bind_port + (worker.index if worker is not None else 0)
+        server = metrics.MetricsServer(registry, host=str(config.metrics.bind_ip), port=port)
+        futures.append(asyncio.ensure_future(server.run()))
+
+    if worker is not None and not worker.is_polling:
+        logger.info('eBPF redirection managed by polling worker')
+    elif config.ebpf and config.ebpf.enabled:
         logger.info('eBPF redirection enabled')
         logger.info('Wait all proxies to be ready ...')
         await asyncio.gather(
@@ -53,11 +126,29 @@ async def _run_servers():
         )
         logger.info('Wait all proxies to be ready ... Done!')
         futures.append(asyncio.ensure_future(run_ebpf_redirection()))
+        detectors = [proxy.heavy_hitters for proxy in proxies if proxy.heavy_hitters is not None]
+        if config.ebpf.ban_file is not None and detectors:
+            futures.append(asyncio.ensure_future(BanFeed(config.ebpf.ban_file, detectors).run()))
     else:
         logger.info('eBPF redirection disabled')
 
     await asyncio.gather(*futures)
 
 
+def log_top_talkers(proxies, n=10):
+    for proxy in proxies:
+        if proxy.heavy_hitters is None:
+            continue
+        top = ', '.join(f'{host}={count}' for host, count, _error in proxy.heavy_hitters.top(n))
+        logger.info('%s top talkers: %s; banned: %s', proxy.name, top or '-', len(proxy.heavy_hitters.get_bans()))
+
+
+def _setup_worker(worker: WorkerContext, response_store: SharedResponseStore, proxies):
+    for proxy in proxies:
+        proxy.reuse_port = True
+        proxy.polling = worker.is_polling
+        proxy.use_shared_cache(response_store.get_cache(proxy.name))
+
+
 if __name__ == '__main__':
     run()
@@ -0,0 +1,183 @@
+"""Allow/deny lists of client networks
+
+Networks (CIDR) are compiled to sorted array of non-overlapping intervals [start, end] of IPv4 addresses,
+so lookup is binary search over integers and hundreds of thousands of networks take a few megabytes.
+
+Allowed clients are not limited (see `heavy_hitter_threshold` and `client_rate_limit` options),
+requests of denied clients are dropped. Allow list is checked first, so it can exempt
+some addresses of denied network.
+
+Lists loaded from files are reloaded when files are changed,
+new index is built in thread and replaces the old one by single assignment.
+"""
+import array
+import asyncio
+import bisect
+import logging
+import os
+import pathlib
+import socket
+import struct
+import typing
+
+logger = logging.getLogger('sqproxy.acl')
+
+DEFAULT_RELOAD_INTERVAL = 60  # seconds
+
+ALLOW = True
+DENY = False
+
+_IP = struct.Struct('!I')
+
+
+def ip_to_int(host: str) -> int:
+    return _IP.unpack(socket.inet_pton(socket.AF_INET, host))[0]
+
+
+def parse_network(network: str) -> typing.Tuple[int, int]:
+    """:return: the first and the last address of network (like '10.0.0.0/8' or single address)"""
+    address, _, prefix = network.partition('/')
+    start = ip_to_int(address)
+    prefix = int(prefix) if prefix else 32
+    if not 0 <= prefix <= 32:
+        raise ValueError(f'Wrong network prefix: {network}')
+    host_mask = (1 << (32 - prefix)) - 1
+    start &= ~host_mask
+    return start, start | host_mask
+
+
+def read_networks(path: pathlib.Path) -> typing.List[typing.Tuple[int, int]]:
+    """Read networks from file: one per line, '#' starts comment
+
+    Wrong lines are skipped with warning, so broken update of file doesn't stop the proxy.
+    """
+    intervals = []
+    with open(path) as fp:
+        for lineno, line in enumerate(fp, 1):
+            line = line.partition('#')[0].strip()
+            if not line:
+                continue
+            try:
+                intervals.append(parse_network(line))
+            except (OSError, ValueError):
+                logger.warning('%s:%s: wrong network %r skipped', path, lineno, line)
+    return intervals
+
+
+class NetworkSet:
+    """Compiled set of networks"""
+
+    def __init__(self, intervals: typing.Iterable[typing.Tuple[int, int]] = ()):
+        starts = array.array('I')
+        ends = array.array('I')
+        for start, end in sorted(intervals):
+            if ends and start <= ends[-1] + 1:
+                # overlapped or adjacent, merge
+                if end > ends[-1]:
+                    ends[-1] = end
+                continue
+            starts.append(start)
+            ends.append(end)
+        self._starts = starts
+        self._ends = ends
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __contains__(self, ip: int) -> bool:
+        index = bisect.bisect_right(self._starts, ip) - 1
+        return index >= 0 and ip <= self._ends[index]
+
+
+class AccessList:
+    def __init__(self, allow: NetworkSet, deny: NetworkSet):
+        self.allow = allow
+        self.deny = deny
+
+    def check(self, ip: int) -> typing.Optional[bool]:
+        """:return: ALLOW, DENY or None if not listed"""
+        if ip in self.allow:
+            return ALLOW
+        if ip in self.deny:
+            return DENY
+        return None
+
+
+class AccessListSource:
+    """Access list built from config: networks listed inline and in files"""
+
+    def __init__(
+        self,
+        allow: typing.Iterable[str] = (),
+        deny: typing.Iterable[str] = (),
+        allow_files: typing.Iterable[pathlib.Path] = (),
+        deny_files: typing.Iterable[pathlib.Path] = (),
+        reload_interval: float = DEFAULT_RELOAD_INTERVAL,
+    ):
+        self._allow = [parse_network(str(network)) for network in allow]
+        self._deny = [parse_network(str(network)) for network in deny]
+        self.allow_files = [pathlib.Path(path) for path in allow_files]
+        self.deny_files = [pathlib.Path(path) for path in deny_files]
+        self.reload_interval = reload_interval
+        self._mtimes = self._get_mtimes()
+        self.current = self.load()
+
+    @classmethod
+    def from_model(cls, model) -> 'AccessListSource':
+        """:param model: `config.AclModel`"""
+        return cls(
+            allow=model.allow,
+            deny=model.deny,
+            allow_files=model.allow_files,
+            deny_files=model.deny_files,
+            reload_interval=model.reload_interval,
+        )
+
+    def _get_mtimes(self):
+        mtimes = []
+        for path in self.allow_files + self.deny_files:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def _read_files(self, paths):
+        intervals = []
+        for path in paths:
+            try:
+                intervals += read_networks(path)
+            except OSError as exc:
+                logger.warning("Can't read %s: %s", path, exc)
+        return intervals
+
+    def load(self) -> AccessList:
+        """Build access list, it's slow for large files, so called in thread"""
+        allow = NetworkSet(self._allow + self._read_files(self.allow_files))
+        deny = NetworkSet(self._deny + self._read_files(self.deny_files))
+        return AccessList(allow, deny)
+
+    async def reload(self) -> bool:
+        """Rebuild access list if files changed
+
+        :return: True if reloaded
+        """
+        mtimes = self._get_mtimes()
+        if mtimes == self._mtimes:
+            return False
+
+        self._mtimes = mtimes
+        loop = asyncio.get_event_loop()
+        acl = await loop.run_in_executor(None, self.load)
+        self.current = acl
+        logger.info('Access list reloaded: %s allowed, %s denied intervals', len(acl.allow), len(acl.deny))
+        return True
+
+    @property
+    def reloadable(self) -> bool:
+        return bool(self.allow_files or self.deny_files)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            await self.reload()
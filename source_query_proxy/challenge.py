@@ -0,0 +1,76 @@
+"""Stateless per-client challenge numbers
+
+Challenge is a keyed hash (BLAKE2s) of client IP, so nothing is stored per client
+and spoofed requests can't get anything but the short challenge response.
+
+Time is divided into epochs of `lifetime` seconds, every epoch has own key
+derived from the process secret. Challenge of the current and the previous epoch is valid,
+the lowest bit of challenge tells which one was used, so only one hash is computed to check it.
+
+Secret is generated on import, so forked workers (see `workers` module) issue the same challenges.
+"""
+import collections
+import hashlib
+import os
+import struct
+import time
+import typing
+
+SECRET = os.urandom(32)
+DEFAULT_LIFETIME = 30  # seconds
+
+_CHALLENGE = struct.Struct('<l')
+_EPOCH = struct.Struct('<q')
+_HASH_MASK = 0x7FFFFFFE  # positive, never A2S_EMPTY_CHALLENGE (-1); the lowest bit is epoch parity
+
+
+class ChallengeIssuer:
+    def __init__(self, lifetime: float = DEFAULT_LIFETIME, secret: bytes = SECRET, person: bytes = b''):
+        """
+        :param lifetime: seconds, challenge is valid from `lifetime` to `2 * lifetime` seconds
+        :param secret: up to 32 bytes
+        :param person: up to 8 bytes, gives different challenges with the same secret (e.g. per server)
+        """
+        self.lifetime = lifetime
+        self._secret = secret
+        self._person = person
+        self._keys: typing.Dict[int, bytes] = {}  # epoch -> key, the current and the previous one
+        self.stats = collections.Counter()  # issued, accepted, rejected
+
+    def _get_key(self, epoch: int) -> bytes:
+        key = self._keys.get(epoch)
+        if key is None:
+            key = hashlib.blake2s(_EPOCH.pack(epoch), key=self._secret, person=self._person).digest()
+            self._keys = {e: k for e, k in self._keys.items() if abs(e - epoch) == 1}
+            self._keys[epoch] = key
+        return key
+
+    def _make(self, host: str, epoch: int) -> bytes:
+        digest = hashlib.blake2s(host.encode(), key=self._get_key(epoch), digest_size=4).digest()
+        value = int.from_bytes(digest, 'little') & _HASH_MASK | epoch & 1
+        return _CHALLENGE.pack(value)
+
+    def issue(self, host: str, now: float = None) -> bytes:
+        """Challenge for client
+
+        :return: raw (little-endian) challenge number
+        """
+        if now is None:
+            now = time.monotonic()
+        self.stats['issued'] += 1
+        return self._make(host, int(now // self.lifetime))
+
+    def verify(self, challenge: bytes, host: str, now: float = None) -> bool:
+        """Check raw challenge received from client"""
+        if now is None:
+            now = time.monotonic()
+        epoch = int(now // self.lifetime)
+        if (challenge[0] ^ epoch) & 1:
+            epoch -= 1
+
+        if challenge == self._make(host, epoch):
+            self.stats['accepted'] += 1
+            return True
+
+        self.stats['rejected'] += 1
+        return False
@@ -7,11 +7,18 @@ def sqproxy():
 
 
 @sqproxy.command()
-def run():
+@click.option(
+    '--workers',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='Number of processes sharing listening ports (SO_REUSEPORT)',
+)
+def run(workers):
     """Run SQProxy process"""
     from .__main__ import run
 
-    run()
+    run(workers=workers)
 
 
 if __name__ == '__main__':
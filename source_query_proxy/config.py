@@ -3,6 +3,7 @@ import logging
 import pathlib
 import typing
 from ipaddress import IPv4Address
+from ipaddress import IPv4Network
 
 import sentry_sdk
 import yaml
@@ -13,6 +14,8 @@ from pydantic import BaseSettings
 from pydantic import Extra
 from pydantic import confloat
 from pydantic import conint
+from pydantic import conlist
+from pydantic import constr
 from pydantic import validator
 from sentry_sdk.integrations.logging import LoggingIntegration
 
@@ -109,6 +112,17 @@ class EntrypointModel(BaseModel):
             raise AttributeError(exc.args[0].replace("'entrypoint'", f"'{file_path}'"))
 
 
+class AclModel(BaseModel):
+    allow: typing.List[IPv4Network] = []
+    deny: typing.List[IPv4Network] = []
+    allow_files: typing.List[pathlib.Path] = []
+    deny_files: typing.List[pathlib.Path] = []
+    reload_interval: confloat(gt=0) = 60
+
+    class Config:
+        extra = Extra.forbid
+
+
 class ServerModel(BaseModel):
     meta: dict
     network: NetworkModel
@@ -119,6 +133,26 @@ class ServerModel(BaseModel):
     no_a2s_rules: bool = False
     wait_ready_graceful_period: confloat(gt=0) = 5
     max_a2s_fails_before_offline: conint(gt=0) = 10
+    batched_udp_io: bool = False
+    answer_in_protocol: bool = True
+    recv_queue_size: conint(ge=0) = 1024
+    recv_queue_drop: constr(regex=r'^(newest|oldest)$') = 'oldest'
+    adaptive_polling: bool = False
+    a2s_idle_cache_lifetime: confloat(gt=0) = 60
+    change_aware_polling: bool = False
+    a2s_unchanged_cache_lifetime: confloat(gt=0) = 30
+    compress_responses: bool = False
+    compress_responses_threshold: conint(gt=0) = 2400
+    a2s_info_challenge: bool = True
+    a2s_per_client_challenge: bool = True
+    a2s_challenge_lifetime: confloat(gt=0) = 30
+    client_rate_limit: confloat(ge=0) = 0
+    client_rate_burst: conint(gt=0) = 20
+    client_rate_limit_subnet: bool = False
+    heavy_hitter_threshold: conint(ge=0) = 0
+    heavy_hitter_window: confloat(gt=0) = 10
+    heavy_hitter_ban_time: confloat(gt=0) = 300
+    acl: typing.Optional[AclModel] = None
     entrypoint: typing.Optional[EntrypointModel] = None
 
     @validator('entrypoint', pre=True)
@@ -137,6 +171,34 @@ class EBPFModel(BaseModel):
     enabled: bool = False
     executable: typing.Union[str, typing.List[str]] = 'python2'
     script_path: typing.Optional[pathlib.Path] = None
+    ban_file: typing.Optional[pathlib.Path] = None
+
+    class Config:
+        extra = Extra.forbid
+
+
+class SchedulerModel(BaseModel):
+    jitter: confloat(ge=0, lt=1) = 0.1
+    max_in_flight: conint(gt=0) = 64
+
+    class Config:
+        extra = Extra.forbid
+
+
+class OverloadModel(BaseModel):
+    enabled: bool = False
+    lag_thresholds: conlist(confloat(gt=0), min_items=3, max_items=3) = [0.05, 0.1, 0.25]
+    queue_thresholds: conlist(confloat(gt=0, le=1), min_items=3, max_items=3) = [0.5, 0.75, 0.9]
+    check_interval: confloat(gt=0) = 0.05
+
+    class Config:
+        extra = Extra.forbid
+
+
+class MetricsModel(BaseModel):
+    enabled: bool = False
+    bind_ip: IPv4Address = IPv4Address('127.0.0.1')
+    bind_port: conint(ge=1, le=65535) = 9580
 
     class Config:
         extra = Extra.forbid
@@ -186,6 +248,25 @@ class Settings(BaseSettings):
             return None
         return EBPFModel.parse_obj(ebpf)
 
+    @cached_property
+    def scheduler(self) -> SchedulerModel:
+        return SchedulerModel.parse_obj(self.merged_config_data.get('scheduler') or {})
+
+    @cached_property
+    def overload(self) -> OverloadModel:
+        return OverloadModel.parse_obj(self.merged_config_data.get('overload') or {})
+
+    @cached_property
+    def metrics(self) -> MetricsModel:
+        return MetricsModel.parse_obj(self.merged_config_data.get('metrics') or {})
+
+    @cached_property
+    def acl(self) -> typing.Optional[AclModel]:
+        acl = self.merged_config_data.get('acl')
+        if not acl:
+            return None
+        return AclModel.parse_obj(acl)
+
 
 def _apply_defaults(target, defaults):
     target.update(dict_merge(defaults, target))
@@ -323,5 +404,13 @@ def __getattr__(name):
         return settings.ebpf
     elif name == 'servers':
         return settings.servers
+    elif name == 'scheduler':
+        return settings.scheduler
+    elif name == 'acl':
+        return settings.acl
+    elif name == 'overload':
+        return settings.overload
+    elif name == 'metrics':
+        return settings.metrics
     else:
         raise AttributeError(name)
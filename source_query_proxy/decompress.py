@@ -0,0 +1,73 @@
+"""Decompression of bz2 compressed split packets
+
+Compressed packet declares size and CRC32 of decompressed data,
+decompression stops as soon as output exceeds declared size (or our own limit),
+so decompression bomb can't exhaust memory.
+
+Large payloads are decompressed in thread pool, so event loop is not blocked.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import time
+
+from .source import messages
+
+MAX_SIZE = messages.MAX_DECOMPRESSED_SIZE
+OFFLOAD_THRESHOLD = 4096  # compressed bytes, larger payloads decompressed off event loop
+MAX_WORKERS = 2
+
+
+class Decompressor:
+    """Decompress payloads of compressed split packets and collect stats"""
+
+    _executor = None
+
+    def __init__(self, max_size: int = MAX_SIZE, offload_threshold: int = OFFLOAD_THRESHOLD):
+        """
+        :param max_size: limit of decompressed size
+        :param offload_threshold: payloads larger than it (bytes) decompressed in thread pool
+        """
+        self.max_size = max_size
+        self.offload_threshold = offload_threshold
+        self.stats = collections.Counter()  # decompressed, offloaded, errors
+        self.time_total = 0.0
+        self.time_max = 0.0
+
+    @classmethod
+    def get_executor(cls) -> concurrent.futures.ThreadPoolExecutor:
+        # shared by all streams, bz2 releases GIL
+        if cls._executor is None:
+            cls._executor = concurrent.futures.ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix='sqproxy-bz2')
+        return cls._executor
+
+    def _decompress_timed(self, data, size, crc):
+        start = time.perf_counter()
+        try:
+            result, error = messages.decompress(data, size, crc, self.max_size), None
+        except messages.BrokenMessageError as exc:
+            result, error = None, exc
+        return result, error, time.perf_counter() - start
+
+    def _done(self, result, error, elapsed):
+        # stats changed only in event loop thread
+        self.stats['decompressed'] += 1
+        self.time_total += elapsed
+        if elapsed > self.time_max:
+            self.time_max = elapsed
+
+        if error is not None:
+            self.stats['errors'] += 1
+            raise error
+        return result
+
+    def decompress(self, data: bytes, size: int, crc: int) -> bytes:
+        return self._done(*self._decompress_timed(data, size, crc))
+
+    async def decompress_async(self, data: bytes, size: int, crc: int) -> bytes:
+        if len(data) <= self.offload_threshold:
+            return self.decompress(data, size, crc)
+
+        self.stats['offloaded'] += 1
+        loop = asyncio.get_event_loop()
+        return self._done(*await loop.run_in_executor(self.get_executor(), self._decompress_timed, data, size, crc))
@@ -0,0 +1,71 @@
+"""Byte-level classification of client requests
+
+Decoding every incoming datagram through :mod:`.source.messages` is the most
+expensive part of answering a client. But client requests have only a handful
+of fixed layouts, so we can recognize them by packet length and request type byte
+and compare the rest with prebuilt request bytes.
+
+Layouts are not hardcoded: they are built from `messages` classes once.
+Anything not matched here should be decoded in usual way.
+"""
+import typing
+
+from .source import messages
+
+A2S_INFO = 'a2s_info'
+A2S_PLAYERS = 'a2s_players'
+A2S_RULES = 'a2s_rules'
+KINDS = (A2S_INFO, A2S_PLAYERS, A2S_RULES)
+
+CHALLENGE_SIZE = 4
+
+#: (kind, challenge) where challenge is raw (little-endian) bytes or None
+ClassifiedRequest = typing.Tuple[str, typing.Optional[bytes]]
+
+REQUEST_TYPE_OFFSET = len(messages.Header().encode(split=messages.NO_SPLIT))
+
+
+def _layout(kind: str, packet: bytes, with_challenge: bool):
+    if with_challenge:
+        prefix = packet[:-CHALLENGE_SIZE]
+    else:
+        prefix = packet
+
+    return (len(packet), packet[REQUEST_TYPE_OFFSET]), (kind, prefix, with_challenge)
+
+
+class RequestClassifier:
+    """Map raw request bytes to the kind of requested data without any `Message` objects"""
+
+    def __init__(self):
+        layouts = [
+            _layout(A2S_INFO, messages.InfoRequest().encode(), with_challenge=False),
+            _layout(A2S_INFO, messages.InfoRequestV2(challenge=0).encode(), with_challenge=True),
+            _layout(A2S_PLAYERS, messages.PlayersRequest(challenge=0).encode(), with_challenge=True),
+            _layout(A2S_RULES, messages.RulesRequest(challenge=0).encode(), with_challenge=True),
+        ]
+        self._table = dict(layouts)
+
+    def classify(self, data: bytes) -> typing.Optional[ClassifiedRequest]:
+        """Get kind of request and it's challenge
+
+        :return: None if layout of `data` is unknown, so it should be decoded by `messages`
+        """
+        size = len(data)
+        if size <= REQUEST_TYPE_OFFSET:
+            return None
+
+        layout = self._table.get((size, data[REQUEST_TYPE_OFFSET]))
+        if layout is None:
+            return None
+
+        kind, prefix, with_challenge = layout
+        if not data.startswith(prefix):
+            return None
+
+        if with_challenge:
+            return kind, data[-CHALLENGE_SIZE:]
+        return kind, None
+
+
+request_classifier = RequestClassifier()
@@ -0,0 +1,156 @@
+"""Reassembly of split packets with bounded memory
+
+Fragments come from the network, so any source can start any amount of split packets
+and never finish them. Incomplete packets are limited by:
+
+- count (globally and per source), the oldest packet is evicted to make room
+- total size of collected fragments (bytes budget), the oldest packets are evicted
+- time, packet not completed in `timeout` seconds is dropped
+"""
+import collections
+import logging
+import time
+import typing
+
+logger = logging.getLogger('sqproxy.fragments')
+
+Address = typing.Tuple[str, int]
+
+DEFAULT_TIMEOUT = 3  # seconds
+DEFAULT_MAX_PACKETS = 1024
+DEFAULT_MAX_PACKETS_PER_SOURCE = 8
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_MAX_FRAGMENTS = 100
+
+
+class _Packet:
+    __slots__ = ('source', 'deadline', 'fragments', 'missing', 'size')
+
+    def __init__(self, source, deadline, fragment_count):
+        self.source = source
+        self.deadline = deadline
+        self.fragments = [None] * fragment_count
+        self.missing = fragment_count
+        self.size = 0
+
+
+class FragmentReassembler:
+    def __init__(
+        self,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_packets: int = DEFAULT_MAX_PACKETS,
+        max_packets_per_source: int = DEFAULT_MAX_PACKETS_PER_SOURCE,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_fragments: int = DEFAULT_MAX_FRAGMENTS,
+    ):
+        """
+        :param timeout: seconds to wait all fragments of packet since first one
+        :param max_packets: how many incomplete packets can be collected
+        :param max_packets_per_source: how many incomplete packets of single source can be collected
+        :param max_bytes: total size of fragments of incomplete packets
+        :param max_fragments: packets of more fragments are dropped
+        """
+        self.timeout = timeout
+        self.max_packets = max_packets
+        self.max_packets_per_source = max_packets_per_source
+        self.max_bytes = max_bytes
+        self.max_fragments = max_fragments
+
+        # (source, message_id) -> packet, ordered by creation, so by deadline too
+        self._packets: typing.Dict[tuple, _Packet] = collections.OrderedDict()
+        # source -> keys of it's packets, from the oldest
+        self._per_source: typing.Dict[Address, typing.List[tuple]] = {}
+        self.size = 0  # bytes of collected fragments
+        # completed, expired, evicted (bytes or count limit), evicted_per_source,
+        # duplicates, dropped (broken fragment numbers)
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self._packets)
+
+    def add(
+        self,
+        source: Address,
+        message_id: int,
+        fragment_id: int,
+        fragment_count: int,
+        content: bytes,
+        now: float = None,
+    ) -> typing.Optional[bytes]:
+        """Collect fragment
+
+        :return: whole packet or None if not all fragments received yet
+        """
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+
+        key = source, message_id
+        packet = self._packets.get(key)
+        if packet is None:
+            if not fragment_id < fragment_count <= self.max_fragments:
+                self.stats['dropped'] += 1
+                logger.debug('Drop fragment %s/%s from %s', fragment_id, fragment_count, source)
+                return None
+
+            if fragment_count == 1:
+                self.stats['completed'] += 1
+                return bytes(content)
+
+            packet = self._new_packet(key, now, fragment_count)
+
+        fragments = packet.fragments
+        if fragment_id >= len(fragments):
+            self.stats['dropped'] += 1
+            return None
+        if fragments[fragment_id] is not None:
+            self.stats['duplicates'] += 1
+            return None
+
+        fragments[fragment_id] = content
+        packet.missing -= 1
+        if not packet.missing:
+            self._remove(key)
+            self.stats['completed'] += 1
+            return b''.join(fragments)
+
+        packet.size += len(content)
+        self.size += len(content)
+        while self.size > self.max_bytes and self._packets:
+            self._evict_oldest()
+        return None
+
+    def _new_packet(self, key, now, fragment_count) -> _Packet:
+        source = key[0]
+        source_keys = self._per_source.get(source)
+        if source_keys is not None and len(source_keys) >= self.max_packets_per_source:
+            self._remove(source_keys[0])
+            self.stats['evicted_per_source'] += 1
+
+        if len(self._packets) >= self.max_packets:
+            self._evict_oldest()
+
+        packet = self._packets[key] = _Packet(source, now + self.timeout, fragment_count)
+        self._per_source.setdefault(source, []).append(key)
+        return packet
+
+    def _evict_oldest(self):
+        self._remove(next(iter(self._packets)))
+        self.stats['evicted'] += 1
+
+    def _expire(self, now):
+        packets = self._packets
+        while packets:
+            key = next(iter(packets))
+            if packets[key].deadline > now:
+                break
+            self._remove(key)
+            self.stats['expired'] += 1
+
+    def _remove(self, key):
+        packet = self._packets.pop(key)
+        self.size -= packet.size
+        source_keys = self._per_source[packet.source]
+        source_keys.remove(key)
+        if not source_keys:
+            del self._per_source[packet.source]
@@ -0,0 +1,203 @@
+"""Detection of the most active query sources (heavy hitters)
+
+Sources counted by Space-Saving sketch: only `capacity` counters are kept,
+new source takes the counter of the least active one (and inherits it's count as possible error).
+So any source sent more than `total / capacity` requests is guaranteed to be tracked,
+and memory is bounded whatever amount of sources floods us.
+
+Source which guaranteed count (count - error) within a window reaches the threshold is banned:
+requests of banned sources are dropped by proxy, and with eBPF redirection enabled
+bans are written to the ban file (see `BanFeed`), so they can be dropped before reaching Python.
+"""
+import asyncio
+import collections
+import logging
+import os
+import pathlib
+import time
+import typing
+
+logger = logging.getLogger('sqproxy.heavyhitters')
+
+DEFAULT_CAPACITY = 1024
+MAX_BANS = 65536
+BAN_FEED_INTERVAL = 1  # seconds
+
+
+class _Counter:
+    __slots__ = ('count', 'error')
+
+    def __init__(self, count, error):
+        self.count = count
+        self.error = error
+
+
+class SpaceSaving:
+    """Top-k counter with O(1) update (Stream-Summary)"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._counters: typing.Dict[str, _Counter] = {}
+        # count -> keys with such count, insertion ordered (the oldest evicted first)
+        self._buckets: typing.Dict[int, typing.Dict[str, None]] = {}
+        self._min_count = 0
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key: str) -> _Counter:
+        """Count occurrence of `key`
+
+        :return: counter of `key`, `count` is overestimated at most by `error`
+        """
+        counters = self._counters
+        buckets = self._buckets
+        counter = counters.get(key)
+        if counter is None:
+            if len(counters) < self.capacity:
+                counter = counters[key] = _Counter(0, 0)
+                self._min_count = 0
+            else:
+                # replace counter of the least active key
+                min_bucket = buckets[self._min_count]
+                evicted = next(iter(min_bucket))
+                counter = counters.pop(evicted)
+                counters[key] = counter
+                counter.error = counter.count
+                self._unlink(evicted, counter.count)
+        else:
+            self._unlink(key, counter.count)
+
+        counter.count += 1
+        bucket = buckets.get(counter.count)
+        if bucket is None:
+            bucket = buckets[counter.count] = {}
+        bucket[key] = None
+        if counter.count - 1 == self._min_count and (counter.count - 1) not in buckets:
+            self._min_count = counter.count
+        return counter
+
+    def _unlink(self, key, count):
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+
+    def top(self, n: int = 10) -> typing.List[typing.Tuple[str, int, int]]:
+        """The most active keys
+
+        :return: list of (key, count, error) sorted by count
+        """
+        result = []
+        for count in sorted(self._buckets, reverse=True):
+            for key in self._buckets[count]:
+                result.append((key, count, self._counters[key].error))
+                if len(result) == n:
+                    return result
+        return result
+
+    def clear(self):
+        self._counters.clear()
+        self._buckets.clear()
+        self._min_count = 0
+
+
+class HeavyHitterDetector:
+    def __init__(
+        self,
+        threshold: int,
+        window: float,
+        ban_time: float,
+        capacity: int = DEFAULT_CAPACITY,
+    ):
+        """
+        :param threshold: requests within the window to ban source
+        :param window: seconds, counts are reset after it
+        :param ban_time: seconds
+        :param capacity: how many sources are tracked
+        """
+        self.threshold = threshold
+        self.window = window
+        self.ban_time = ban_time
+        self.sketch = SpaceSaving(capacity)
+        self.bans: typing.Dict[str, float] = {}  # host -> ban expiration time
+        self._window_end = 0.0
+        self.stats = collections.Counter()  # banned
+
+    def add(self, host: str, now: float = None) -> bool:
+        """Count request of `host`
+
+        :return: True if `host` is banned
+        """
+        if now is None:
+            now = time.monotonic()
+
+        expires = self.bans.get(host)
+        if expires is not None:
+            if expires > now:
+                return True
+            del self.bans[host]
+
+        if now >= self._window_end:
+            self.sketch.clear()
+            self._window_end = now + self.window
+            self._purge_bans(now)
+
+        counter = self.sketch.add(host)
+        if counter.count - counter.error >= self.threshold and len(self.bans) < MAX_BANS:
+            self.bans[host] = now + self.ban_time
+            self.stats['banned'] += 1
+            logger.warning(
+                '%s banned for %s seconds: %s requests in %s seconds', host, self.ban_time, counter.count, self.window
+            )
+            return True
+        return False
+
+    def _purge_bans(self, now: float):
+        expired = [host for host, expires in self.bans.items() if expires <= now]
+        for host in expired:
+            del self.bans[host]
+
+    def get_bans(self, now: float = None) -> typing.List[str]:
+        """Currently banned hosts, expired bans removed"""
+        if now is None:
+            now = time.monotonic()
+        self._purge_bans(now)
+        return list(self.bans)
+
+    def top(self, n: int = 10) -> typing.List[typing.Tuple[str, int, int]]:
+        """Top talkers of the current window: (host, count, error)"""
+        return self.sketch.top(n)
+
+
+class BanFeed:
+    """Write bans of all detectors to the file read by eBPF redirection
+
+    One IPv4 address per line, file replaced atomically and only if bans changed.
+    """
+
+    def __init__(self, path: pathlib.Path, detectors: typing.Iterable[HeavyHitterDetector]):
+        self.path = pathlib.Path(path)
+        self.detectors = list(detectors)
+        self._written = None
+
+    def update(self, now: float = None) -> bool:
+        """:return: True if file rewritten"""
+        bans = set()
+        for detector in self.detectors:
+            bans.update(detector.get_bans(now))
+        bans = sorted(bans)
+        if bans == self._written:
+            return False
+
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text(''.join(host + '\n' for host in bans))
+        os.replace(tmp_path, self.path)
+        self._written = bans
+        return True
+
+    async def run(self, interval: float = BAN_FEED_INTERVAL):
+        logger.info('Write bans to %s', self.path)
+        while True:
+            self.update()
+            await asyncio.sleep(interval)
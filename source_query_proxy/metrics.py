@@ -0,0 +1,324 @@
+"""Metrics exposed in Prometheus text format
+
+Hot path only increments plain counters (`collections.Counter` attributes of proxies and their parts),
+nothing is locked or formatted per request. Metrics are collected from these counters
+and rendered only when the endpoint is scraped, rates are calculated by Prometheus.
+
+With several workers each worker serves own metrics on `bind_port + worker index`.
+"""
+import asyncio
+import logging
+import math
+import time
+import typing
+
+logger = logging.getLogger('sqproxy.metrics')
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = '/metrics'
+REQUEST_TIMEOUT = 5  # seconds
+MAX_HEADERS = 100
+
+# keys of `recv_stats` of listening socket -> reason of dropped request
+_RECV_DROP_REASONS = {
+    'dropped': 'recv_queue_full',
+    'broken': 'broken',
+    'send_paused': 'send_paused',
+}
+
+
+def _escape_help(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """Metric family: name, type and samples with different labels"""
+
+    def __init__(self, name: str, kind: str, documentation: str):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.samples: typing.List[typing.Tuple[typing.Dict[str, str], float]] = []
+
+    def add(self, value, **labels):
+        self.samples.append((labels, value))
+        return self
+
+    def add_counts(self, counts: typing.Mapping[str, int], label: str, **labels):
+        """Sample for every key of `counts`, key is value of `label`"""
+        for key, value in sorted(counts.items()):
+            self.add(value, **{label: key}, **labels)
+        return self
+
+    def render(self) -> typing.List[str]:
+        lines = [
+            f'# HELP {self.name} {_escape_help(self.documentation)}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        for labels, value in self.samples:
+            if labels:
+                formatted = ','.join(f'{key}="{_escape_label(str(label))}"' for key, label in labels.items())
+                lines.append(f'{self.name}{{{formatted}}} {_format_value(value)}')
+            else:
+                lines.append(f'{self.name} {_format_value(value)}')
+        return lines
+
+
+CollectorType = typing.Callable[[], typing.Iterable[Metric]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.collectors: typing.List[CollectorType] = []
+
+    def register(self, collector: CollectorType):
+        """:param collector: called on every scrape, returns fresh `Metric`s"""
+        self.collectors.append(collector)
+
+    def collect(self) -> typing.List[Metric]:
+        """Metrics of all collectors, samples of metrics with the same name are merged"""
+        metrics: typing.Dict[str, Metric] = {}
+        for collector in self.collectors:
+            try:
+                collected = list(collector())
+            except Exception:
+                logger.exception('Metrics collector %r failed', collector)
+                continue
+
+            for metric in collected:
+                known = metrics.get(metric.name)
+                if known is None:
+                    metrics[metric.name] = metric
+                else:
+                    known.samples += metric.samples
+        return list(metrics.values())
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.collect():
+            lines += metric.render()
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def collect_proxy(proxy) -> typing.List[Metric]:
+    """Metrics of `proxy.QueryProxy`"""
+    server = proxy.name
+    now = time.monotonic()
+
+    drops = proxy.client_stats.copy()
+    for key, count in proxy.recv_stats.items():
+        drops[_RECV_DROP_REASONS.get(key, key)] += count
+
+    metrics = [
+        Metric('sqproxy_server_online', GAUGE, 'Game server answers polls, client requests answered only if 1').add(
+            int(proxy.online), server=server
+        ),
+        Metric('sqproxy_requests_total', COUNTER, 'Client requests by type').add_counts(
+            proxy.demand, 'kind', server=server
+        ),
+        Metric('sqproxy_answers_total', COUNTER, 'Answered client requests').add(
+            proxy.response_stats['answered'], server=server
+        ),
+        Metric('sqproxy_sent_bytes_total', COUNTER, 'Bytes of responses to clients, before split into fragments').add(
+            proxy.response_stats['bytes'], server=server
+        ),
+        Metric('sqproxy_dropped_requests_total', COUNTER, 'Dropped client requests by reason').add_counts(
+            drops, 'reason', server=server
+        ),
+        Metric('sqproxy_cache_age_seconds', GAUGE, 'Seconds since response was stored by poll').add_counts(
+            {key: now - updated for key, updated in proxy.cache_updated.items()}, 'kind', server=server
+        ),
+        Metric('sqproxy_backend_polls_total', COUNTER, 'Polls of game server by result')
+        .add(proxy.upstream_stats['polls'], server=server, result='ok')
+        .add(proxy.upstream_stats['poll_timeouts'], server=server, result='timeout'),
+        Metric('sqproxy_backend_events_total', COUNTER, 'Round trips, challenge requests, etc. of polls').add_counts(
+            {key: count for key, count in proxy.upstream_stats.items() if key not in ('polls', 'poll_timeouts')},
+            'event',
+            server=server,
+        ),
+        Metric('sqproxy_challenges_total', COUNTER, 'Per-client challenges by result').add_counts(
+            proxy.challenges.stats, 'result', server=server
+        ),
+    ]
+
+    if proxy.listener is not None:
+        metrics += collect_fragments(proxy.listener, socket='listener', server=server)
+    if proxy.poller is None and proxy._upstream is not None:
+        metrics += collect_fragments(proxy._upstream, socket='upstream', server=server)
+
+    if proxy.heavy_hitters is not None:
+        metrics += [
+            Metric('sqproxy_bans_total', COUNTER, 'Sources banned as heavy hitters').add(
+                proxy.heavy_hitters.stats['banned'], server=server
+            ),
+            Metric('sqproxy_banned_sources', GAUGE, 'Currently banned sources').add(
+                len(proxy.heavy_hitters.get_bans()), server=server
+            ),
+        ]
+
+    if proxy.shedder is not None:
+        metrics += [
+            Metric('sqproxy_overload_level', GAUGE, 'Overload level: 0 - none, 1 - rules, 2 - players, 3 - info').add(
+                proxy.shedder.level, server=server
+            ),
+            Metric('sqproxy_shed_requests_total', COUNTER, 'Client requests refused under overload').add_counts(
+                proxy.shedder.stats, 'kind', server=server
+            ),
+        ]
+
+    return metrics
+
+
+def collect_fragments(owner, **labels) -> typing.List[Metric]:
+    """Metrics of reassembly and decompression of split packets by `transport.FragmentsMixin`"""
+    decompressor = owner.decompressor
+    return [
+        Metric('sqproxy_fragments_total', COUNTER, 'Reassembly of split packets').add_counts(
+            owner.fragments.stats, 'event', **labels
+        ),
+        Metric('sqproxy_decompressions_total', COUNTER, 'Decompression of compressed split packets').add_counts(
+            decompressor.stats, 'event', **labels
+        ),
+        Metric('sqproxy_decompression_seconds_total', COUNTER, 'Time spent to decompress packets').add(
+            decompressor.time_total, **labels
+        ),
+        Metric('sqproxy_decompression_seconds_max', GAUGE, 'The longest decompression of packet').add(
+            decompressor.time_max, **labels
+        ),
+    ]
+
+
+def collect_scheduler(scheduler) -> typing.List[Metric]:
+    """Metrics of `scheduler.PollScheduler`"""
+    return [
+        Metric('sqproxy_scheduler_events_total', COUNTER, 'Scheduled polls, their errors and delays').add_counts(
+            scheduler.stats, 'event'
+        ),
+        Metric('sqproxy_scheduler_queue_depth', GAUGE, 'Polls which should be already started').add(
+            scheduler.queue_depth
+        ),
+        Metric('sqproxy_scheduler_in_flight', GAUGE, 'Running polls').add(scheduler.in_flight),
+        Metric('sqproxy_scheduler_lateness_seconds_total', COUNTER, 'Total delay of polls start').add(
+            scheduler.lateness_total
+        ),
+        Metric('sqproxy_scheduler_lateness_seconds_max', GAUGE, 'The longest delay of poll start').add(
+            scheduler.lateness_max
+        ),
+    ]
+
+
+def collect_poller(poller) -> typing.List[Metric]:
+    """Metrics of `poller.BackendPoller`"""
+    metrics = [
+        Metric('sqproxy_poller_datagrams_total', COUNTER, 'Datagrams of shared polling socket').add_counts(
+            poller.stats, 'event'
+        ),
+    ]
+    if poller.stream is not None:
+        metrics += collect_fragments(poller.stream, socket='poller')
+    return metrics
+
+
+def collect_lag_monitor(monitor) -> typing.List[Metric]:
+    """Metrics of `overload.LoopLagMonitor`"""
+    return [
+        Metric('sqproxy_event_loop_lag_seconds', GAUGE, 'Smoothed lag of event loop').add(monitor.lag),
+    ]
+
+
+class MetricsServer:
+    """Minimal HTTP server of metrics, answers GET /metrics only"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = '127.0.0.1', port: int = 0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info('Serve metrics on http://%s:%s%s', self.host, self.port, METRICS_PATH)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def run(self):
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request_line = await asyncio.wait_for(self._read_request(reader), REQUEST_TIMEOUT)
+            except (ValueError, asyncio.LimitOverrunError):
+                # line longer than limit of stream reader
+                response = '400 Bad Request', b'', True
+            else:
+                if request_line is None:
+                    return
+                response = self._route(request_line)
+            self._respond(writer, *response)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> typing.Optional[str]:
+        request_line = await reader.readline()
+        for _ in range(MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+        return request_line.decode('latin-1').strip() or None
+
+    def _route(self, request_line: str) -> typing.Tuple[str, bytes, bool]:
+        """:return: (status, body, send body)"""
+        parts = request_line.split()
+        if len(parts) < 2:
+            return '400 Bad Request', b'', True
+
+        method, target = parts[0], parts[1]
+        if target.partition('?')[0] != METRICS_PATH:
+            return '404 Not Found', b'', True
+        if method not in ('GET', 'HEAD'):
+            return '405 Method Not Allowed', b'', True
+        return '200 OK', self.registry.render().encode(), method == 'GET'
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: str, body: bytes, send_body: bool):
+        headers = (
+            f'HTTP/1.0 {status}\r\n'
+            f'Content-Type: {CONTENT_TYPE}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+        )
+        writer.write(headers.encode('latin-1'))
+        if send_body:
+            writer.write(body)
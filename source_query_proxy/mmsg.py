@@ -0,0 +1,374 @@
+"""Batched datagram transport based on recvmmsg(2)/sendmmsg(2)
+
+Default asyncio datagram transport makes one syscall and one event-loop callback per datagram.
+:class:`BatchedDatagramTransport` drains socket by batches with a single `recvmmsg()` call
+and flushes all replies queued during one loop iteration with a single `sendmmsg()` call.
+
+It's drop-in replacement for asyncio transport, so any `asyncio.DatagramProtocol` can be used with it.
+Linux only, see :func:`is_available`.
+"""
+import asyncio
+import collections
+import ctypes
+import ctypes.util
+import errno
+import logging
+import socket
+import struct
+
+logger = logging.getLogger('sqproxy.mmsg')
+
+DEFAULT_BATCH_SIZE = 64
+# A2S requests (and fragments of split ones) fit in ~1400 bytes, larger datagrams are truncated and dropped
+DEFAULT_RECV_BUFFER_SIZE = 2048
+MAX_DATAGRAM_SIZE = 65535
+SOCKADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+ADDR_CACHE_SIZE = 4096
+
+# Send queue limits (in bytes) to pause/resume protocol writing, like asyncio transports do
+WRITE_BUFFER_HIGH_WATER = 64 * 1024
+WRITE_BUFFER_LOW_WATER = 16 * 1024
+
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+MSG_TRUNC = getattr(socket, 'MSG_TRUNC', 0x20)
+
+_SOCKADDR_FAMILY = struct.Struct('=H')
+_SOCKADDR_IN_PORT = struct.Struct('!H')
+_SOCKADDR_IN6 = struct.Struct('!HI16s')
+_SOCKADDR_IN6_SCOPE = struct.Struct('=I')
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', MsgHdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None, None
+
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+
+_recvmmsg, _sendmmsg = _load_libc()
+
+
+def is_available():
+    return _recvmmsg is not None
+
+
+def decode_sockaddr(raw: bytes):
+    """Convert raw `struct sockaddr_in`/`struct sockaddr_in6` to address tuple like `socket` module do"""
+    (family,) = _SOCKADDR_FAMILY.unpack_from(raw)
+    if family == socket.AF_INET:
+        (port,) = _SOCKADDR_IN_PORT.unpack_from(raw, 2)
+        return socket.inet_ntop(socket.AF_INET, raw[4:8]), port
+    if family == socket.AF_INET6:
+        port, flowinfo, addr = _SOCKADDR_IN6.unpack_from(raw, 2)
+        (scope_id,) = _SOCKADDR_IN6_SCOPE.unpack_from(raw, 24)
+        return socket.inet_ntop(socket.AF_INET6, addr), port, flowinfo, scope_id
+    raise ValueError(f'Unsupported address family: {family}')
+
+
+def encode_sockaddr(family, addr) -> bytes:
+    """Opposite to :func:`decode_sockaddr`"""
+    host, port = addr[:2]
+    if family == socket.AF_INET:
+        return b''.join(
+            (
+                _SOCKADDR_FAMILY.pack(family),
+                _SOCKADDR_IN_PORT.pack(port),
+                socket.inet_pton(socket.AF_INET, host),
+                bytes(8),
+            )
+        )
+    if family == socket.AF_INET6:
+        flowinfo = addr[2] if len(addr) > 2 else 0
+        scope_id = addr[3] if len(addr) > 3 else 0
+        return b''.join(
+            (
+                _SOCKADDR_FAMILY.pack(family),
+                _SOCKADDR_IN6.pack(port, flowinfo, socket.inet_pton(socket.AF_INET6, host)),
+                _SOCKADDR_IN6_SCOPE.pack(scope_id),
+            )
+        )
+    raise ValueError(f'Unsupported address family: {family}')
+
+
+class BatchedDatagramTransport(asyncio.DatagramTransport):
+    def __init__(
+        self,
+        loop,
+        sock: socket.socket,
+        protocol: asyncio.DatagramProtocol,
+        batch_size=DEFAULT_BATCH_SIZE,
+        recv_buffer_size=DEFAULT_RECV_BUFFER_SIZE,
+    ):
+        """
+        :param recv_buffer_size: max size of received datagram, larger ones are dropped (see `stats`)
+        """
+        super().__init__()
+        self._loop = loop
+        self._sock = sock
+        self._fileno = sock.fileno()
+        self._protocol = protocol
+        self._batch_size = batch_size
+        self._closing = False
+        self.stats = collections.Counter()  # truncated
+        self._extra = {
+            'socket': sock,
+            'sockname': sock.getsockname(),
+        }
+
+        # preallocated receive buffers, reused for each batch
+        recv_buffer_size = min(recv_buffer_size, MAX_DATAGRAM_SIZE)
+        self._recv_buffers = [ctypes.create_string_buffer(recv_buffer_size) for _ in range(batch_size)]
+        self._recv_names = [ctypes.create_string_buffer(SOCKADDR_SIZE) for _ in range(batch_size)]
+        self._recv_iovecs = (IOVec * batch_size)()
+        self._recv_msgs = (MMsgHdr * batch_size)()
+        for i in range(batch_size):
+            self._recv_iovecs[i].iov_base = ctypes.addressof(self._recv_buffers[i])
+            self._recv_iovecs[i].iov_len = recv_buffer_size
+            hdr = self._recv_msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._recv_names[i])
+            hdr.msg_iov = ctypes.pointer(self._recv_iovecs[i])
+            hdr.msg_iovlen = 1
+
+        self._send_iovecs = (IOVec * batch_size)()
+        self._send_msgs = (MMsgHdr * batch_size)()
+        for i in range(batch_size):
+            hdr = self._send_msgs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self._send_iovecs[i])
+            hdr.msg_iovlen = 1
+        self._send_queue = []
+        self._send_queue_bytes = 0
+        self._flush_scheduled = False
+        self._writer_added = False
+        self._writing_paused = False
+
+        # raw sockaddr -> addr tuple (and back), clients usually query many times
+        self._addr_cache = {}
+        self._sockaddr_cache = {}
+
+        self._loop.call_soon(self._protocol.connection_made, self)
+        self._loop.call_soon(self._add_reader)
+
+    def _add_reader(self):
+        if not self._closing:
+            self._loop.add_reader(self._fileno, self._on_readable)
+
+    def get_extra_info(self, name, default=None):
+        return self._extra.get(name, default)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._send_queue.clear()
+        self._send_queue_bytes = 0
+        if self._loop.is_closed():
+            self._sock.close()
+        else:
+            self._loop.remove_reader(self._fileno)
+            if self._writer_added:
+                self._loop.remove_writer(self._fileno)
+            self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+    def _call_connection_lost(self, exc):
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._sock.close()
+
+    def get_write_buffer_size(self):
+        return self._send_queue_bytes
+
+    def get_write_buffer_limits(self):
+        return WRITE_BUFFER_LOW_WATER, WRITE_BUFFER_HIGH_WATER
+
+    def _maybe_pause_protocol(self):
+        if self._writing_paused or self._send_queue_bytes <= WRITE_BUFFER_HIGH_WATER:
+            return
+        self._writing_paused = True
+        self._protocol.pause_writing()
+
+    def _maybe_resume_protocol(self):
+        if not self._writing_paused or self._send_queue_bytes > WRITE_BUFFER_LOW_WATER:
+            return
+        self._writing_paused = False
+        self._protocol.resume_writing()
+
+    def _decode_addr(self, raw):
+        addr = self._addr_cache.get(raw)
+        if addr is None:
+            if len(self._addr_cache) >= ADDR_CACHE_SIZE:
+                self._addr_cache.clear()
+            addr = self._addr_cache[raw] = decode_sockaddr(raw)
+        return addr
+
+    def _encode_addr(self, addr):
+        sockaddr = self._sockaddr_cache.get(addr)
+        if sockaddr is None:
+            if len(self._sockaddr_cache) >= ADDR_CACHE_SIZE:
+                self._sockaddr_cache.clear()
+            raw = encode_sockaddr(self._sock.family, addr)
+            sockaddr = self._sockaddr_cache[addr] = (ctypes.create_string_buffer(raw, len(raw)), len(raw))
+        return sockaddr
+
+    def _on_readable(self):
+        """Read one batch and return control to the loop
+
+        If socket still has datagrams we will be called again on next loop iteration,
+        so consumers, pollers and scheduled flushes can't be starved by flood
+        """
+        if self._closing:
+            return
+
+        msgs = self._recv_msgs
+        batch_size = self._batch_size
+
+        for i in range(batch_size):
+            msgs[i].msg_hdr.msg_namelen = SOCKADDR_SIZE
+
+        count = _recvmmsg(self._fileno, msgs, batch_size, MSG_DONTWAIT, None)
+        if count < 0:
+            err = ctypes.get_errno()
+            if err not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self._protocol.error_received(OSError(err, errno.errorcode.get(err, err)))
+            return
+
+        for i in range(count):
+            msg = msgs[i]
+            if msg.msg_hdr.msg_flags & MSG_TRUNC:
+                self.stats['truncated'] += 1
+                continue
+            data = ctypes.string_at(self._recv_buffers[i], msg.msg_len)
+            addr = self._decode_addr(self._recv_names[i].raw[: msg.msg_hdr.msg_namelen])
+            self._protocol.datagram_received(data, addr)
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+
+        data = bytes(data)
+        self._send_queue.append((data, addr))
+        self._send_queue_bytes += len(data)
+        self._maybe_pause_protocol()
+        if not self._flush_scheduled and not self._writer_added:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        queue = self._send_queue
+        msgs = self._send_msgs
+        iovecs = self._send_iovecs
+
+        while queue and not self._closing:
+            batch = queue[: self._batch_size]
+            for i, (data, addr) in enumerate(batch):
+                iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+                iovecs[i].iov_len = len(data)
+                hdr = msgs[i].msg_hdr
+                if addr is None:
+                    hdr.msg_name = None
+                    hdr.msg_namelen = 0
+                else:
+                    sockaddr, sockaddr_len = self._encode_addr(addr)
+                    hdr.msg_name = ctypes.addressof(sockaddr)
+                    hdr.msg_namelen = sockaddr_len
+
+            sent = _sendmmsg(self._fileno, msgs, len(batch), 0)
+            if sent < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    self._maybe_pause_protocol()
+                    self._wait_writable()
+                    return
+                if err != errno.EINTR:
+                    # first datagram in batch can't be sent, skip it like sendto() do
+                    sent = 1
+                    self._protocol.error_received(OSError(err, errno.errorcode.get(err, err)))
+                else:
+                    continue
+
+            self._send_queue_bytes -= sum(len(data) for data, _ in batch[:sent])
+            del queue[:sent]
+
+        self._maybe_resume_protocol()
+        if self._writer_added:
+            self._loop.remove_writer(self._fileno)
+            self._writer_added = False
+
+    def _wait_writable(self):
+        if not self._writer_added:
+            self._writer_added = True
+            self._loop.add_writer(self._fileno, self._flush)
+
+
+def create_bound_socket(addr, reuse_port=False) -> socket.socket:
+    host, port = addr[:2]
+    family, type_, proto, _, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, type_, proto)
+    try:
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setblocking(False)
+        sock.bind(sockaddr)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+async def create_batched_endpoint(
+    protocol_factory,
+    local_addr,
+    batch_size=DEFAULT_BATCH_SIZE,
+    reuse_port=False,
+    recv_buffer_size=DEFAULT_RECV_BUFFER_SIZE,
+):
+    """Same as `loop.create_datagram_endpoint(protocol_factory, local_addr=local_addr)`"""
+    loop = asyncio.get_event_loop()
+    sock = create_bound_socket(local_addr, reuse_port=reuse_port)
+    protocol = protocol_factory()
+    transport = BatchedDatagramTransport(
+        loop, sock, protocol, batch_size=batch_size, recv_buffer_size=recv_buffer_size
+    )
+    await asyncio.sleep(0)  # let connection_made be called
+    return transport, protocol
@@ -0,0 +1,114 @@
+"""Load shedding by query priority
+
+Under overload it's better to answer some requests than be late for all of them.
+Dropped A2S_INFO hides server from browsers, but dropped A2S_RULES (usually several fragments) barely matters.
+So requests are refused progressively by level of overload:
+
+1. A2S_RULES
+2. A2S_PLAYERS too
+3. A2S_INFO without valid challenge too (challenge responses not sent)
+
+Overload is detected by event loop lag (how late sleeping coroutine is woken up)
+and fill of receive queue of listening socket (if requests are queued).
+"""
+import asyncio
+import collections
+import logging
+import typing
+
+from . import dispatch
+
+logger = logging.getLogger('sqproxy.overload')
+
+LEVEL_NONE = 0
+LEVEL_RULES = 1
+LEVEL_PLAYERS = 2
+LEVEL_INFO = 3
+
+#: kind of request -> level since which it's refused
+SHED_LEVELS = {
+    dispatch.A2S_RULES: LEVEL_RULES,
+    dispatch.A2S_PLAYERS: LEVEL_PLAYERS,
+    dispatch.A2S_INFO: LEVEL_INFO,
+}
+
+DEFAULT_LAG_THRESHOLDS = (0.05, 0.1, 0.25)  # seconds
+DEFAULT_QUEUE_THRESHOLDS = (0.5, 0.75, 0.9)  # fill of queue
+DEFAULT_CHECK_INTERVAL = 0.05  # seconds
+LAG_DECAY = 0.2  # weight of new measurement when lag decreases
+
+
+def _get_level(value: float, thresholds: typing.Sequence[float]) -> int:
+    level = LEVEL_NONE
+    for threshold in thresholds:
+        if value < threshold:
+            break
+        level += 1
+    return level
+
+
+class LoadShedder:
+    def __init__(
+        self,
+        lag_thresholds: typing.Sequence[float] = DEFAULT_LAG_THRESHOLDS,
+        queue_thresholds: typing.Sequence[float] = DEFAULT_QUEUE_THRESHOLDS,
+        name: str = '',
+    ):
+        """
+        :param lag_thresholds: event loop lag (seconds) of levels 1, 2 and 3
+        :param queue_thresholds: fill of receive queue (0..1) of levels 1, 2 and 3
+        """
+        self.lag_thresholds = lag_thresholds
+        self.queue_thresholds = queue_thresholds
+        self.name = name
+        self.queue_fill: typing.Optional[typing.Callable[[], float]] = None  # set by listener
+        self.level = LEVEL_NONE
+        self.stats = collections.Counter()  # kind of request -> refused
+
+    def update(self, lag: float):
+        level = _get_level(lag, self.lag_thresholds)
+        if self.queue_fill is not None:
+            level = max(level, _get_level(self.queue_fill(), self.queue_thresholds))
+
+        if level != self.level:
+            log = logger.warning if level > self.level else logger.info
+            log('%s: overload level %s -> %s (loop lag %.3fs)', self.name, self.level, level, lag)
+            self.level = level
+
+    def should_shed(self, kind: str) -> bool:
+        """Check and count refused request, it's called only when `level` is not LEVEL_NONE"""
+        if self.level >= SHED_LEVELS[kind]:
+            self.stats[kind] += 1
+            return True
+        return False
+
+
+class LoopLagMonitor:
+    """Measure event loop lag and update levels of `LoadShedder`s
+
+    Lag goes up immediately and decays smoothly, so level doesn't flap on every measurement.
+    """
+
+    def __init__(self, interval: float = DEFAULT_CHECK_INTERVAL):
+        self.interval = interval
+        self.lag = 0.0
+        self.shedders: typing.List[LoadShedder] = []
+
+    def add(self, shedder: LoadShedder):
+        self.shedders.append(shedder)
+
+    def measured(self, lag: float):
+        if lag > self.lag:
+            self.lag = lag
+        else:
+            self.lag += (lag - self.lag) * LAG_DECAY
+
+        for shedder in self.shedders:
+            shedder.update(self.lag)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.measured(max(loop.time() - start - self.interval, 0.0))
@@ -0,0 +1,181 @@
+"""Polling of all game servers through single UDP socket
+
+Without it every `QueryProxy` opens own socket to it's game server,
+so host with hundreds of servers holds (and churns) hundreds of sockets and ephemeral ports.
+
+`BackendPoller` owns one unconnected socket, replies are demultiplexed by source address and response type
+to subscribed `BackendChannel`. Split packets are reassembled per source address.
+
+The socket can receive datagrams from anybody: datagrams of unknown sources are dropped before decoding,
+broken ones are counted and skipped, so single datagram can't stop polling of all servers.
+"""
+import asyncio
+import collections
+import ipaddress
+import logging
+import typing
+
+from .source import messages
+from .transport import SourceDatagramClient
+from .transport import bind
+
+logger = logging.getLogger('sqproxy.poller')
+
+Address = typing.Tuple[str, int]
+
+READER_RESTART_DELAY = 1  # seconds
+
+
+def normalize_addr(addr: Address) -> Address:
+    """Address as it seen in replies: request to unspecified address (0.0.0.0) answered from loopback"""
+    host, port = addr
+    ip = ipaddress.ip_address(host)
+    if ip.is_unspecified:
+        ip = ipaddress.ip_address('::1' if ip.version == 6 else '127.0.0.1')
+    return str(ip), port
+
+
+class BackendChannel:
+    """Poller endpoint for responses of single type from single game server
+
+    Quacks like connected `SourceDatagramClient` (`send_packet()`, `recv_packet()`),
+    so it can be passed to `QueryProxy.send_recv_packet()`
+    """
+
+    def __init__(self, poller: 'BackendPoller', addr: Address, response_cls: typing.Type[messages.Packet]):
+        self.poller = poller
+        self.addr = addr
+        self.response_cls = response_cls
+        self.pending = False  # request sent, response not received yet
+        self._recvq = asyncio.Queue()
+
+    @property
+    def sockname(self):
+        return self.poller.sockname
+
+    def deliver(self, message: messages.Packet, data: bytes, addr: Address):
+        self._recvq.put_nowait((message, data, addr))
+
+    async def send_packet(self, packet: bytes):
+        # late responses to previous (timed out) requests
+        while not self._recvq.empty():
+            self._recvq.get_nowait()
+
+        self.pending = True
+        await self.poller.send_packet(packet, self.addr)
+
+    async def recv_packet(self):
+        message, data, addr = await self._recvq.get()
+        if not isinstance(message, messages.GetChallengeResponse):
+            self.pending = False
+        return message, data, addr
+
+    def close(self):
+        self.poller.unsubscribe(self)
+
+
+class BackendPoller:
+    def __init__(self, local_addr: Address = ('0.0.0.0', 0)):
+        self.local_addr = local_addr
+        self.stream: typing.Optional[SourceDatagramClient] = None
+        # game server address -> {response type: channels}, several proxies can poll the same game server
+        self._channels: typing.Dict[Address, typing.Dict[type, typing.List[BackendChannel]]] = {}
+        self._reader = None
+        self.stats = collections.Counter()  # sent, received, dropped, broken, reader_errors
+
+    @property
+    def sockname(self):
+        return self.stream.sockname
+
+    async def start(self):
+        if self.stream is not None:
+            return
+
+        self.stream = await bind(self.local_addr, cls=SourceDatagramClient)
+        self._reader = asyncio.ensure_future(self._read())
+        logger.info('Poll game servers from %s', self.sockname)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def subscribe(self, addr: Address, response_cls: typing.Type[messages.Packet]) -> BackendChannel:
+        addr = normalize_addr(addr)
+        channel = BackendChannel(self, addr, response_cls)
+        self._channels.setdefault(addr, {}).setdefault(response_cls, []).append(channel)
+        return channel
+
+    def unsubscribe(self, channel: BackendChannel):
+        channels = self._channels.get(channel.addr)
+        subscribed = channels.get(channel.response_cls) if channels else None
+        if not subscribed or channel not in subscribed:
+            return
+
+        subscribed.remove(channel)
+        if not subscribed:
+            del channels[channel.response_cls]
+        if not channels:
+            del self._channels[channel.addr]
+
+    async def send_packet(self, packet: bytes, addr: Address):
+        assert self.stream is not None, 'Poller is not started'
+        await self.stream.send_packet(packet, addr)
+        self.stats['sent'] += 1
+
+    async def _read(self):
+        while True:
+            try:
+                await self._read_forever()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.stats['reader_errors'] += 1
+                logger.exception('Reading of game server responses failed, restart in %ss', READER_RESTART_DELAY)
+                await asyncio.sleep(READER_RESTART_DELAY)
+
+    async def _read_forever(self):
+        stream = self.stream
+        while True:
+            data, addr = await stream.recv()
+            if addr not in self._channels:
+                # not decoded, fragments of unknown sources don't take place in reassembler
+                self.stats['dropped'] += 1
+                continue
+
+            try:
+                packet = await stream.handle_fragments_async(data, addr)
+                if packet is None:
+                    # not all fragments received yet
+                    continue
+                message = stream.decode_response(packet)
+            except messages.BrokenMessageError:
+                self.stats['broken'] += 1
+                logger.debug('Drop broken packet from %s: %r', addr, data[:32])
+                continue
+
+            self.stats['received'] += 1
+            self.dispatch(message, packet, addr)
+
+    def dispatch(self, message: typing.Optional[messages.Packet], data: bytes, addr: Address):
+        channels = self._channels.get(addr)
+        if message is None or not channels:
+            self.stats['dropped'] += 1
+            logger.debug('Drop unexpected packet from %s: %r', addr, data[:32])
+            return
+
+        if isinstance(message, messages.GetChallengeResponse):
+            # challenge number is the same for all request types
+            targets = [channel for subscribed in channels.values() for channel in subscribed if channel.pending]
+        else:
+            targets = channels.get(type(message), [])
+
+        if not targets:
+            self.stats['dropped'] += 1
+            return
+
+        for channel in targets:
+            channel.deliver(message, data, addr)
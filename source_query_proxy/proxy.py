@@ -3,21 +3,52 @@ import collections
 import functools
 import logging
 import random
+import struct
 import time
 import typing
 
 import async_timeout
 import backoff
 
+from . import acl
 from . import config
+from . import dispatch
+from .challenge import ChallengeIssuer
+from .heavyhitters import HeavyHitterDetector
+from .ratelimit import RateLimiter
 from .source import messages
+from .transport import FRAGMENT_MAX_SIZE
+from .transport import BrokenPacketError
+from .transport import SourceDatagramServer
 from .transport import bind
+from .transport import bind_answering
 from .transport import connect
+from .transport import decode_packet
+from .transport import split_compressed_packet
+from .transport import split_packet
 
 MAX_SIZE_32 = 2 ** 31 - 1
 
 NO_RESPONSE = object()
 
+SHARED_STATE_SYNC_INTERVAL = 0.5
+
+_REQUEST_KINDS = {
+    messages.InfoRequest: dispatch.A2S_INFO,
+    messages.InfoRequestV2: dispatch.A2S_INFO,
+    messages.PlayersRequest: dispatch.A2S_PLAYERS,
+    messages.RulesRequest: dispatch.A2S_RULES,
+}
+
+# key -> polling loop, subclasses can override it
+_UPDATE_LOOPS = {
+    dispatch.A2S_INFO: '_update_info',
+    dispatch.A2S_PLAYERS: '_update_players',
+    dispatch.A2S_RULES: '_update_rules',
+}
+
+_CHALLENGE_RESPONSE_PREFIX = messages.GetChallengeResponse(challenge=0).encode()[: -dispatch.CHALLENGE_SIZE]
+
 retry_ConnError = backoff.on_exception(  # noqa: ignore=N816
     backoff.constant,
     ConnectionRefusedError,
@@ -105,6 +136,7 @@ class QueryProxy:
     A2S_EMPTY_CHALLENGE = -1
     connect = functools.partial(connect)
     bind = functools.partial(bind)
+    bind_answering = functools.partial(bind_answering)
 
     def __init__(self, settings: config.ServerModel, name: str = None):
         listen_addr = (str(settings.network.bind_ip), settings.network.bind_port)
@@ -113,11 +145,48 @@ class QueryProxy:
         if name is None:
             name = '%s:%s' % listen_addr
 
+        self.name = name
         self.listen_addr = listen_addr
         self.server_addr = server_addr
         self.resp_cache = {}
+        self.cache_updated = {}  # key -> time.monotonic() of the last stored response
         self.our_a2s_challenge = random.randint(1, MAX_SIZE_32)
+        # requests can be classified without decoding only if nobody overrides how we respond
+        self._fast_dispatch = type(self).get_response_for is QueryProxy.get_response_for
+        # overridden polling loops keep running instead of polls by scheduler
+        self._custom_update_loops = {
+            key for key, name in _UPDATE_LOOPS.items() if getattr(type(self), name) is not getattr(QueryProxy, name)
+        }
         self.settings = settings
+        # stateless per-client challenges, `our_a2s_challenge` is used if client address is unknown
+        self.challenges = ChallengeIssuer(lifetime=settings.a2s_challenge_lifetime)
+        self.rate_limiter = None
+        if settings.client_rate_limit:
+            self.rate_limiter = RateLimiter(
+                rate=settings.client_rate_limit,
+                burst=settings.client_rate_burst,
+                aggregate_subnet=settings.client_rate_limit_subnet,
+            )
+        self.heavy_hitters = None
+        if settings.heavy_hitter_threshold:
+            self.heavy_hitters = HeavyHitterDetector(
+                threshold=settings.heavy_hitter_threshold,
+                window=settings.heavy_hitter_window,
+                ban_time=settings.heavy_hitter_ban_time,
+            )
+        # `acl.AccessListSource` of this server and shared by all servers
+        self.acl = None
+        if settings.acl is not None:
+            self.acl = acl.AccessListSource.from_model(settings.acl)
+        self.global_acl = None
+        # dropped client requests: offline, denied, banned, rate_limited, broken, malformed, unknown
+        self.client_stats = collections.Counter()
+        # sent responses: answered, bytes (payload, before split into fragments)
+        self.response_stats = collections.Counter()
+        # dropped by listening socket: dropped (receive queue is full) or broken, send_paused (answered in protocol)
+        self.recv_stats = collections.Counter()
+        self.listener = None  # `transport.FragmentsMixin` receiving client requests
+        self.shedder = None  # `overload.LoadShedder`
         self.logger = logging.getLogger(name)
         self._okfail = LastOkFailCounter(
             fails_threshold=self.settings.max_a2s_fails_before_offline,
@@ -126,13 +195,186 @@ class QueryProxy:
         )
         self.online = False  # True - answer to client requests, False - ignore it
 
+        # Game server polling: one socket and challenge number for all kinds of requests
+        self.poller = None  # `poller.BackendPoller`, socket shared with other proxies
+        self._upstream = None
+        self._upstream_channels = {}  # response type -> `poller.BackendChannel`
+        self._upstream_lock = asyncio.Lock()
+        self._upstream_challenge = None
+        self._info_challenge_required = False
+        self.upstream_stats = collections.Counter()
+        self.scheduler = None  # `scheduler.PollScheduler`, polls run by it instead of own tasks
+        self._poll_jobs = {}  # key -> `scheduler.PollJob`
+        self._poll_wakeups = {}  # key -> asyncio.Event, wake own polling loop
+
+        # Adaptive polling: poll rarely while nobody asks
+        self.demand = collections.Counter()  # key -> count of client requests
+        self._demand_seen = {}  # key -> demand at the last poll
+        self._demand_reported = collections.Counter()  # key -> local demand already added to shared cache
+        self._idle_polls = collections.Counter()  # key -> polls in a row without demand
+        self._stretched = set()  # keys polled with stretched interval
+
+        # Change-aware polling: A2S_INFO fields which trigger poll of other data
+        self._info_state = None  # (player_count, bot_count, map)
+
+        # (response, fragments) of last large responses, found by identity
+        self._split_responses = collections.deque(maxlen=len(dispatch.KINDS) + 1)
+
+        # Multi-worker mode (see `workers` module)
+        self.polling = True  # False - don't poll game server, responses delivered by polling worker
+        self.shared_cache = None  # `shm.SharedResponseCache`, responses shared between workers
+        self.reuse_port = False  # share listening port with other workers
+
+    @property
+    def our_a2s_challenge(self) -> int:
+        return self._our_a2s_challenge
+
+    @our_a2s_challenge.setter
+    def our_a2s_challenge(self, value: int):
+        self._our_a2s_challenge = value
+        # prebuilt values for answering without decoding
+        self._our_a2s_challenge_raw = struct.pack('<l', value)
+        self._our_a2s_challenge_response = messages.GetChallengeResponse(challenge=value).encode()
+
+    def challenge_for(self, host: str) -> int:
+        """Challenge number which client from `host` should send"""
+        if not self.settings.a2s_per_client_challenge:
+            return self.our_a2s_challenge
+        return struct.unpack('<l', self.challenges.issue(host))[0]
+
     def _on_online(self):
         self.logger.info('Server UP now')
         self.online = True
+        if self.shared_cache is not None:
+            self.shared_cache.online = self.online
 
     def _on_offline(self):
         self.logger.warning('Server DOWN. Checking continued...')
         self.online = False
+        if self.shared_cache is not None:
+            self.shared_cache.online = self.online
+
+    def _store_response(self, key: str, data: bytes):
+        self.resp_cache[key] = data
+        self.cache_updated[key] = time.monotonic()
+        if self.shared_cache is not None:
+            self.shared_cache[key] = data
+        if len(data) > FRAGMENT_MAX_SIZE:
+            self._split_responses.append((data, self._split(data)))
+
+    def get_fragments(self, response) -> typing.Tuple[bytes, ...]:
+        """Ready to send fragments of large response
+
+        Responses are split once: on store (or first send, if response is not stored by us),
+        new message id for each version of response.
+        """
+        for split_response, fragments in self._split_responses:
+            if split_response is response:
+                return fragments
+
+        fragments = self._split(response)
+        self._split_responses.append((response, fragments))
+        return fragments
+
+    def _split(self, response) -> typing.Tuple[bytes, ...]:
+        fragments = split_packet(response)
+        if self.settings.compress_responses and len(response) > self.settings.compress_responses_threshold:
+            compressed = split_compressed_packet(response)
+            # random-like data may not shrink, send plain then
+            if len(compressed) < len(fragments):
+                fragments = compressed
+        return fragments
+
+    def use_shared_cache(self, shared_cache):
+        """Share responses with other workers
+
+        Polling proxy writes responses to `shared_cache`,
+        non-polling proxy answers from it
+        """
+        self.shared_cache = shared_cache
+        if not self.polling:
+            self.resp_cache = shared_cache
+
+    async def _sync_shared_state(self):
+        """Follow online state of polling worker and report client requests to it"""
+        while True:
+            self.online = self.shared_cache.online
+            for key, count in self.demand.items():
+                reported = self._demand_reported[key]
+                if count != reported:
+                    self.shared_cache.add_demand(key, count - reported)
+                    self._demand_reported[key] = count
+            await asyncio.sleep(SHARED_STATE_SYNC_INTERVAL)
+
+    async def _follow_shared_demand(self):
+        """Restore poll interval of polling worker when other workers got requests"""
+        while True:
+            for key in list(self._stretched):
+                if self._get_demand(key) != self._demand_seen.get(key):
+                    self._on_demand_returned(key)
+            await asyncio.sleep(SHARED_STATE_SYNC_INTERVAL)
+
+    def _get_demand(self, key: str) -> int:
+        demand = self.demand[key]
+        if self.shared_cache is not None:
+            demand += self.shared_cache.get_demand(key)
+        return demand
+
+    def get_poll_interval(self, key: str) -> float:
+        """Delay before next poll, should be called once after each poll
+
+        With adaptive polling interval stretched while nobody asks `key`
+        (doubled each poll up to `a2s_idle_cache_lifetime`)
+        """
+        settings = self.settings
+        lifetime = getattr(settings, f'{key}_cache_lifetime')
+        if settings.change_aware_polling and key != dispatch.A2S_INFO:
+            # changes are polled on demand of A2S_INFO, this is a safety net
+            lifetime = max(lifetime, settings.a2s_unchanged_cache_lifetime)
+
+        if not settings.adaptive_polling:
+            return lifetime
+
+        demand = self._get_demand(key)
+        if demand != self._demand_seen.get(key):
+            self._demand_seen[key] = demand
+            self._idle_polls[key] = 0
+            self._stretched.discard(key)
+            return lifetime
+
+        self._idle_polls[key] += 1
+        max_lifetime = max(lifetime, settings.a2s_idle_cache_lifetime)
+        interval = min(max_lifetime, lifetime * 2 ** min(self._idle_polls[key], 32))
+        if interval > lifetime:
+            self._stretched.add(key)
+        return interval
+
+    def _on_demand_returned(self, key: str):
+        self._stretched.discard(key)
+        self._idle_polls[key] = 0
+        self.poll_soon(key)
+
+    def poll_soon(self, key: str):
+        """Poll `key` now instead of planned time"""
+        job = self._poll_jobs.get(key)
+        if job is not None:
+            self.scheduler.reschedule(job)
+            return
+
+        wakeup = self._poll_wakeups.get(key)
+        if wakeup is not None:
+            wakeup.set()
+
+    async def _wait_next_poll(self, key: str):
+        wakeup = self._poll_wakeups.get(key)
+        if wakeup is None:
+            wakeup = self._poll_wakeups[key] = asyncio.Event()
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), self.get_poll_interval(key))
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
 
     # noinspection PyPep8Naming
     @property
@@ -147,47 +389,176 @@ class QueryProxy:
         )
 
     async def _listen_client_requests(self):
+        if self.settings.answer_in_protocol:
+            await self._answer_client_requests()
+            return
+
         self.logger.info('Binding (%s) ... ', self.listen_addr)
-        async with (await self.bind(self.listen_addr)) as listening:
+        listening = await self.bind(
+            self.listen_addr,
+            batched=self.settings.batched_udp_io,
+            reuse_port=self.reuse_port,
+            recv_queue_size=self.settings.recv_queue_size,
+            recv_queue_policy=self.settings.recv_queue_drop,
+        )
+        self.recv_stats = listening.recv_stats
+        self.listener = listening
+        if self.shedder is not None:
+            self.shedder.queue_fill = listening.recv_queue_fill
+        async with listening:
             self.logger.info('Binding (%s) ... done!', self.listen_addr)
             self.logger.info('Listen for client requests on %s ...', self.listen_addr)
             while True:
-                request, data, addr = await listening.recv_packet()
-                if request is None:
+                try:
+                    data, addr = await listening.recv_raw_packet()
+                except BrokenPacketError as exc:
+                    self.client_stats['broken'] += 1
                     self.logger.warning(
                         'Packet ignored. Broken data was received: data[:150]=%s',
-                        data[:150],
+                        exc.raw_data[:150],
                     )
                     continue
 
-                if addr[1] == 0:
-                    # FIXME: https://github.com/MagicStack/uvloop/issues/338
+                response = self.handle_request(data, addr)
+                if response is None:
                     continue
 
-                if not self.online:
-                    continue
+                if len(response) > FRAGMENT_MAX_SIZE:
+                    await listening.send_fragments(self.get_fragments(response), addr=addr)
+                else:
+                    await listening.send_packet(response, addr=addr)
+                response_stats = self.response_stats
+                response_stats['answered'] += 1
+                response_stats['bytes'] += len(response)
 
-                response = self.get_response_for(request, None)
-                if response is None:
-                    self.logger.warning('No response for %s', request)
-                    continue
-                if response is NO_RESPONSE:
-                    continue
+    async def _answer_client_requests(self):
+        """Answer client requests right in datagram protocol, without queue and task per request"""
+        self.logger.info('Binding (%s) ... ', self.listen_addr)
+        transport, protocol = await self.bind_answering(
+            self.listen_addr,
+            self.handle_request,
+            split=self.get_fragments,
+            sent_stats=self.response_stats,
+            batched=self.settings.batched_udp_io,
+            reuse_port=self.reuse_port,
+        )
+        self.recv_stats = protocol.stats
+        self.listener = protocol
+        try:
+            self.logger.info('Binding (%s) ... done!', self.listen_addr)
+            self.logger.info('Listen for client requests on %s ...', self.listen_addr)
+            await protocol.closed
+        finally:
+            transport.close()
 
-                await listening.send_packet(response, addr=addr)
+    def handle_request(self, data: bytes, addr) -> typing.Optional[bytes]:
+        """Response for client request, it's called for every received datagram
 
-    def get_tasks(self):
+        :return: None if request should not be answered
+        """
+        if addr[1] == 0:
+            # FIXME: https://github.com/MagicStack/uvloop/issues/338
+            return None
+
+        if not self.online:
+            self.client_stats['offline'] += 1
+            return None
+
+        host = addr[0]
+        verdict = self._check_acl(host)
+        if verdict is acl.DENY:
+            self.client_stats['denied'] += 1
+            return None
+
+        if verdict is not acl.ALLOW:
+            if self.heavy_hitters is not None and self.heavy_hitters.add(host):
+                self.client_stats['banned'] += 1
+                return None
+
+            if self.rate_limiter is not None and not self.rate_limiter.allow(host):
+                self.client_stats['rate_limited'] += 1
+                return None
+
+        response = self.get_response_for_data(data, addr)
+        if response is None:
+            self.client_stats['unknown'] += 1
+            self.logger.warning('No response for %s', data[:150])
+            return None
+        if response is NO_RESPONSE:
+            return None
+        return response
+
+    def _check_acl(self, host: str) -> typing.Optional[bool]:
+        """Check client in access lists, server's list has priority over the global one
+
+        :return: `acl.ALLOW`, `acl.DENY` or None if not listed
+        """
+        if self.acl is None and self.global_acl is None:
+            return None
+
+        ip = acl.ip_to_int(host)
+        for source in (self.acl, self.global_acl):
+            if source is not None:
+                verdict = source.current.check(ip)
+                if verdict is not None:
+                    return verdict
+        return None
+
+    def use_load_shedder(self, shedder):
+        """Refuse requests by priority under overload, `shedder` is `overload.LoadShedder`"""
+        self.shedder = shedder
+        shedder.name = self.name
+
+    def use_scheduler(self, scheduler):
+        """Poll game server by shared (running) `scheduler.PollScheduler`"""
+        self.scheduler = scheduler
+
+    def get_poll_funcs(self):
+        """Functions to poll game server: [(key, poll once)]"""
         funcs = [
-            self._listen_client_requests,
-            self._update_info,
-            self._update_players,
+            ('a2s_info', self._poll_info),
+            ('a2s_players', self._poll_players),
         ]
         if not self.settings.no_a2s_rules:
-            funcs.append(self._update_rules)
+            funcs.append(('a2s_rules', self._poll_rules))
+        return funcs
+
+    def _schedule_polls(self):
+        for key, poll in self.get_poll_funcs():
+            if key in self._custom_update_loops:
+                continue
+            interval = functools.partial(self.get_poll_interval, key)
+            # polls of one game server wait each other on `_upstream_lock`, don't hold slots of scheduler for it
+            self._poll_jobs[key] = self.scheduler.add(f'{self.name}:{key}', poll, interval, group=self)
+
+    def _unschedule_polls(self):
+        for job in self._poll_jobs.values():
+            self.scheduler.remove(job)
+        self._poll_jobs.clear()
+
+    def get_tasks(self):
+        funcs = [self._listen_client_requests]
+        if self.polling and self.scheduler is not None:
+            self._schedule_polls()
+            funcs += [
+                getattr(self, _UPDATE_LOOPS[key]) for key, _ in self.get_poll_funcs() if key in self._custom_update_loops
+            ]
+        elif self.polling:
+            funcs += [self._update_info, self._update_players]
+            if not self.settings.no_a2s_rules:
+                funcs.append(self._update_rules)
+        elif self.shared_cache is not None:
+            funcs.append(self._sync_shared_state)
+
+        if self.polling and self.shared_cache is not None and self.settings.adaptive_polling:
+            funcs.append(self._follow_shared_demand)
+
+        if self.acl is not None and self.acl.reloadable:
+            funcs.append(self.acl.run)
 
         return [asyncio.create_task(self.retry_AnyError(func)()) for func in funcs]
 
-    async def send_recv_packet(self, client, packet: messages.Packet, timeout=None):
+    async def send_recv_packet(self, client, packet: messages.Packet, timeout=None, expect=None):
         """Send packet and wait for response for it
 
         In addition to call client.[send_packet(), recv_packet()] this method handle
@@ -197,6 +568,8 @@ class QueryProxy:
         :param packet: any `messages.Packet` instance to send to
         :param timeout: how much wait response
             trigger asyncio.TimeoutError on exceeded
+        :param expect: `messages.Packet` class (or tuple) of wanted response,
+            any other responses (e.g. late response to previous request) will be skipped
         :return: tuple (message, data, addr, new_challenge)
             `new_challenge` will be None if not present
         """
@@ -208,11 +581,16 @@ class QueryProxy:
                 await client.send_packet(packet.encode(challenge=a2s_challenge))
             else:
                 await client.send_packet(packet.encode())
+            self.upstream_stats['round_trips'] += 1
 
             start = time.monotonic()
             with async_timeout.timeout(timeout):
-                message, data, addr = await client.recv_packet()
-                self.logger.debug('Got %s for %ss', message.__class__.__name__, time.monotonic() - start)
+                while True:
+                    message, data, addr = await client.recv_packet()
+                    self.logger.debug('Got %s for %ss', message.__class__.__name__, time.monotonic() - start)
+                    if expect is None or isinstance(message, (messages.GetChallengeResponse, expect)):
+                        break
+                    self.upstream_stats['unexpected_responses'] += 1
 
             if isinstance(message, messages.GetChallengeResponse):
                 if old_challenge not in (self.A2S_EMPTY_CHALLENGE, None):
@@ -224,137 +602,272 @@ class QueryProxy:
 
                 old_challenge = a2s_challenge
                 a2s_challenge = message['challenge']
+                self.upstream_stats['challenge_requests'] += 1
                 continue
 
             break
 
         return message, data, addr, a2s_challenge
 
-    @retry_ConnError
-    async def _update_info(self):
-        logger = self.logger.getChild('update-info')
-        request = messages.InfoRequestV2()
+    def use_poller(self, poller):
+        """Send requests to game server through shared (started) `poller.BackendPoller`"""
+        self._close_upstream()
+        self.poller = poller
 
-        while True:
-            async with (await connect(self.server_addr)) as client:
-                logger.debug('Send request to %s (client port=%s)', self.server_addr, client.sockname[1])
+    async def _get_upstream(self, expect):
+        """Long-lived socket connected to game server or channel of shared poller"""
+        if self.poller is not None:
+            channel = self._upstream_channels.get(expect)
+            if channel is None:
+                channel = self._upstream_channels[expect] = self.poller.subscribe(self.server_addr, expect)
+            return channel
 
-                try:
-                    message, data, addr, a2s_challenge = await self.send_recv_packet(
-                        client,
-                        request,
-                        timeout=max(
-                            self.settings.a2s_response_timeout,
-                            self.settings.a2s_info_cache_lifetime,
-                        ),
-                    )
-                except asyncio.TimeoutError:
-                    self._okfail.fail()
-                else:
-                    self._okfail.ok()
-                    self.resp_cache['a2s_info'] = data
+        if self._upstream is None:
+            self._upstream = await connect(self.server_addr)
+            self.upstream_stats['sockets_opened'] += 1
+        return self._upstream
 
-            await asyncio.sleep(self.settings.a2s_info_cache_lifetime)
+    def _close_upstream(self):
+        if self._upstream is not None:
+            self._upstream.close()
+            self._upstream = None
 
-    @retry_ConnError
-    async def _update_rules(self):
-        logger = self.logger.getChild('update-rules')
+        for channel in self._upstream_channels.values():
+            channel.close()
+        self._upstream_channels.clear()
 
-        while True:
-            async with (await connect(self.server_addr)) as client:
-                logger.debug('Sent request to %s (client port=%s)', self.server_addr, client.sockname[1])
+    async def _poll(self, key: str, request: messages.Packet, expect, lifetime: float):
+        """Query game server once and store response to cache
 
-                request = messages.RulesRequest(challenge=self.A2S_EMPTY_CHALLENGE)
+        Last known challenge is reused, so usually one round trip per poll is enough
 
-                try:
-                    message, data, addr, a2s_challenge = await self.send_recv_packet(
-                        client,
-                        request,
-                        timeout=max(
-                            self.settings.a2s_response_timeout,
-                            self.settings.a2s_rules_cache_lifetime,
-                        ),
-                    )
-                except asyncio.TimeoutError:
-                    self._okfail.fail()
-                else:
-                    self._okfail.ok()
-                    self.resp_cache['a2s_rules'] = data
+        :return: tuple (message, challenge), message is None on timeout
+        """
+        async with self._upstream_lock:
+            client = await self._get_upstream(expect)
+            self.logger.debug('Send %s request to %s (client port=%s)', key, self.server_addr, client.sockname[1])
+
+            if self._upstream_challenge is not None and 'challenge' in request:
+                request['challenge'] = self._upstream_challenge
+
+            try:
+                message, data, addr, a2s_challenge = await self.send_recv_packet(
+                    client,
+                    request,
+                    timeout=max(self.settings.a2s_response_timeout, lifetime),
+                    expect=expect,
+                )
+            except asyncio.TimeoutError:
+                self.upstream_stats['poll_timeouts'] += 1
+                self._okfail.fail()
+                return None, None
+            except ConnectionRefusedError:
+                self._close_upstream()
+                raise
+
+            self.upstream_stats['polls'] += 1
+            if a2s_challenge is not None and a2s_challenge != self.A2S_EMPTY_CHALLENGE:
+                if a2s_challenge == request.get('challenge'):
+                    # known challenge accepted, challenge request not needed
+                    self.upstream_stats['round_trips_saved'] += 1
+                self._upstream_challenge = a2s_challenge
+
+            self._okfail.ok()
+            self._store_response(key, data)
+            return message, a2s_challenge
+
+    async def _poll_info(self):
+        request = messages.InfoRequestV2()
+        if self._info_challenge_required:
+            request['challenge'] = self.A2S_EMPTY_CHALLENGE
+
+        message, a2s_challenge = await self._poll(
+            'a2s_info',
+            request,
+            expect=messages.InfoResponse,
+            lifetime=self.settings.a2s_info_cache_lifetime,
+        )
+        if a2s_challenge is not None:
+            # server requires challenge for A2S_INFO, so send known one with every request
+            self._info_challenge_required = True
+
+        if message is not None and self.settings.change_aware_polling:
+            self._check_info_changes(message)
+        return message
+
+    def _check_info_changes(self, message: messages.InfoResponse):
+        """Poll players and rules right now if A2S_INFO says they are changed"""
+        state = message['player_count'], message['bot_count'], message['map']
+        old_state, self._info_state = self._info_state, state
+        if old_state is None:
+            return
 
-            await asyncio.sleep(self.settings.a2s_rules_cache_lifetime)
+        if state[:2] != old_state[:2]:
+            self.upstream_stats['change_triggered_polls'] += 1
+            self.poll_soon(dispatch.A2S_PLAYERS)
+        if state[2] != old_state[2] and not self.settings.no_a2s_rules:
+            self.upstream_stats['change_triggered_polls'] += 1
+            self.poll_soon(dispatch.A2S_RULES)
+
+    async def _poll_players(self):
+        message, _ = await self._poll(
+            'a2s_players',
+            messages.PlayersRequest(challenge=self.A2S_EMPTY_CHALLENGE),
+            expect=messages.PlayersResponse,
+            lifetime=self.settings.a2s_players_cache_lifetime,
+        )
+        return message
+
+    async def _poll_rules(self):
+        message, _ = await self._poll(
+            'a2s_rules',
+            messages.RulesRequest(challenge=self.A2S_EMPTY_CHALLENGE),
+            expect=messages.RulesResponse,
+            lifetime=self.settings.a2s_rules_cache_lifetime,
+        )
+        return message
 
     @retry_ConnError
-    async def _update_players(self):
-        logger = self.logger.getChild('update-players')
+    async def _update_info(self):
+        while True:
+            await self._poll_info()
+            await self._wait_next_poll('a2s_info')
 
+    @retry_ConnError
+    async def _update_rules(self):
         while True:
-            async with (await connect(self.server_addr)) as client:
-                logger.debug('Send request to %s (client port=%s)', self.server_addr, client.sockname[1])
+            await self._poll_rules()
+            await self._wait_next_poll('a2s_rules')
 
-                request = messages.PlayersRequest(challenge=self.A2S_EMPTY_CHALLENGE)
-                try:
-                    message, data, addr, a2s_challenge = await self.send_recv_packet(
-                        client,
-                        request,
-                        timeout=max(
-                            self.settings.a2s_response_timeout,
-                            self.settings.a2s_players_cache_lifetime,
-                        ),
-                    )
-                except asyncio.TimeoutError:
-                    self._okfail.fail()
-                else:
-                    self._okfail.ok()
-                    self.resp_cache['a2s_players'] = data
+    @retry_ConnError
+    async def _update_players(self):
+        while True:
+            await self._poll_players()
+            await self._wait_next_poll('a2s_players')
 
-            await asyncio.sleep(self.settings.a2s_players_cache_lifetime)
+    def get_response_for_data(self, data: bytes, addr=None) -> typing.Optional[bytes]:
+        """Get response for raw request data
 
-    def get_response_for(self, message, default) -> typing.Optional[bytes]:
-        resp = default
+        Known request layouts answered without decoding,
+        any other data decoded and passed to `get_response_for()`
 
-        if isinstance(message, messages.InfoRequest):
-            resp = self.resp_cache.get('a2s_info')
-        elif isinstance(message, (messages.PlayersRequest, messages.RulesRequest)):
-            challenge = message['challenge']
+        :param addr: client address, challenge is checked per client if known
+        """
+        request = None
+        if self._fast_dispatch:
+            request = dispatch.request_classifier.classify(data)
+
+        if request is None:
+            try:
+                message = decode_packet(data, msg_classes=SourceDatagramServer.request_message_classes)
+            except messages.BrokenMessageError:
+                message = None
+
+            if message is None:
+                self.client_stats['malformed'] += 1
+                self.logger.warning('Packet ignored. Broken data was received: data[:150]=%s', data[:150])
+                return NO_RESPONSE
+
+            kind = _REQUEST_KINDS.get(type(message))
+            if kind is not None:
+                self.demand[kind] += 1
+                if kind in self._stretched:
+                    self._on_demand_returned(kind)
+            if self._fast_dispatch:
+                return self.get_response_for(message, None, addr=addr)
+            # overridden `get_response_for()` may not accept client address
+            return self.get_response_for(message, None)
+
+        kind, challenge = request
+        self.demand[kind] += 1
+        if kind in self._stretched:
+            self._on_demand_returned(kind)
+
+        return self._get_cached_response(kind, challenge, addr)
+
+    def get_response_for(self, message, default, addr=None) -> typing.Optional[bytes]:
+        kind = _REQUEST_KINDS.get(type(message))
+        if kind is None:
+            return default
+
+        challenge = message.get('challenge')
+        if challenge is not None:
+            challenge = struct.pack('<l', challenge)
+        return self._get_cached_response(kind, challenge, addr)
+
+    def _get_cached_response(self, kind: str, challenge: typing.Optional[bytes], addr) -> typing.Optional[bytes]:
+        """Cached response if challenge is valid, otherwise challenge response
+
+        Under overload requests are refused by priority (see `overload` module)
+
+        :param challenge: raw (little-endian) challenge number, None for A2S_INFO without challenge
+        """
+        shedder = self.shedder
+        shedding = shedder is not None and shedder.level
+        if shedding and kind != dispatch.A2S_INFO and shedder.should_shed(kind):
+            return NO_RESPONSE
+
+        if kind == dispatch.A2S_INFO and not self.settings.a2s_info_challenge:
+            if shedding and shedder.should_shed(kind):
+                return NO_RESPONSE
+            return self.resp_cache.get(kind)
+
+        per_client = addr is not None and self.settings.a2s_per_client_challenge
+        if per_client:
+            valid = challenge is not None and self.challenges.verify(challenge, addr[0])
+        else:
+            valid = challenge == self._our_a2s_challenge_raw
+        if valid:
+            return self.resp_cache.get(kind)
 
-            if challenge == self.our_a2s_challenge:
-                if isinstance(message, messages.PlayersRequest):
-                    resp = self.resp_cache.get('a2s_players')
-                elif isinstance(message, messages.RulesRequest):
-                    resp = self.resp_cache.get('a2s_rules')
-            elif self.our_a2s_challenge != self.A2S_EMPTY_CHALLENGE:
-                # player request challenge number or we don't know who is it
-                # return challenge number
-                resp = messages.GetChallengeResponse(challenge=self.our_a2s_challenge).encode()
+        if shedding and shedder.should_shed(kind):
+            # A2S_INFO without valid challenge
+            return NO_RESPONSE
 
-        return resp
+        # client requests challenge number (or it's expired, or request is spoofed)
+        if per_client:
+            return _CHALLENGE_RESPONSE_PREFIX + self.challenges.issue(addr[0])
+        return self._our_a2s_challenge_response
 
     async def run(self):
         tasks = self.get_tasks()
-        done, pending = await asyncio.wait(
-            tasks,
-            return_when=asyncio.FIRST_COMPLETED,
-        )
+        try:
+            done, pending = await asyncio.wait(
+                tasks,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            self._unschedule_polls()
+
         for task in done:
             exc = task.exception() if not task.cancelled() else None
             self.logger.error('Task unexpectedly completed', exc_info=exc)  # noqa: ignore=G201
 
         for task in pending:
             task.cancel()
+        self._close_upstream()
 
     async def wait_ready(self):
         """Wait until all internals being ready to start"""
-        resp_cache = self.resp_cache = AwaitableDict(self.resp_cache)
-
-        coros = [
-            resp_cache.get_wait('a2s_info'),
-            resp_cache.get_wait('a2s_players'),
-        ]
+        keys = ['a2s_info', 'a2s_players']
         if not self.settings.no_a2s_rules:
-            coros.append(resp_cache.get_wait('a2s_rules'))
+            keys.append('a2s_rules')
 
         graceful_period = self.settings.wait_ready_graceful_period
 
+        if not self.polling:
+            # responses are written by polling worker, nothing to wrap
+            try:
+                with async_timeout.timeout(graceful_period):
+                    while not all(key in self.resp_cache for key in keys):
+                        await asyncio.sleep(SHARED_STATE_SYNC_INTERVAL)
+            except asyncio.TimeoutError:
+                self.logger.warning('Graceful period for wait ready exceeded. Skip waiting')
+            return
+
+        resp_cache = self.resp_cache = AwaitableDict(self.resp_cache)
+        coros = [resp_cache.get_wait(key) for key in keys]
+
         try:
             with async_timeout.timeout(graceful_period):
                 await asyncio.gather(*coros)
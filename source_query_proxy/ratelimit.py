@@ -0,0 +1,69 @@
+"""Per-source rate limiting of client requests with bounded memory
+
+Token bucket is kept as GCRA (generic cell rate algorithm): instead of tokens and
+last update time every bucket stores single "theoretical arrival time",
+request is allowed if it's not further than `burst` intervals ahead of now.
+
+Buckets are not stored per source: source is hashed to one bucket in each of the two
+fixed-size arrays (like count-min sketch), request is allowed only if both buckets allow it.
+Sources sharing one bucket share its budget, but it's unlikely that
+the other bucket of innocent source is shared with abusive one too.
+So memory is the same for a hundred and for millions of sources.
+"""
+import array
+import collections
+import time
+
+DEFAULT_TABLE_SIZE = 2 ** 16
+
+
+def subnet24(host: str) -> str:
+    """Key of /24 network of IPv4 `host`"""
+    return host.rpartition('.')[0]
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int, table_size: int = DEFAULT_TABLE_SIZE, aggregate_subnet: bool = False):
+        """
+        :param rate: allowed requests per second for single source
+        :param burst: how many requests can be sent at once after idle period
+        :param table_size: buckets per array, rounded up to power of 2
+        :param aggregate_subnet: True - limit /24 networks instead of single addresses
+        """
+        self.interval = 1 / rate
+        self.tolerance = self.interval * (burst - 1)
+        size = 1 << max(table_size - 1, 1).bit_length()
+        self._mask = size - 1
+        self._rows = (array.array('d', bytes(8 * size)), array.array('d', bytes(8 * size)))
+        self.aggregate_subnet = aggregate_subnet
+        self.stats = collections.Counter()  # allowed, dropped
+
+    def allow(self, host: str, now: float = None) -> bool:
+        """Check and count request of source `host`"""
+        if now is None:
+            now = time.monotonic()
+        if self.aggregate_subnet:
+            host = subnet24(host)
+
+        h = hash(host)
+        mask = self._mask
+        first, second = self._rows
+        index1 = h & mask
+        index2 = (h >> 32) & mask
+
+        tat1 = first[index1]
+        tat2 = second[index2]
+        if tat1 < now:
+            tat1 = now
+        if tat2 < now:
+            tat2 = now
+
+        limit = now + self.tolerance
+        if tat1 > limit or tat2 > limit:
+            self.stats['dropped'] += 1
+            return False
+
+        first[index1] = tat1 + self.interval
+        second[index2] = tat2 + self.interval
+        self.stats['allowed'] += 1
+        return True
@@ -0,0 +1,206 @@
+"""Single scheduler for polls of all game servers
+
+Instead of sleeping task per server and request type (thousands of timers on large hosts)
+all poll deadlines kept in one heap and only the nearest one has a timer.
+
+Deadlines spread by random jitter, so polls of servers with the same cache lifetime
+don't run in synchronized bursts. Amount of concurrently running polls is capped.
+
+Polls of the same group (e.g. of one game server, they share socket and lock) never run concurrently:
+due poll of busy group is deferred without taking a slot, so waiting polls can't starve other servers.
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import random
+import typing
+
+logger = logging.getLogger('sqproxy.scheduler')
+
+DEFAULT_JITTER = 0.1
+DEFAULT_MAX_IN_FLIGHT = 64
+LATE_POLL_THRESHOLD = 0.1  # seconds
+
+
+class PollJob:
+    def __init__(
+        self,
+        name: str,
+        poll: typing.Callable[[], typing.Awaitable],
+        interval: typing.Callable[[], float],
+        group: typing.Hashable = None,
+    ):
+        """
+        :param name: name for logs
+        :param poll: coroutine function which query game server once
+        :param interval: function which return delay (seconds) between end of poll and start of next one,
+            called once after each poll
+        :param group: jobs of the same group run one at a time, None - no restriction
+        """
+        self.name = name
+        self.poll = poll
+        self.interval = interval
+        self.group = group
+        self.deadline = None  # loop time of next poll, None - not scheduled (running, deferred or removed)
+        self.running = False  # running or deferred until other job of the group is done
+        self.removed = False
+
+    def __repr__(self):
+        return f'<PollJob {self.name} deadline={self.deadline}>'
+
+
+class PollScheduler:
+    def __init__(self, jitter: float = DEFAULT_JITTER, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        """
+        :param jitter: deviation of interval between polls, fraction of interval: 0.1 - ±10%
+        :param max_in_flight: how many polls can run concurrently, others wait in queue
+        """
+        self.jitter = jitter
+        self.max_in_flight = max_in_flight
+        self._heap = []  # (deadline, seq, job), stale entries (deadline != job.deadline) skipped
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._timer = None
+        self._running = set()
+        self._busy_groups = {}  # group of running job -> [(deferred job, deadline)]
+        self.in_flight = 0
+        self.stats = collections.Counter()  # polls, poll_errors, late_polls
+        self.lateness_total = 0.0
+        self.lateness_max = 0.0
+
+    @property
+    def _loop(self):
+        return asyncio.get_event_loop()
+
+    @property
+    def queue_depth(self) -> int:
+        """How many polls should be already started"""
+        now = self._loop.time()
+        due = sum(1 for deadline, _, job in self._heap if deadline <= now and deadline == job.deadline)
+        return due + sum(len(deferred) for deferred in self._busy_groups.values())
+
+    def add(self, name: str, poll, interval, delay: float = 0, group: typing.Hashable = None) -> PollJob:
+        job = PollJob(name, poll, interval, group=group)
+        self._schedule(job, delay)
+        return job
+
+    def reschedule(self, job: PollJob, delay: float = 0):
+        """Poll earlier than planned, no-op if poll is running or planned earlier"""
+        if job.removed or job.running:
+            return
+        if job.deadline is not None and job.deadline <= self._loop.time() + delay:
+            return
+        self._schedule(job, delay)
+
+    def remove(self, job: PollJob):
+        job.removed = True
+        job.deadline = None
+
+    def _schedule(self, job: PollJob, delay: float):
+        job.deadline = deadline = self._loop.time() + delay
+        heapq.heappush(self._heap, (deadline, next(self._seq), job))
+        if self._wakeup is not None and self._heap[0][2] is job:
+            self._wakeup.set()
+
+    def _next_delay(self, job: PollJob) -> float:
+        interval = job.interval()
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        loop = self._loop
+
+        try:
+            while True:
+                if self._heap:
+                    deadline, _, job = self._heap[0]
+                    if deadline != job.deadline:
+                        heapq.heappop(self._heap)
+                        continue
+
+                    if deadline > loop.time():
+                        self._timer = loop.call_at(deadline, self._wakeup.set)
+                        await self._wakeup.wait()
+                        self._wakeup.clear()
+                        self._timer.cancel()
+                        continue
+
+                    deferred = self._busy_groups.get(job.group) if job.group is not None else None
+                    if deferred is not None:
+                        heapq.heappop(self._heap)
+                        self._defer(job, deferred)
+                        continue
+
+                    await slots.acquire()
+                    if self._heap[0][2] is not job or job.deadline != deadline:
+                        # removed or rescheduled while waiting free slot
+                        slots.release()
+                        continue
+
+                    heapq.heappop(self._heap)
+                    self._start(job, slots)
+                else:
+                    await self._wakeup.wait()
+                    self._wakeup.clear()
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._wakeup = None
+
+    @staticmethod
+    def _defer(job: PollJob, deferred: list):
+        deferred.append((job, job.deadline))
+        job.deadline = None
+        job.running = True
+
+    def _release_group(self, group):
+        """Return deferred jobs of `group` to the heap with their original deadlines"""
+        for job, deadline in self._busy_groups.pop(group):
+            job.running = False
+            if job.removed:
+                continue
+            job.deadline = deadline
+            heapq.heappush(self._heap, (deadline, next(self._seq), job))
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _start(self, job: PollJob, slots: asyncio.Semaphore):
+        lateness = self._loop.time() - job.deadline
+        self.lateness_total += lateness
+        if lateness > self.lateness_max:
+            self.lateness_max = lateness
+        if lateness > LATE_POLL_THRESHOLD:
+            self.stats['late_polls'] += 1
+
+        job.deadline = None
+        job.running = True
+        if job.group is not None:
+            self._busy_groups[job.group] = []
+        self.in_flight += 1
+        task = asyncio.ensure_future(self._run_job(job, slots))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run_job(self, job: PollJob, slots: asyncio.Semaphore):
+        try:
+            await job.poll()
+        except asyncio.CancelledError:
+            raise
+        except ConnectionRefusedError:
+            self.stats['poll_errors'] += 1
+        except Exception:
+            self.stats['poll_errors'] += 1
+            logger.exception('Poll %s failed', job.name)
+        finally:
+            self.stats['polls'] += 1
+            self.in_flight -= 1
+            job.running = False
+            slots.release()
+            if job.group is not None:
+                self._release_group(job.group)
+
+        if not job.removed:
+            self._schedule(job, self._next_delay(job))
@@ -0,0 +1,180 @@
+"""Shared memory response cache
+
+Polling worker writes latest responses of each server into shared memory,
+any number of answering processes read them without copying.
+
+Memory should be created before workers fork, e.g. by supervisor:
+anonymous shared mapping is inherited by forked (and restarted) workers.
+
+Each (server, response kind) slot has two buffers and a sequence number (seqlock).
+Writer fills inactive buffer and then flips sequence, so it never touches the buffer readers use.
+Sequence is odd while writing, generation is `seq // 2` and generation buffer is `generation % 2`.
+Buffer of generation `g` will be overwritten only when writing of generation `g + 2` starts (seq >= 2g + 3).
+"""
+import collections.abc
+import logging
+import mmap
+import struct
+import typing
+
+from . import dispatch
+
+logger = logging.getLogger('sqproxy.shm')
+
+DEFAULT_SLOT_CAPACITY = 128 * 1024
+
+KINDS = dispatch.KINDS
+
+# server header: online flag, client requests (demand) of each kind
+_SERVER_HEADER = struct.Struct('=Q' + 'Q' * len(KINDS))
+_ONLINE = struct.Struct('=Q')
+_DEMAND = struct.Struct('=Q')
+# slot header: seq, length of buffer 0, length of buffer 1
+_SLOT_HEADER = struct.Struct('=QII')
+_SEQ = struct.Struct('=Q')
+_LENGTH = struct.Struct('=I')
+
+
+class SharedResponseStore:
+    def __init__(self, server_names: typing.Sequence[str], slot_capacity: int = DEFAULT_SLOT_CAPACITY):
+        self.slot_capacity = slot_capacity
+        self._slot_size = _SLOT_HEADER.size + 2 * slot_capacity
+        self._server_size = _SERVER_HEADER.size + len(KINDS) * self._slot_size
+        self._offsets = {name: i * self._server_size for i, name in enumerate(server_names)}
+        # anonymous shared mapping, pages allocated on first touch
+        self._mmap = mmap.mmap(-1, max(1, len(self._offsets)) * self._server_size)
+        self._view = memoryview(self._mmap)
+
+    def __contains__(self, server_name):
+        return server_name in self._offsets
+
+    def get_cache(self, server_name: str) -> 'SharedResponseCache':
+        return SharedResponseCache(self, self._offsets[server_name])
+
+
+class SharedResponseCache(collections.abc.Mapping):
+    """Responses of single server, mapping: kind -> memoryview
+
+    Returned views are valid until the next but one write of the same kind,
+    use it immediately (e.g. to send) and don't store
+    """
+
+    def __init__(self, store: SharedResponseStore, offset: int):
+        self._store = store
+        self._mem = store._mmap
+        self._view = store._view
+        self._offset = offset
+        capacity = store.slot_capacity
+
+        # kind -> offset of demand counter
+        self._demand_offsets = {kind: offset + _ONLINE.size + i * _DEMAND.size for i, kind in enumerate(KINDS)}
+
+        # kind -> (slot offset, (buffer 0 offset, buffer 1 offset))
+        self._slots = {}
+        slot_offset = offset + _SERVER_HEADER.size
+        for kind in KINDS:
+            data_offset = slot_offset + _SLOT_HEADER.size
+            self._slots[kind] = (slot_offset, (data_offset, data_offset + capacity))
+            slot_offset += store._slot_size
+
+        # kind -> (slot offset, seq, view): last read view, reused while slot is not changed
+        self._last_read = {}
+
+    @property
+    def online(self) -> bool:
+        return bool(_ONLINE.unpack_from(self._mem, self._offset)[0])
+
+    @online.setter
+    def online(self, value: bool):
+        _ONLINE.pack_into(self._mem, self._offset, int(value))
+
+    def get_demand(self, kind) -> int:
+        """How many client requests of `kind` reported by workers"""
+        return _DEMAND.unpack_from(self._mem, self._demand_offsets[kind])[0]
+
+    def add_demand(self, kind, count: int):
+        """Report client requests, any process allowed to call it
+
+        Concurrent reports can be lost, so use it only to detect there were any requests
+        """
+        offset = self._demand_offsets[kind]
+        value = _DEMAND.unpack_from(self._mem, offset)[0]
+        _DEMAND.pack_into(self._mem, offset, (value + count) % (1 << 64))
+
+    def _read(self, kind) -> typing.Tuple[int, memoryview]:
+        slot_offset, buffers = self._slots[kind]
+        view = self._view
+
+        while True:
+            seq, *lengths = _SLOT_HEADER.unpack_from(view, slot_offset)
+            generation = seq // 2
+            if generation == 0:
+                raise KeyError(kind)
+
+            buffer_index = generation % 2
+            data_offset = buffers[buffer_index]
+            data = view[data_offset : data_offset + lengths[buffer_index]]
+
+            # writer doesn't start overwrite this buffer yet
+            if self._is_intact(slot_offset, generation):
+                return generation, data
+
+    def _is_intact(self, slot_offset: int, generation: int) -> bool:
+        return _SEQ.unpack_from(self._view, slot_offset)[0] < 2 * generation + 3
+
+    def __getitem__(self, kind) -> memoryview:
+        last_read = self._last_read.get(kind)
+        if last_read is not None:
+            slot_offset, seq, data = last_read
+            if _SEQ.unpack_from(self._view, slot_offset)[0] == seq:
+                return data
+
+        generation, data = self._read(kind)
+        self._last_read[kind] = (self._slots[kind][0], 2 * generation, data)
+        return data
+
+    def get(self, kind, default=None):
+        try:
+            return self[kind]
+        except KeyError:
+            return default
+
+    def get_bytes(self, kind, default=None) -> typing.Optional[bytes]:
+        """Get copy of response which stays valid forever"""
+        if kind not in self:
+            return default
+
+        slot_offset, _ = self._slots[kind]
+        while True:
+            generation, data = self._read(kind)
+            copy = bytes(data)
+            if self._is_intact(slot_offset, generation):
+                return copy
+
+    def __setitem__(self, kind, data: bytes):
+        """Only one process (writer) allowed to call it"""
+        capacity = self._store.slot_capacity
+        if len(data) > capacity:
+            logger.warning('Response too large for shared cache (%s > %s), ignore it', len(data), capacity)
+            return
+
+        slot_offset, buffers = self._slots[kind]
+        seq = _SEQ.unpack_from(self._view, slot_offset)[0]
+        generation = seq // 2 + 1
+        buffer_index = generation % 2
+        data_offset = buffers[buffer_index]
+
+        _SEQ.pack_into(self._view, slot_offset, 2 * generation - 1)  # writing
+        self._view[data_offset : data_offset + len(data)] = data
+        _LENGTH.pack_into(self._view, slot_offset + _SEQ.size + buffer_index * _LENGTH.size, len(data))
+        _SEQ.pack_into(self._view, slot_offset, 2 * generation)
+
+    def __iter__(self):
+        return (kind for kind in KINDS if kind in self)
+
+    def __contains__(self, kind):
+        slot = self._slots.get(kind)
+        return slot is not None and _SEQ.unpack_from(self._view, slot[0])[0] >= 2
+
+    def __len__(self):
+        return sum(1 for _ in self)
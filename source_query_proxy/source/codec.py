@@ -0,0 +1,379 @@
+"""Compiled codecs for `messages.Message` classes
+
+Field-by-field processing calls every field with a new slice of the remaining buffer.
+Codec is built once per class instead:
+
+- runs of fixed-width fields (with the same byte order) unpacked/packed by single `struct.Struct`
+- strings found by single `bytes.find()` from offset, without slicing the remainder
+- nested messages and `raw_tail` are views of decoded buffer, not copies of it
+- values of nested messages kept in tuples, not dicts
+- key-value dicts (A2S_RULES) decoded without intermediate `Message` objects
+- lazy decoding only validates structure, values decoded on first access
+- any other (custom) field falls back to it's own `decode()`/`encode()`
+
+Results are the same as of field-by-field processing, see `reference_decode()`/`reference_encode()`.
+"""
+import struct
+import typing
+
+from . import messages
+from . import util
+
+DecodeStep = typing.Callable[[bytes, int, dict], int]
+EncodeStep = typing.Callable[[dict, list], None]
+
+
+def reference_decode(cls: typing.Type['messages.Message'], packet: bytes) -> 'messages.Message':
+    """Field-by-field decoding (without codec)"""
+    buffer = packet
+    values = {}
+    for field in cls.fields:
+        values[field.name], buffer = field.decode(buffer, values)
+    return cls(buffer, **values)
+
+
+def reference_encode(cls: typing.Type['messages.Message'], values: dict) -> bytes:
+    """Field-by-field encoding (without codec)"""
+    buf = []
+    for field in cls.fields:
+        try:
+            buf.append(field.encode(values.get(field.name, None), values))
+        except messages.SkipEncodeError:
+            pass
+    return b''.join(buf)
+
+
+class Codec:
+    def __init__(self, cls: typing.Type['messages.Message']):
+        self.cls = cls
+        self.names = tuple(field.name for field in cls.fields)
+        self.index = {name: index for index, name in enumerate(self.names)}
+        groups = _group_fields(cls.fields)
+        self._decode_steps = [_compile_decode(byte_order, fields) for byte_order, fields in groups]
+        self._validate_steps = [_compile_decode(byte_order, fields, False) for byte_order, fields in groups]
+        self._encode_steps = [_compile_encode(byte_order, fields) for byte_order, fields in groups]
+
+    def decode_values(self, buffer: bytes, offset: int = 0) -> typing.Tuple[dict, int]:
+        """Decode fields from `buffer` starting at `offset`
+
+        :return: tuple (values, offset of the rest)
+        """
+        values = {}
+        for step in self._decode_steps:
+            offset = step(buffer, offset, values)
+        return values, offset
+
+    def validate(self, buffer: bytes, offset: int = 0) -> int:
+        """Check structure of message without decoding strings and nested messages
+
+        :return: offset of the rest
+        """
+        values = {}  # only fixed-width values, needed for counts of arrays
+        for step in self._validate_steps:
+            offset = step(buffer, offset, values)
+        return offset
+
+    def decode(self, packet: bytes, offset: int = 0, lazy: bool = False) -> 'messages.Message':
+        """Decode message starting at `offset`, `raw_tail` of result is view of `packet`
+
+        :param lazy: only validate message, values will be decoded on first access
+        """
+        if not isinstance(packet, bytes):
+            # no find() in memoryview, mutable buffers can be reused by caller
+            packet = bytes(packet)
+
+        if lazy:
+            return self.cls.from_buffer(packet, self.validate(packet, offset), start=offset)
+
+        values, end = self.decode_values(packet, offset)
+        return self.cls.from_buffer(packet, end, values)
+
+    def encode(self, values: dict) -> bytes:
+        buf = []
+        for step in self._encode_steps:
+            step(values, buf)
+        return b''.join(buf)
+
+
+def get_codec(cls: typing.Type['messages.Message']) -> Codec:
+    # look only at own attribute, subclasses have other fields
+    codec = cls.__dict__.get('_codec')
+    if codec is None:
+        codec = cls._codec = Codec(cls)
+    return codec
+
+
+def _converter(field) -> typing.Optional[typing.Callable]:
+    """Converter of fixed-width field value applied after unpacking"""
+    converters = {
+        messages.PlatformField: util.Platform,
+        messages.ServerTypeField: util.ServerType,
+    }
+    return converters.get(type(field))
+
+
+def _is_fixed_width(field) -> bool:
+    if field.fmt is None or field.fmt == 's':
+        return False
+    return type(field).decode is messages.MessageField.decode or _converter(field) is not None
+
+
+def _group_fields(fields) -> typing.List[typing.Tuple[typing.Optional[str], list]]:
+    """Split fields to groups: (byte order, [fixed-width fields]) or (None, [other field])"""
+    groups = []
+    for field in fields:
+        if not _is_fixed_width(field):
+            groups.append((None, [field]))
+            continue
+
+        byte_order = field.format[0]
+        if groups and groups[-1][0] == byte_order:
+            groups[-1][1].append(field)
+        else:
+            groups.append((byte_order, [field]))
+    return groups
+
+
+def _struct(byte_order: str, fields) -> struct.Struct:
+    return struct.Struct(byte_order + ''.join(field.format[1:] for field in fields))
+
+
+def _compile_decode(byte_order: typing.Optional[str], fields, materialize: bool = True) -> DecodeStep:
+    """
+    :param materialize: False - only check structure and skip strings and nested messages
+        (fixed-width and custom fields are decoded anyway)
+    """
+    if byte_order is not None:
+        return _decode_struct(byte_order, fields)
+
+    field = fields[0]
+    decode = type(field).decode
+    if decode is messages.StringField.decode:
+        return _decode_string(field, materialize)
+    if decode is messages.MessageDictField.decode:
+        return _decode_dict(field, materialize)
+    if decode is messages.MessageArrayField.decode:
+        return _decode_array(field, materialize)
+    return _decode_custom(field)
+
+
+def _compile_encode(byte_order: typing.Optional[str], fields) -> EncodeStep:
+    if byte_order is not None and all(type(field).encode is messages.MessageField.encode for field in fields):
+        return _encode_struct(byte_order, fields)
+
+    steps = [_encode_field(field) for field in fields]
+    if len(steps) == 1:
+        return steps[0]
+
+    def encode_fields(values, buf):
+        for step in steps:
+            step(values, buf)
+
+    return encode_fields
+
+
+def _decode_struct(byte_order: str, fields) -> DecodeStep:
+    packer = _struct(byte_order, fields)
+    size = packer.size
+    unpack_from = packer.unpack_from
+    names = [field.name for field in fields]
+    # (name, validate, convert) of fields which need more than unpacking
+    post = [
+        (field.name, field.validate if field.validators else None, _converter(field))
+        for field in fields
+        if field.validators or _converter(field) is not None
+    ]
+
+    def decode_struct(buffer, offset, values):
+        if len(buffer) - offset < size:
+            raise messages.BufferExhaustedError
+        try:
+            values.update(zip(names, unpack_from(buffer, offset)))
+        except struct.error as exc:
+            raise messages.BrokenMessageError(exc)
+
+        for name, validate, convert in post:
+            value = values[name]
+            if validate is not None:
+                validate(value)
+            if convert is not None:
+                values[name] = convert(value)
+        return offset + size
+
+    return decode_struct
+
+
+def _decode_string(field, materialize: bool = True) -> DecodeStep:
+    name = field.name
+    validate = field.validate if field.validators else None
+
+    def skip_string(buffer, offset, values):
+        if offset >= len(buffer):
+            raise messages.BufferExhaustedError
+        terminator = buffer.find(b'\x00', offset)
+        if terminator == -1:
+            raise messages.BufferExhaustedError('No string terminator')
+        return terminator + 1
+
+    def decode_string(buffer, offset, values):
+        if offset >= len(buffer):
+            raise messages.BufferExhaustedError
+        terminator = buffer.find(b'\x00', offset)
+        if terminator == -1:
+            raise messages.BufferExhaustedError('No string terminator')
+
+        value = values[name] = buffer[offset:terminator].decode('utf8', 'ignore')
+        if validate is not None:
+            validate(value)
+        return terminator + 1
+
+    if not materialize and validate is None:
+        return skip_string
+    return decode_string
+
+
+def _decode_entries(field, new_entries, add_entry, materialize: bool = True) -> DecodeStep:
+    """Emulates `MessageArrayField.decode()`: decode `count` entries, return to entry start on failure"""
+    name = field.name
+    count = field.count
+    entry_codec = get_codec(field.element)
+
+    def decode_entries(buffer, offset, values):
+        entries = new_entries()
+        decoded = 0
+        while decoded < count(values):
+            try:
+                entry_values, entry_end = entry_codec.decode_values(buffer, offset)
+            except messages.BrokenMessageError as exc:
+                if decoded < count.minimum:
+                    raise messages.BrokenMessageError(exc)
+                break
+            offset = entry_end
+            add_entry(entries, buffer, offset, entry_values)
+            decoded += 1
+
+        values[name] = entries
+        return offset
+
+    def skip_entries(buffer, offset, values):
+        decoded = 0
+        while decoded < count(values):
+            try:
+                offset = entry_codec.validate(buffer, offset)
+            except messages.BrokenMessageError as exc:
+                if decoded < count.minimum:
+                    raise messages.BrokenMessageError(exc)
+                break
+            decoded += 1
+        return offset
+
+    return decode_entries if materialize else skip_entries
+
+
+def _decode_array(field, materialize: bool = True) -> DecodeStep:
+    element = field.element
+
+    def add_entry(entries, buffer, offset, entry_values):
+        # values of all fields are decoded in order of fields
+        entries.append(element.from_buffer(buffer, offset, tuple(entry_values.values())))
+
+    return _decode_entries(field, list, add_entry, materialize)
+
+
+def _is_plain_string(field) -> bool:
+    return type(field).decode is messages.StringField.decode and not field.validators
+
+
+def _decode_string_dict(field, materialize: bool = True) -> DecodeStep:
+    """Dict of string pairs (A2S_RULES): two `find()` per entry, without per-field calls"""
+    name = field.name
+    count = field.count
+
+    def decode_string_dict(buffer, offset, values):
+        entries = {}
+        size = len(buffer)
+        find = buffer.find
+        decoded = 0
+        while decoded < count(values):
+            key_end = find(b'\x00', offset) if offset < size else -1
+            value_end = find(b'\x00', key_end + 1) if -1 < key_end < size - 1 else -1
+            if value_end == -1:
+                if decoded < count.minimum:
+                    raise messages.BrokenMessageError('Incomplete message')
+                break
+
+            if materialize:
+                key = buffer[offset:key_end].decode('utf8', 'ignore')
+                entries[key] = buffer[key_end + 1 : value_end].decode('utf8', 'ignore')
+            offset = value_end + 1
+            decoded += 1
+
+        if materialize:
+            values[name] = entries
+        return offset
+
+    return decode_string_dict
+
+
+def _decode_dict(field, materialize: bool = True) -> DecodeStep:
+    if _is_plain_string(field.key_field) and _is_plain_string(field.value_field):
+        return _decode_string_dict(field, materialize)
+
+    key_name = field.key_field.name
+    value_name = field.value_field.name
+
+    def add_entry(entries, buffer, offset, entry_values):
+        entries[entry_values[key_name]] = entry_values[value_name]
+
+    return _decode_entries(field, dict, add_entry, materialize)
+
+
+def _decode_custom(field) -> DecodeStep:
+    name = field.name
+
+    def decode_custom(buffer, offset, values):
+        values[name], rest = field.decode(memoryview(buffer)[offset:], values)
+        return len(buffer) - len(rest)
+
+    return decode_custom
+
+
+def _encode_struct(byte_order: str, fields) -> EncodeStep:
+    pack = _struct(byte_order, fields).pack
+    fallback = [_encode_field(field) for field in fields]
+
+    def encode_struct(values, buf):
+        packed = []
+        for field in fields:
+            value = values.get(field.name)
+            if value is None:
+                try:
+                    value = field.default_value
+                except messages.SkipEncodeError:
+                    # skipped field changes format of run
+                    for step in fallback:
+                        step(values, buf)
+                    return
+            if field.validators:
+                field.validate(value)
+            packed.append(value)
+
+        try:
+            buf.append(pack(*packed))
+        except struct.error as exc:
+            raise messages.BrokenMessageError(exc)
+
+    return encode_struct
+
+
+def _encode_field(field) -> EncodeStep:
+    name = field.name
+    encode = field.encode
+
+    def encode_field(values, buf):
+        try:
+            buf.append(encode(values.get(name, None), values))
+        except messages.SkipEncodeError:
+            pass
+
+    return encode_field
@@ -4,11 +4,20 @@ import collections
 import functools
 import socket
 import struct
+import zlib
 
+from . import codec
 from . import util
 
 NO_SPLIT = -1
 SPLIT = -2
+HEADER_SIZE = 4  # split (LongFieldLE)
+MAX_DECOMPRESSED_SIZE = 1024 * 1024
+
+_SPLIT_HEADERS = {
+    NO_SPLIT: struct.pack('<l', NO_SPLIT),
+    SPLIT: struct.pack('<l', SPLIT),
+}
 
 _missing = object()
 
@@ -45,19 +54,11 @@ def on_header_required(func):
     @functools.wraps(func)
     def wrap(*args, **kw):
         split_header = kw.pop('split_header', False)
-        nosplit_header = not split_header
 
         result = func(*args, **kw)
 
-        split = (nosplit_header and NO_SPLIT) or (split_header and SPLIT) or _missing
-
-        if split is _missing:
-            raise RuntimeError
-
-        header = Header().encode(split=split)
-        result = b''.join((header, result))
-
-        return result
+        header = _SPLIT_HEADERS[SPLIT if split_header else NO_SPLIT]
+        return header + result
 
     return wrap
 
@@ -80,6 +81,29 @@ def needs_buffer(func):
     return needs_buffer
 
 
+def decompress(data, size, crc, max_size=MAX_DECOMPRESSED_SIZE):
+    """Decompress bz2 `data` of declared `size` and CRC32
+
+    Decompression stops as soon as output exceeds declared size,
+    so decompression bomb can't exhaust memory.
+    """
+    if not 0 <= size <= max_size:
+        raise BrokenMessageError('Declared size {} out of limit {}'.format(size, max_size))
+
+    decompressor = bz2.BZ2Decompressor()
+    try:
+        # one more byte to detect data larger than declared
+        result = decompressor.decompress(data, max_length=size + 1)
+    except (OSError, EOFError, ValueError) as exc:
+        raise BrokenMessageError('Broken bz2 data: {}'.format(exc))
+
+    if len(result) != size or not decompressor.eof:
+        raise BrokenMessageError('Decompressed size mismatch, declared {}'.format(size))
+    if zlib.crc32(result) != crc & 0xFFFFFFFF:
+        raise BrokenMessageError('Decompressed data CRC mismatch')
+    return result
+
+
 def int2ip(value):
     return socket.inet_ntoa(struct.pack('i', value))
 
@@ -427,6 +451,13 @@ class MessageDictField(MessageArrayField):
 
 
 class Message(collections.abc.MutableMapping):
+    """Decoded (or to be encoded) message, mapping: field name -> value
+
+    Values are kept in dict, in tuple (in order of `fields`, entries of arrays)
+    or not decoded yet (None, lazy decoding)
+    """
+
+    __slots__ = ('_buffer', '_tail_offset', '_values', '_start')
 
     fields = ()
 
@@ -434,7 +465,48 @@ class Message(collections.abc.MutableMapping):
         self.raw_tail = raw_tail
         self.values = values
 
+    @classmethod
+    def from_buffer(cls, buffer, offset, values=None, start=0):
+        """Decoded message, rest of `buffer` from `offset` is not copied
+
+        :param values: decoded values, None - decode them from `start` on first access
+        """
+        message = cls(buffer)
+        message._values = values
+        message._start = start
+        message._tail_offset = offset
+        return message
+
+    @property
+    def values(self) -> dict:
+        values = self._values
+        if values is None:
+            values = self._values = codec.get_codec(type(self)).decode_values(self._buffer, self._start)[0]
+        elif values.__class__ is tuple:
+            # caller can modify values
+            values = self._values = dict(zip(codec.get_codec(type(self)).names, values))
+        return values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+
+    @property
+    def raw_tail(self):
+        if not self._tail_offset:
+            return self._buffer
+        # created on demand, most of decoded messages don't use it
+        return memoryview(self._buffer)[self._tail_offset :]
+
+    @raw_tail.setter
+    def raw_tail(self, value):
+        self._buffer = value
+        self._tail_offset = 0
+
     def __getitem__(self, key):
+        values = self._values
+        if values.__class__ is tuple:
+            return values[codec.get_codec(type(self)).index[key]]
         return self.values[key]
 
     def __setitem__(self, key, value):
@@ -444,32 +516,29 @@ class Message(collections.abc.MutableMapping):
         del self.values[key]
 
     def __len__(self):
+        if self._values.__class__ is tuple:
+            return len(self._values)
         return len(self.values)
 
     def __iter__(self):
+        if self._values.__class__ is tuple:
+            return iter(codec.get_codec(type(self)).names)
         return iter(self.values)
 
     def __repr__(self):
-        return f'{self.__class__}({self.values})'
+        return f'{self.__class__}({dict(self)})'
 
     def encode(self, **field_values):
         values = dict(self.values, **field_values)
-        buf = []
-        for field in self.fields:
-            try:
-                buf.append(field.encode(values.get(field.name, None), values))
-            except SkipEncodeError:
-                pass
-        return b''.join(buf)
+        return codec.get_codec(type(self)).encode(values)
 
     @classmethod
     @on_broken_default
-    def decode(cls, packet):
-        buffer = packet
-        values = {}
-        for field in cls.fields:
-            values[field.name], buffer = field.decode(buffer, values)
-        return cls(buffer, **values)
+    def decode(cls, packet, offset=0, lazy=False):
+        """
+        :param lazy: only validate `packet`, values are decoded on first access
+        """
+        return codec.get_codec(cls).decode(packet, offset, lazy)
 
 
 class Header(Message):
@@ -480,6 +549,8 @@ class Header(Message):
 class Packet(Message):
     """Message with Header"""
 
+    __slots__ = ()
+
     encode = on_header_required(Message.encode)
 
 
@@ -504,6 +575,11 @@ class Fragment(Packet):
 
 
 class CompressedFragment(Packet):
+    """First fragment of compressed split packet
+
+    Packets of engines which compress have no `mtu` field, size and CRC32 of whole decompressed packet
+    are only in the first fragment.
+    """
 
     fields = (
         LongFieldLE('message_id'),
@@ -519,7 +595,21 @@ class CompressedFragment(Packet):
 
     @property
     def content(self):
-        return bz2.decompress(self.raw_tail)
+        return decompress(self.raw_tail, self['size'], self['crc'])
+
+
+class CompressedFragmentHeader(Packet):
+    """Common header of all fragments of compressed split packet"""
+
+    fields = (
+        LongFieldLE('message_id'),
+        ByteField('fragment_count'),
+        ByteField('fragment_id'),  # 0-indexed
+    )
+
+    @property
+    def is_compressed(self):
+        return True
 
 
 class InfoRequest(Packet):
@@ -584,6 +674,8 @@ class PlayersRequest(Packet):
 
 class PlayerEntry(Packet):
 
+    __slots__ = ()
+
     fields = (
         ByteField('index'),
         StringField('name'),
@@ -651,6 +743,8 @@ class MasterServerRequest(Packet):
 
 class MSAddressEntry(Message):
 
+    __slots__ = ()
+
     fields = (
         MSAddressEntryIPField('host'),
         MSAddressEntryPortField('port'),
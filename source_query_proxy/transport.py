@@ -1,17 +1,36 @@
 import asyncio
-import itertools
+import bz2
+import collections
 import logging
 import math
 import random
+import struct
 import typing
+import zlib
 
-import pylru
 from asyncio_dgram.aio import DatagramStream
 from asyncio_dgram.aio import Protocol as _AioDgramProtocol
 
+from . import mmsg
+from .decompress import Decompressor
+from .fragments import FragmentReassembler
 from .source import messages
 
 MAX_SIZE_32 = 2 ** 31 - 1
+COMPRESSED_MESSAGE_FLAG = 1 << 31  # MSB of message id of split packet
+
+NO_SPLIT_HEADER = messages.Header().encode(split=messages.NO_SPLIT)
+
+FRAGMENT_MAX_SIZE = 1200
+FRAGMENT_HEADER_SIZE = len(
+    messages.Fragment().encode(message_id=0, fragment_count=0, fragment_id=0, mtu=0, split_header=True)
+)
+
+_COMPRESSED_SIZE_CRC = struct.Struct('<ll')
+
+RECV_QUEUE_SIZE = 1024  # datagrams
+DROP_NEWEST = 'newest'
+DROP_OLDEST = 'oldest'
 
 logger = logging.getLogger('sqproxy.transport')
 
@@ -27,95 +46,229 @@ class ErrorIgnoreProtocol(_AioDgramProtocol):
         pass  # we are not interested in any errors because it's udp
 
 
+class BoundedRecvQueue(asyncio.Queue):
+    """Queue of received datagrams which drops datagrams instead of growing when full
+
+    Under overload it's better to drop requests than answer them when client already gave up.
+    `DROP_OLDEST` keeps the freshest datagrams, `DROP_NEWEST` keeps the queued ones.
+    """
+
+    def __init__(self, maxsize: int = RECV_QUEUE_SIZE, policy: str = DROP_OLDEST):
+        if policy not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError(f'Unknown drop policy: {policy}')
+        super().__init__(maxsize)
+        self.policy = policy
+        self.stats = collections.Counter()  # dropped
+
+    def put_nowait(self, item):
+        if self.full():
+            # end of stream (None, None) is never dropped
+            if self.policy == DROP_NEWEST and item[0] is not None:
+                self.stats['dropped'] += 1
+                return
+            self.get_nowait()
+            self.stats['dropped'] += 1
+        super().put_nowait(item)
+
+
+def _make_recvq(size: int, policy: str) -> asyncio.Queue:
+    if not size:
+        return asyncio.Queue()
+    return BoundedRecvQueue(size, policy)
+
+
 class BrokenPacketError(Exception):  # FIXME: message is app layer and packet is transport layer
     def __init__(self, raw_data, addr):
         self.raw_data = raw_data
         self.addr = addr
 
 
-class SourceDatagramStream(DatagramStream):
-    FRAGMENT_MAX_SIZE = 1200
+def split_packet(packet: bytes, split_size=FRAGMENT_MAX_SIZE, message_id: int = None) -> typing.Tuple[bytes, ...]:
+    """Split packet to ready to send fragments (datagrams)
+
+    :param message_id: id of split packet, random by default
+    """
+    if message_id is None:
+        message_id = random.randint(1, MAX_SIZE_32)
+
+    mtu = split_size - FRAGMENT_HEADER_SIZE
+    fragment_count = math.ceil(len(packet) / mtu)  # type: int
+
+    fragments = []
+    for fragment_id in range(fragment_count):
+        fragment_header = messages.Fragment().encode(
+            message_id=message_id,
+            fragment_count=fragment_count,
+            fragment_id=fragment_id,
+            mtu=mtu,
+            split_header=True,
+        )
+        offset = fragment_id * mtu
+        fragments.append(fragment_header + packet[offset : offset + mtu])
+
+    return tuple(fragments)
+
+
+def split_compressed_packet(
+    packet: bytes, split_size=FRAGMENT_MAX_SIZE, message_id: int = None
+) -> typing.Tuple[bytes, ...]:
+    """Compress packet (bz2) and split it to ready to send fragments
+
+    Fragments of compressed packet have no `mtu` field,
+    size and CRC32 of whole packet are in the first fragment (after fragment header).
+    """
+    if message_id is None:
+        message_id = random.randint(1, MAX_SIZE_32)
+
+    payload = _COMPRESSED_SIZE_CRC.pack(len(packet), _signed32(zlib.crc32(packet))) + bz2.compress(packet)
+    header_size = len(_compressed_fragment_header(0, 0, 0))
+    mtu = split_size - header_size
+    fragment_count = math.ceil(len(payload) / mtu)  # type: int
+
+    fragments = []
+    for fragment_id in range(fragment_count):
+        offset = fragment_id * mtu
+        header = _compressed_fragment_header(message_id, fragment_count, fragment_id)
+        fragments.append(header + payload[offset : offset + mtu])
+
+    return tuple(fragments)
+
+
+def _signed32(value: int) -> int:
+    """Unsigned 32-bit value as signed, to pack it as LongField"""
+    return value - (1 << 32) if value > MAX_SIZE_32 else value
+
+
+def _compressed_fragment_header(message_id, fragment_count, fragment_id) -> bytes:
+    return messages.CompressedFragmentHeader().encode(
+        message_id=_signed32(message_id | COMPRESSED_MESSAGE_FLAG),
+        fragment_count=fragment_count,
+        fragment_id=fragment_id,
+        split_header=True,
+    )
+
+
+class FragmentsMixin:
+    """Reassembly of split packets, requires `fragments` and `decompressor` attributes"""
+
     MAX_FRAGMENTS_PER_PACKET = 100
+    # False - compressed split packets are broken, client requests are never compressed
+    # and decompression of crafted payloads would cost CPU of listener
+    ACCEPT_COMPRESSED = True
 
-    def __init__(self, transport, recvq, excq, drained):
-        super().__init__(transport, recvq, excq, drained)
-        self.fragments = pylru.lrucache(size=1024)
+    fragments: FragmentReassembler
+    decompressor: Decompressor
+
+    def collect_fragments(self, packet, addr=None) -> typing.Optional[typing.Tuple[bytes, bool]]:
+        """Collect fragments of split packet
+
+        :param addr: source of packet, fragments of different sources are never mixed
+        :return: tuple (whole packet, is compressed) or None if not all fragments received yet
+        """
+        if packet.startswith(NO_SPLIT_HEADER):
+            # most common case, don't spend time to decode header
+            return packet, False
 
-    def handle_fragments(self, packet):
         header = messages.Header.decode(packet)
         if header['split'] != messages.SPLIT:
-            return packet
+            return packet, False
 
-        fragment = messages.Fragment.decode(header.raw_tail)
+        fragment = messages.Fragment.decode(packet, messages.HEADER_SIZE)
+        if fragment.is_compressed and not self.ACCEPT_COMPRESSED:
+            raise messages.BrokenMessageError('Compressed packet is not accepted')
         if fragment.is_compressed:
-            fragment = messages.CompressedFragment.decode(header.raw_tail)
+            # size and CRC32 in the first fragment kept as part of content, see `_split_compressed()`
+            fragment = messages.CompressedFragmentHeader.decode(packet, messages.HEADER_SIZE)
+
+        packet = self.fragments.add(
+            addr,
+            fragment['message_id'],
+            fragment['fragment_id'],
+            fragment['fragment_count'],
+            fragment.raw_tail,
+        )
+        if packet is None:
+            return None
+        return packet, fragment.is_compressed
 
-        packet_id = fragment['message_id']
+    @staticmethod
+    def _split_compressed(packet):
+        """Split reassembled compressed packet to (bz2 data, size, CRC32)"""
+        if len(packet) < _COMPRESSED_SIZE_CRC.size:
+            raise messages.BufferExhaustedError
+        size, crc = _COMPRESSED_SIZE_CRC.unpack_from(packet)
+        return memoryview(packet)[_COMPRESSED_SIZE_CRC.size :], size, crc
 
-        if packet_id in self.fragments:
-            fragment_count, packet_fragments = self.fragments[packet_id]
-        else:
-            fragment_count = fragment['fragment_count']
-            if fragment_count > self.MAX_FRAGMENTS_PER_PACKET:
-                logger.warning(
-                    'Packet fragment count more than our limit: %s > %s.' 'Packet will be trimmed',
-                    fragment_count,
-                    self.MAX_FRAGMENTS_PER_PACKET,
-                )
-                fragment_count = self.MAX_FRAGMENTS_PER_PACKET
-
-            packet_fragments = []
-            self.fragments[packet_id] = fragment_count, packet_fragments
-
-        fragment_ids = {f['fragment_id'] for f in packet_fragments}
-        if fragment['fragment_id'] not in fragment_ids:
-            packet_fragments.append(fragment)
-
-        if len(packet_fragments) < fragment_count:
+    def handle_fragments(self, packet, addr=None):
+        """Collect fragments of split packet, compressed packet decompressed in place
+
+        :return: whole packet or None if not all fragments received yet
+        """
+        collected = self.collect_fragments(packet, addr)
+        if collected is None:
             return None
 
-        self.fragments.pop(packet_id, None)
-        packet_fragments.sort(key=lambda f: f['fragment_id'])
-        return b''.join(f.content for f in packet_fragments)
+        packet, compressed = collected
+        if compressed:
+            return self.decompressor.decompress(*self._split_compressed(packet))
+        return packet
+
+    async def handle_fragments_async(self, packet, addr=None):
+        """Same as `handle_fragments()`, but large payloads are decompressed off event loop"""
+        collected = self.collect_fragments(packet, addr)
+        if collected is None:
+            return None
+
+        packet, compressed = collected
+        if compressed:
+            return await self.decompressor.decompress_async(*self._split_compressed(packet))
+        return packet
+
+
+class SourceDatagramStream(FragmentsMixin, DatagramStream):
+    FRAGMENT_MAX_SIZE = FRAGMENT_MAX_SIZE
+
+    def __init__(self, transport, recvq, excq, drained):
+        super().__init__(transport, recvq, excq, drained)
+        self.fragments = FragmentReassembler(max_fragments=self.MAX_FRAGMENTS_PER_PACKET)
+        self.decompressor = Decompressor()
+
+    @property
+    def recv_stats(self) -> typing.Counter[str]:
+        """Stats of receive queue: dropped"""
+        return getattr(self._recvq, 'stats', collections.Counter())
+
+    def recv_queue_fill(self) -> float:
+        """How full receive queue is: 0..1, always 0 for unlimited queue"""
+        if not self._recvq.maxsize:
+            return 0.0
+        return self._recvq.qsize() / self._recvq.maxsize
 
     async def send_packet(self, packet, addr=None, split_size=FRAGMENT_MAX_SIZE):
         if len(packet) <= split_size:
             await self._send(packet, addr)
             return
 
-        message_id = random.randint(1, MAX_SIZE_32)
-        fragment_count = math.ceil(len(packet) / split_size)  # type: int
-        mtu = split_size - (4 + (4 + 1 + 1 + 2))  # MAX_SIZE - (packet header + fragment header)
-
-        packet_iter = iter(packet)
-
-        for fragment_id in range(fragment_count):
-            fragment_tail = bytes(itertools.islice(packet_iter, mtu))
+        await self.send_fragments(split_packet(packet, split_size), addr)
 
-            fragment_header = messages.Fragment().encode(
-                message_id=message_id,
-                fragment_count=fragment_count,
-                fragment_id=fragment_id,
-                mtu=mtu,
-                split_header=True,
-            )
-
-            await self._send(b''.join((fragment_header, fragment_tail)), addr)
+    async def send_fragments(self, fragments: typing.Iterable[bytes], addr=None):
+        """Send fragments made by `split_packet()`"""
+        for fragment in fragments:
+            await self._send(fragment, addr)
 
     async def recv_packet(self):
         while True:
             data, addr = await super().recv()
 
             try:
-                data = self.handle_fragments(data)
+                packet = await self.handle_fragments_async(data, addr)
             except messages.BrokenMessageError:
                 raise BrokenPacketError(data, addr)
 
-            if data is None:
+            if packet is None:
                 # data not ready
                 continue
-
-            return data, addr
+            return packet, addr
 
     async def send_bytes(self, data, addr=None):
         """Alias for `send()`, use it instead `send()`
@@ -136,12 +289,11 @@ class SourceDatagramStream(DatagramStream):
         self.close()
 
 
-def decode_packet(packet, msg_classes):
-    header = messages.Header.decode(packet)
-    packet = header.raw_tail
+def decode_packet(packet, msg_classes, lazy=False):
+    messages.Header.decode(packet)
 
     for cls in msg_classes:
-        msg = cls.decode(packet, default=None)
+        msg = cls.decode(packet, messages.HEADER_SIZE, lazy=lazy, default=None)
         if msg is not None:
             return msg
 
@@ -149,6 +301,8 @@ def decode_packet(packet, msg_classes):
 
 
 class SourceDatagramServer(SourceDatagramStream):
+    ACCEPT_COMPRESSED = False
+
     request_message_classes = (
         messages.InfoRequestV2,
         messages.InfoRequest,
@@ -159,6 +313,14 @@ class SourceDatagramServer(SourceDatagramStream):
     def decode_request(self, packet):
         return decode_packet(packet, msg_classes=self.request_message_classes)
 
+    async def recv_raw_packet(self):
+        """Same as `recv_packet()` but request decoding is up to the caller
+
+        :return: tuple (data, addr)
+        :raise BrokenPacketError: broken packet was received
+        """
+        return await super().recv_packet()
+
     async def recv_packet(self):
         try:
             data, addr = await super().recv_packet()
@@ -178,7 +340,8 @@ class SourceDatagramClient(SourceDatagramStream):
     )
 
     def decode_response(self, packet):
-        return decode_packet(packet, msg_classes=self.response_message_classes)
+        # only raw responses are cached, values of message decoded if somebody needs them
+        return decode_packet(packet, msg_classes=self.response_message_classes, lazy=True)
 
     async def recv_packet(self):
         while True:
@@ -191,10 +354,98 @@ class SourceDatagramClient(SourceDatagramStream):
             return message, data, addr
 
 
+class AnsweringProtocol(FragmentsMixin, asyncio.DatagramProtocol):
+    """Answer requests right in `datagram_received()`
+
+    No queue, future or task per datagram: response is looked up by `handler`
+    and sent by `transport.sendto()` in the same loop callback.
+    So `handler` must not block, it's called for every received request.
+
+    Responses are dropped while transport's write buffer is full.
+    """
+
+    ACCEPT_COMPRESSED = False
+
+    def __init__(
+        self,
+        handler: typing.Callable[[bytes, typing.Any], typing.Optional[bytes]],
+        split: typing.Callable[[bytes], typing.Iterable[bytes]] = split_packet,
+        sent_stats: typing.Counter[str] = None,
+    ):
+        """
+        :param handler: (request, addr) -> response or None to not answer
+        :param split: response -> fragments, called for responses larger than `FRAGMENT_MAX_SIZE`
+        :param sent_stats: counter of sent responses: answered, bytes (payload, before split into fragments)
+        """
+        self.handler = handler
+        self.split = split
+        self.sent_stats = collections.Counter() if sent_stats is None else sent_stats
+        self.fragments = FragmentReassembler(max_fragments=self.MAX_FRAGMENTS_PER_PACKET)
+        self.decompressor = Decompressor()
+        self.transport = None
+        self.closed = asyncio.get_event_loop().create_future()
+        self.stats = collections.Counter()  # broken, send_paused
+        self._paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def error_received(self, exc):
+        pass  # see `ErrorIgnoreProtocol`
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+
+    def datagram_received(self, data, addr):
+        try:
+            packet = self.handle_fragments(data, addr)
+        except messages.BrokenMessageError:
+            self.stats['broken'] += 1
+            logger.warning('Packet ignored. Broken data was received: data[:150]=%s', data[:150])
+            return
+
+        if packet is None:
+            return
+
+        response = self.handler(packet, addr)
+        if response is None or self.transport is None:
+            return
+
+        if self._paused:
+            self.stats['send_paused'] += 1
+            return
+
+        if len(response) <= FRAGMENT_MAX_SIZE:
+            self.transport.sendto(response, addr)
+        else:
+            for fragment in self.split(response):
+                self.transport.sendto(fragment, addr)
+
+        sent_stats = self.sent_stats
+        sent_stats['answered'] += 1
+        sent_stats['bytes'] += len(response)
+
+
 SourceDatagramServerType = typing.TypeVar('SourceDatagramServerType', bound=SourceDatagramServer)
 
 
-async def bind(addr, *, cls: typing.Type[SourceDatagramServerType] = None) -> SourceDatagramServerType:
+async def bind(
+    addr,
+    *,
+    cls: typing.Type[SourceDatagramServerType] = None,
+    batched: bool = False,
+    reuse_port: bool = False,
+    recv_queue_size: int = RECV_QUEUE_SIZE,
+    recv_queue_policy: str = DROP_OLDEST,
+) -> SourceDatagramServerType:
     """
     Bind a socket to a local address for datagrams.  The socket will be either
     AF_INET or AF_INET6 depending upon the type of address specified.
@@ -202,17 +453,34 @@ async def bind(addr, *, cls: typing.Type[SourceDatagramServerType] = None) -> So
     @param addr - For AF_INET or AF_INET6, a tuple with the the host and port to
                   to bind; port may be set to 0 to get any free port.
     @param cls  - implementation of server SourceDatagram protocol
+    @param batched - receive and send datagrams by batches (recvmmsg/sendmmsg),
+                     ignored if not supported by platform
+    @param reuse_port - allow other sockets (processes) bind the same address (SO_REUSEPORT)
+    @param recv_queue_size - how many received datagrams can wait processing, 0 - unlimited
+    @param recv_queue_policy - which datagrams are dropped when queue is full: DROP_OLDEST or DROP_NEWEST
     @return     - A SourceDatagramServer instance
     """
     loop = asyncio.get_event_loop()
-    recvq = asyncio.Queue()
+    recvq = _make_recvq(recv_queue_size, recv_queue_policy)
     excq = asyncio.Queue()
     drained = asyncio.Event()
 
-    transport, protocol = await loop.create_datagram_endpoint(
-        lambda: ErrorIgnoreProtocol(recvq, excq, drained),
-        local_addr=addr,
-    )
+    if batched and not mmsg.is_available():
+        logger.warning('Batched I/O (recvmmsg/sendmmsg) is not supported by platform, fallback to default')
+        batched = False
+
+    if batched:
+        transport, protocol = await mmsg.create_batched_endpoint(
+            lambda: ErrorIgnoreProtocol(recvq, excq, drained),
+            local_addr=addr,
+            reuse_port=reuse_port,
+        )
+    else:
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: ErrorIgnoreProtocol(recvq, excq, drained),
+            local_addr=addr,
+            reuse_port=reuse_port or None,
+        )
 
     if cls is None:
         cls = SourceDatagramServer
@@ -220,10 +488,49 @@ async def bind(addr, *, cls: typing.Type[SourceDatagramServerType] = None) -> So
     return cls(transport, recvq, excq, drained)
 
 
+async def bind_answering(
+    addr,
+    handler: typing.Callable[[bytes, typing.Any], typing.Optional[bytes]],
+    *,
+    split: typing.Callable[[bytes], typing.Iterable[bytes]] = split_packet,
+    sent_stats: typing.Counter[str] = None,
+    batched: bool = False,
+    reuse_port: bool = False,
+) -> typing.Tuple[asyncio.DatagramTransport, AnsweringProtocol]:
+    """Bind a socket which requests are answered by `handler` synchronously
+
+    See `AnsweringProtocol` and `bind()` for parameters.
+    Wait `protocol.closed` to know when transport is closed.
+    """
+    loop = asyncio.get_event_loop()
+
+    if batched and not mmsg.is_available():
+        logger.warning('Batched I/O (recvmmsg/sendmmsg) is not supported by platform, fallback to default')
+        batched = False
+
+    if batched:
+        return await mmsg.create_batched_endpoint(
+            lambda: AnsweringProtocol(handler, split, sent_stats),
+            local_addr=addr,
+            reuse_port=reuse_port,
+        )
+    return await loop.create_datagram_endpoint(
+        lambda: AnsweringProtocol(handler, split, sent_stats),
+        local_addr=addr,
+        reuse_port=reuse_port or None,
+    )
+
+
 SourceDatagramClientType = typing.TypeVar('SourceDatagramClientType', bound=SourceDatagramClient)
 
 
-async def connect(addr, *, cls: typing.Type[SourceDatagramClientType] = None) -> SourceDatagramClientType:
+async def connect(
+    addr,
+    *,
+    cls: typing.Type[SourceDatagramClientType] = None,
+    recv_queue_size: int = RECV_QUEUE_SIZE,
+    recv_queue_policy: str = DROP_OLDEST,
+) -> SourceDatagramClientType:
     """
     Connect a socket to a remote address for datagrams.  The socket will be
     either AF_INET or AF_INET6 depending upon the type of host specified.
@@ -231,10 +538,12 @@ async def connect(addr, *, cls: typing.Type[SourceDatagramClientType] = None) ->
     @param addr - For AF_INET or AF_INET6, a tuple with the the host and port to
                   to connect to.
     @param cls  - implementation of client SourceDatagram protocol
+    @param recv_queue_size - how many received datagrams can wait processing, 0 - unlimited
+    @param recv_queue_policy - which datagrams are dropped when queue is full: DROP_OLDEST or DROP_NEWEST
     @return     - A SourceDatagramClient instance
     """
     loop = asyncio.get_event_loop()
-    recvq = asyncio.Queue()
+    recvq = _make_recvq(recv_queue_size, recv_queue_policy)
     excq = asyncio.Queue()
     drained = asyncio.Event()
 
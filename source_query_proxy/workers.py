@@ -0,0 +1,121 @@
+"""Run proxies in several processes sharing the same listening ports
+
+Each worker binds every `listen_addr` with SO_REUSEPORT, so kernel spreads client requests across workers (cores).
+Only the polling worker (index 0) queries game servers,
+other workers read fresh responses from shared memory (see `shm` module).
+
+Supervisor restarts crashed workers.
+"""
+import logging
+import os
+import signal
+import time
+import typing
+
+logger = logging.getLogger('sqproxy.workers')
+
+POLLING_WORKER_INDEX = 0
+
+
+class WorkerContext(typing.NamedTuple):
+    index: int
+
+    @property
+    def is_polling(self) -> bool:
+        return self.index == POLLING_WORKER_INDEX
+
+
+def _format_exit_status(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return f'killed by signal {os.WTERMSIG(status)}'
+    return f'exit code {os.WEXITSTATUS(status)}'
+
+
+class Supervisor:
+    restart_delay = 1
+
+    def __init__(self, workers: int, target: typing.Callable[[WorkerContext], None]):
+        """
+        :param workers: how many worker processes run
+        :param target: worker main function, it's called in forked process
+        """
+        self.workers = workers
+        self.target = target
+        self._children = {}  # pid -> worker index
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        signal.signal(signal.SIGUSR1, self._forward_signal)
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        self._watch()
+
+    def _watch(self):
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            index = self._children.pop(pid, None)
+            if index is None or self._stopping:
+                continue
+
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == os.EX_OK:
+                logger.warning('Worker #%s (pid=%s) exited normally, do not restart it', index, pid)
+                continue
+
+            logger.error(
+                'Worker #%s (pid=%s) unexpectedly exited (%s). Restart it in %ss',
+                index,
+                pid,
+                _format_exit_status(status),
+                self.restart_delay,
+            )
+            time.sleep(self.restart_delay)
+            if not self._stopping:
+                self._spawn(index)
+
+    def _on_stop_signal(self, signum, frame):
+        if self._stopping:
+            return
+
+        logger.info('Stop workers ...')
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _forward_signal(self, signum, frame):
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid != 0:
+            self._children[pid] = index
+            logger.info('Worker #%s started (pid=%s)', index, pid)
+            return
+
+        # worker process
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        code = os.EX_OK
+        try:
+            self.target(WorkerContext(index=index))
+        except BaseException:  # noqa: B902
+            logger.exception('Worker #%s crashed', index)
+            code = os.EX_SOFTWARE
+        finally:
+            # never return to supervisor code
+            os._exit(code)  # noqa: WPS421
@@ -65,4 +65,5 @@ def _check_no_errors(caplog):
 
 pytest_plugins = [
     'tests.fixtures.config',
+    'tests.fixtures.responses',
 ]
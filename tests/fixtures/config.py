@@ -144,6 +144,7 @@ class ConfigManager:
             # make it afterwards to allow make pre-parsing actions
             _ = config.ebpf
             _ = config.servers
+            _ = config.scheduler
 
             config.setup(old_settings)
 
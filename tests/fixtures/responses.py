@@ -0,0 +1,28 @@
+"""Raw responses of real game servers"""
+import pytest
+
+
+RUST_INFO_RESPONSE = b'\xff\xff\xff\xffI\x11ZOZO.GG | X2/X5 | INSTA | REM | TP | KITS | WIPE 6.02\x00Procedural Map\x00rust\x00Rust\x00\x00\x00\x00<\x00dl\x00\x012215\x00\xb1om\x07\xcc\xf6ra7@\x01mp60,cp0,qp0,v2215,h986958cf,stok,born1581024860,gmrust,oxide,modded\x00J\xda\x03\x00\x00\x00\x00\x00'  # noqa: E501
+RUST_RULES_RESPONSE = b'\xff\xff\xff\xffE"\x00build\x0046638\x00description_0\x00\x00description_00\x00\xd0\xa1\xd0\xb5\xd1\x80\xd0\xb2\xd0\xb5\xd1\x80 \xd1\x81\xd0\xbe\xd0\xbe\xd0\xb1\xd1\x89\xd0\xb5\xd1\x81\xd1\x82\xd0\xb2\xd0\xb0 ZOZO.GG\\n\\n- \xd0\x9c\xd0\xb3\xd0\xbd\xd0\xbe\xd0\xb2\xd0\xb5\xd0\xbd\xd0\xbd\xd1\x8b\xd0\xb9 \xd0\xba\xd1\x80\xd0\xb0\xd1\x84\xd1\x82\\n- \xd0\xa0\xd0\xb5\xd0\xb9\xd1\x82\xd1\x8b: \xd1\x852 (\xd0\xb4\xd0\xb5\xd0\xbd\xd1\x8c) / \xd1\x855 (\xd0\xbd\xd0\xbe\xd1\x87\xd1\x8c)                     \x00description_01\x00           \\n- \xd0\xa0\xd0\xb5\xd0\xbc\xd1\x83\xd0\xb2 \xd1\x82\xd0\xbe\xd0\xbb\xd1\x8c\xd0\xba\xd0\xbe \xd0\xbd\xd0\xb0 \xd1\x81\xd0\xb2\xd0\xbe\xd0\xb8 \xd0\xbf\xd0\xbe\xd1\x81\xd1\x82\xd1\x80\xd0\xbe\xd0\xb9\xd0\xba\xd0\xb8\\n- \xd0\xa1\xd1\x82\xd0\xb0\xd1\x80\xd1\x82\xd0\xbe\xd0\xb2\xd1\x8b\xd0\xb5 \xd0\xbd\xd0\xb0\xd0\xb1\xd0\xbe\xd1\x80\xd1\x8b \xd0\xb4\xd0\xbb\xd1\x8f \xd0\xb2\xd1\x81\xd0\xb5\xd1\x85\x00description_02\x00\x00description_03\x00\x00description_04\x00\x00description_05\x00\x00description_06\x00\x00description_07\x00\x00description_08\x00\x00description_09\x00\x00description_10\x00\x00description_11\x00\x00description_12\x00\x00description_13\x00\x00description_14\x00\x00description_15\x00\x00ent_cnt\x0071167\x00fps\x00226\x00fps_avg\x00227.28\x00gc_cl\x00150\x00gc_mb\x001119\x00gmd\x00The default Rust survival gamemode\x00gmn\x00rust\x00gmt\x00Rust: Survival Mode\x00gmu\x00https://rust.facepunch.com\x00hash\x00986958cf\x00headerimage\x00http://i.imgur.com/1SHlsXX.jpg\x00pve\x00False\x00uptime\x0023944\x00url\x00http://zozo.gg/\x00world.seed\x004218819\x00world.size\x004000\x00'  # noqa: E501
+RUST_PLAYERS_RESPONSE = b'\xff\xff\xff\xffD\x01\x00MyHangryLord\x00\x00\x00\x00\x00\x17\\LD'
+CSS_RULES_RESPONSE_FRAGMENT_COMPRESSED = b'\xfe\xff\xff\xffL\x80\x00\x80\x01\x00"\x06\x00\x00\xbc\x06[\x18BZh91AY&SY\x06\x82\x1b\x00\x00\x03\x11_\x80\xc0\x00@\x0f\x7f\xe0oS\xc9\x10\xbf\xef\xff\xf0\x00\x00\xd0\x038\xa9oS\xab\xb2\xd8\xc3\x12jh\x02`A\r\x00\xd1\xea\x004\xf5\x00i\x06\x9a\nz\x8d\x01\xa0\x00\x00\x00\x000\x84HOH\x03 h\x00\x00\x00\x0c\x00\x00\x00\x00\xd0h\x03@4\x02H\x814\x9e\x9a#F\xa2~\x94h\x00\x00\x00\xf5;\xfa\xbd}\xdf\xe7\xc3K\xba\x18p\xfd\xe0W\xa7\xb7\xa4\xda\xf3\x84B\xb4\xd2\x8c)\x08 ZF\x02\x9c\xd89y&D|\x05\x7f\xea\xea\xb6M\xdf\xb44b\xf4g\xc8\x9e\xd2\x12R\x0b\x81\x1f\x05\x01\x00\x96\xaeH\xe4\xcdZ\xa42\x96U\x91J\x12\x90\x80\xcbz\x84\x08\xfbdc\xe3\xf5\xc1\xfb\xf3?\xe6Q\x11\\y\xad\xd7\xddg\xea\xc9^\xc8\x00\xd8I\x94\x1c$P\x82\xf9\xb2s\x04\x04\x99\x93\x08j\xfb,\x89J\x834\x9b-\'\x15\xbf\x02\xd3B\xc8\x10\xa50;P\x10\x8aF\x08\x9c\xd8\xe6\xefm\r:\xb1\x0c\xd4P\x99}\xc5\xaeA\xeeD1\xea\x95\xa1N\x86\x8c7\x8c\x88\x84\xaa\x03A\x13\xef\x1e\x1ai7B\xdd52\xd7\xde\x92T\x0f2w\x88$\x12])\xf7/\xcbQf\x85\x90i\xa4\xd9m\x10\xb9S0\xc32\xc0f\x0b\xd37\xf0~o\x0bS\xb4\xc0\xa0\xb0t\x811\x8a\xbb\xa8\x13\x94\x83\x11\\\xd3\xdc\x1au\x0cJ1\n\x0e\xf0D\xb1\x99g\x8c2]\xcaZY\r\xcc\xc0\xc0)bnP\xac\x99?4IL\xa1\x04d7\xed\x04\x16 \x96j\xbd\x06\xaaCIN\x96H\xb1\xa6k\'\xbcw\x99\xbc\x94D\x84\x12\xb4\x18\xc2\xf6\x90\xa5\xb2Of\x8d\xf4\xd3\xa5\x87h\x7f\xb3\x99\xd9\x82s\xa4\xf7\x926\x8c6v&\xb5C\xa3\x1a\xf6O\x1f\xc7cx\xcd\x19\xb6\x08\xa6\x89\xfe\xfb\xa2+\x8f\x15UW\xba1~\x96\x05\x7f,\x1ei\xb1\xbcQY9\x0b96s\x8cw-H\xc5\x01=l%4\x1ci\x83\xedlov\xe5\xa5\xf0\x91\xcd\x97\x18\xd7%[\xae\x896$\xc1\xd6\x18V,!\x98\x8a\xb1\xfdZ\xf3\x8c\xf6]\xd7;Q\xaaT,j\x95;\x8b\xc3\xaa\xd5*.Es9\xbe2`\xe7TE\xe8%\x950B\x1e\x0f\x85^\xa3a\x04D \\\x0cq\xcc#H\x1a\x11t\x16w\xbf\x02\x89\x01\x13\x9bU\x99\x15\x19\xd0Gw\x18\x9dc#\xad\xe2Bm@\xads\xf4tZ\xc1g\xcc^\xbe\xbd\xfdL\xb4\xb2I\xb0\x93\xbbnJ\x0e]J\x9bJ\xafB\xf2?>-\'<\xb36\xd5:A\x0e\xfd\x95B$\x8aQ\x19\xef\xaf\xbdZ09s2\xd6\x92[\xdc\x96G\x0c\x9c\x04\xe0\x8cXG\x10w\x08\xd0\x1cl\xe2\xd2\x12f\xaf\x85Ov\xfb\xa9\xfeM\x1dlv\xa9\xaf\xc7"\xdc\x1a\xca\xad\x9c\x83V\xb2,b\x16\xd7Y\x9bAs\xe0\xa0^\x18#\xc3\xc3\x91\x03!\n\xfa-\xd6#\x96\xab\xca\xca\xb1\x8ds\xd2\x02\x98\r\x94\x8aAD\x8b{\xa7\xca\x9f\xbb\x1c5\x19r\xc5\xf8B\xf6\x8b\x04\x8fN\x9c\x8e/N\xd0\x9a\x86.a|\xdc\xd0\x9c\xc1ra\x99#\x124\x056\x8e\x91EX)4(\xd9\x8a\n\xea\xef,$*\xbf\x8e?\xe2\xeeH\xa7\n\x12\x00\xd0C`\x00'  # noqa: E501
+
+
+@pytest.fixture()
+def rust_info_response_bytes():
+    return RUST_INFO_RESPONSE
+
+
+@pytest.fixture()
+def rust_rules_response_bytes():
+    return RUST_RULES_RESPONSE
+
+
+@pytest.fixture()
+def rust_players_response_bytes():
+    return RUST_PLAYERS_RESPONSE
+
+
+@pytest.fixture()
+def css_rules_response_bytes__fragmented__compressed():
+    return CSS_RULES_RESPONSE_FRAGMENT_COMPRESSED
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from source_query_proxy import acl
+from source_query_proxy.acl import AccessListSource
+from source_query_proxy.acl import NetworkSet
+from source_query_proxy.acl import ip_to_int
+from source_query_proxy.acl import parse_network
+
+pytestmark = [pytest.mark.asyncio]
+
+
+def test_parse_network():
+    assert parse_network('10.0.0.0/8') == (ip_to_int('10.0.0.0'), ip_to_int('10.255.255.255'))
+    assert parse_network('10.1.2.3') == (ip_to_int('10.1.2.3'), ip_to_int('10.1.2.3'))
+    # host bits ignored
+    assert parse_network('10.1.2.3/24') == parse_network('10.1.2.0/24')
+    assert parse_network('0.0.0.0/0') == (0, 2 ** 32 - 1)
+
+    for network in ['10.0.0.0/33', '10.0.0/8', 'example.com']:
+        with pytest.raises((OSError, ValueError)):
+            parse_network(network)
+
+
+def test_network_set():
+    networks = NetworkSet(
+        parse_network(network) for network in ['10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25', '192.168.1.1']
+    )
+    assert len(networks) == 2  # merged
+
+    for host in ['10.0.0.0', '10.0.1.255', '192.168.1.1']:
+        assert ip_to_int(host) in networks
+    for host in ['9.255.255.255', '10.0.2.0', '192.168.1.0', '192.168.1.2', '255.255.255.255']:
+        assert ip_to_int(host) not in networks
+    assert 0 not in NetworkSet()
+
+
+def test_allow_has_priority():
+    source = AccessListSource(allow=['10.0.0.1'], deny=['10.0.0.0/8'])
+    assert source.current.check(ip_to_int('10.0.0.1')) is acl.ALLOW
+    assert source.current.check(ip_to_int('10.0.0.2')) is acl.DENY
+    assert source.current.check(ip_to_int('11.0.0.1')) is None
+
+
+async def test_reloaded(tmp_path):
+    path = tmp_path / 'deny.txt'
+    path.write_text('# bad\n10.0.0.0/8\n\nbroken line\n192.168.0.1  # single\n')
+    source = AccessListSource(deny_files=[path])
+    assert not source.allow_files and source.reloadable
+
+    old = source.current
+    assert old.check(ip_to_int('10.1.1.1')) is acl.DENY
+    assert old.check(ip_to_int('192.168.0.1')) is acl.DENY
+    assert not await source.reload()
+
+    path.write_text('172.16.0.0/12\n')
+    os.utime(path, ns=(0, 0))
+    assert await source.reload()
+    assert source.current is not old
+    assert source.current.check(ip_to_int('10.1.1.1')) is None
+    assert source.current.check(ip_to_int('172.16.5.5')) is acl.DENY
+
+    # removed file is empty list
+    path.unlink()
+    assert await source.reload()
+    assert source.current.check(ip_to_int('172.16.5.5')) is None
+
+
+def test_large_list():
+    networks = [f'{a}.{b}.{c}.0/24' for a in (10, 20) for b in range(256) for c in range(0, 256, 2)]
+    source = AccessListSource(deny=networks)
+    deny = source.current.deny
+    assert len(deny) == 2 * 256 * 128
+    assert deny._starts.itemsize * len(deny) * 2 <= 1024 * 1024
+    assert ip_to_int('20.100.4.1') in deny
+    assert ip_to_int('20.100.5.1') not in deny
@@ -0,0 +1,44 @@
+import struct
+
+import pytest
+
+from source_query_proxy.challenge import ChallengeIssuer
+
+HOST = '127.0.0.1'
+
+
+@pytest.fixture()
+def issuer():
+    return ChallengeIssuer(lifetime=10)
+
+
+def test_valid_for_two_epochs(issuer):
+    challenge = issuer.issue(HOST, now=15)
+
+    assert issuer.verify(challenge, HOST, now=15)
+    assert issuer.verify(challenge, HOST, now=29.9)
+    assert not issuer.verify(challenge, HOST, now=30)
+    assert issuer.stats == {'issued': 1, 'accepted': 2, 'rejected': 1}
+
+
+def test_rotated(issuer):
+    assert issuer.issue(HOST, now=5) != issuer.issue(HOST, now=15)
+    assert issuer.verify(issuer.issue(HOST, now=5), HOST, now=5)
+
+
+def test_per_client(issuer):
+    challenge = issuer.issue(HOST, now=0)
+    assert not issuer.verify(challenge, '127.0.0.2', now=0)
+    assert not issuer.verify(challenge, HOST + '1', now=0)
+
+
+def test_per_secret():
+    challenge = ChallengeIssuer(secret=b'a').issue(HOST, now=0)
+    assert ChallengeIssuer(secret=b'a').verify(challenge, HOST, now=0)
+    assert not ChallengeIssuer(secret=b'b').verify(challenge, HOST, now=0)
+
+
+def test_positive(issuer):
+    for index in range(1000):
+        challenge, = struct.unpack('<l', issuer.issue(f'10.0.{index // 256}.{index % 256}', now=index))
+        assert challenge >= 0
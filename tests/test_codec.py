@@ -0,0 +1,216 @@
+import struct
+
+import pytest
+
+from source_query_proxy.source import codec
+from source_query_proxy.source import messages
+from source_query_proxy.source import util
+from source_query_proxy.transport import SourceDatagramClient
+from tests.fixtures.responses import RUST_INFO_RESPONSE
+from tests.fixtures.responses import RUST_PLAYERS_RESPONSE
+from tests.fixtures.responses import RUST_RULES_RESPONSE
+
+HEADER_SIZE = 4
+
+MASTER_SERVER_RESPONSE = bytes([0xFF, 0xFF, 0xFF, 0xFF, 0x66, 0x0A, 10, 0, 0, 1, 0x69, 0x87, 0, 0, 0, 0, 0, 0])
+
+DECODE_CASES = [
+    (messages.InfoResponse, RUST_INFO_RESPONSE[HEADER_SIZE:]),
+    (messages.PlayersResponse, RUST_PLAYERS_RESPONSE[HEADER_SIZE:]),
+    (messages.RulesResponse, RUST_RULES_RESPONSE[HEADER_SIZE:]),
+    (messages.InfoRequest, messages.InfoRequest().encode()[HEADER_SIZE:]),
+    (messages.InfoRequestV2, messages.InfoRequestV2(challenge=0xBEEF).encode()[HEADER_SIZE:]),
+    (messages.InfoRequestV2, messages.InfoRequest().encode()[HEADER_SIZE:]),
+    (messages.PlayersRequest, messages.PlayersRequest(challenge=-1).encode()[HEADER_SIZE:]),
+    (messages.GetChallengeResponse, messages.GetChallengeResponse(challenge=0xBEEF).encode()[HEADER_SIZE:]),
+    (messages.Header, RUST_INFO_RESPONSE),
+    (messages.Header, b'\x00\x00\x00\x00'),
+    (messages.Fragment, b'\x01\x00\x00\x00\x02\x00\xe0\x04payload'),
+    (messages.MasterServerResponse, MASTER_SERVER_RESPONSE),
+    # truncated and broken
+    (messages.InfoResponse, RUST_INFO_RESPONSE[HEADER_SIZE:40]),
+    (messages.PlayersResponse, RUST_PLAYERS_RESPONSE[HEADER_SIZE:-2]),
+    (messages.RulesResponse, RUST_RULES_RESPONSE[HEADER_SIZE:-10]),
+    (messages.RulesResponse, RUST_RULES_RESPONSE[HEADER_SIZE:-1]),
+    (messages.PlayersRequest, b'U\x01'),
+    (messages.PlayersRequest, b'V\x01\x00\x00\x00'),
+    (messages.Fragment, b''),
+]
+
+
+def _decode(decode, cls, packet):
+    try:
+        return decode(cls, packet)
+    except messages.BrokenMessageError as exc:
+        return type(exc)
+
+
+@pytest.mark.parametrize(('cls', 'packet'), DECODE_CASES)
+def test_decode_same_as_reference(cls, packet):
+    expected = _decode(codec.reference_decode, cls, packet)
+    result = _decode(lambda cls, packet: cls.decode(packet), cls, packet)
+
+    assert result == expected
+    if isinstance(expected, messages.Message):
+        assert result.raw_tail == expected.raw_tail
+        assert type(result) is cls
+
+
+@pytest.mark.parametrize(('cls', 'packet'), DECODE_CASES)
+def test_lazy_decode_same_as_reference(cls, packet):
+    expected = _decode(codec.reference_decode, cls, packet)
+    result = _decode(lambda cls, packet: cls.decode(packet, lazy=True), cls, packet)
+
+    if isinstance(expected, messages.Message):
+        assert result.raw_tail == expected.raw_tail
+        assert result == expected
+    else:
+        assert result == expected
+
+
+def test_lazy_decode_values_on_access():
+    message = messages.RulesResponse.decode(RUST_RULES_RESPONSE, messages.HEADER_SIZE, lazy=True)
+    assert message._values is None
+
+    assert message['rule_count'] == len(message['rules'])
+    assert message._values is not None
+
+
+def test_decode_response_lazy():
+    message = SourceDatagramClient.decode_response(SourceDatagramClient, RUST_INFO_RESPONSE)
+
+    assert isinstance(message, messages.InfoResponse)
+    assert message._values is None
+    assert message['map'] == 'Procedural Map'
+
+
+def test_decode_values():
+    response = messages.InfoResponse.decode(RUST_INFO_RESPONSE[HEADER_SIZE:])
+
+    assert response['map'] == 'Procedural Map'
+    assert response['app_id'] == 0
+    assert response['server_type'] == util.ServerType.DEDICATED
+    assert response['platform'] == util.Platform.LINUX
+    assert response['version'] == '2215'
+
+
+def test_decode_dict():
+    response = messages.RulesResponse.decode(RUST_RULES_RESPONSE[HEADER_SIZE:])
+    reference = codec.reference_decode(messages.RulesResponse, RUST_RULES_RESPONSE[HEADER_SIZE:])
+
+    assert len(response['rules']) == response['rule_count']
+    assert list(response['rules'].items()) == list(reference['rules'].items())
+
+
+def test_decode_array_backtracks_to_entry_start():
+    class Entry(messages.Message):
+        fields = (messages.LongFieldLE('long'), messages.ShortFieldLE('short'))
+
+    class Message(messages.Message):
+        fields = (
+            messages.MessageArrayField('entries', Entry, messages.MessageArrayField.all()),
+            messages.ByteField('byte'),
+        )
+
+    packet = b'\x01\x00\x00\x00\x02\x00\xff\xff\xff\xff\x00'
+    message = Message.decode(packet)
+
+    assert message == codec.reference_decode(Message, packet)
+    assert message['byte'] == 0xFF
+    assert message.raw_tail == b'\xff\xff\xff\x00'
+
+
+def test_decode_raw_tail_not_copied():
+    players = b''.join(bytes([index]) + b'player\x00' + bytes(8) for index in range(64))
+    packet = b'\xff\xff\xff\xffD\x40' + players + b'tail'
+    message = messages.PlayersResponse.decode(packet, messages.HEADER_SIZE)
+
+    assert len(message['players']) == 64
+    assert isinstance(message.raw_tail, memoryview)
+    assert message.raw_tail.obj is packet
+    assert message.raw_tail == b'tail'
+    assert message['players'][-1].raw_tail.obj is packet
+
+
+def test_compact_entries():
+    message = messages.PlayersResponse.decode(RUST_PLAYERS_RESPONSE, messages.HEADER_SIZE)
+    entry = message['players'][0]
+
+    assert not hasattr(entry, '__dict__')
+    assert isinstance(entry._values, tuple)
+    assert entry['name'] == 'MyHangryLord'
+    assert list(entry) == ['index', 'name', 'score', 'duration']
+    assert len(entry) == 4
+    assert entry.get('missing') is None
+    assert entry == messages.PlayerEntry(**dict(entry))
+
+    entry['score'] = 10
+    assert entry['score'] == 10
+    assert entry.values == {'index': 0, 'name': 'MyHangryLord', 'score': 10, 'duration': entry['duration']}
+
+
+def test_decode_default_on_broken():
+    assert messages.InfoResponse.decode(b'I', default=None) is None
+
+
+@pytest.mark.parametrize(
+    ('cls', 'values'),
+    [
+        (messages.InfoRequest, {}),
+        (messages.InfoRequestV2, {}),
+        (messages.InfoRequestV2, {'challenge': 0xBEEF}),
+        (messages.PlayersRequest, {'challenge': -1}),
+        (messages.GetChallengeResponse, {'challenge': 0xBEEF}),
+        (messages.Fragment, {'message_id': 1, 'fragment_count': 2, 'fragment_id': 0, 'mtu': 1200}),
+        (messages.Header, {'split': messages.SPLIT}),
+        (
+            messages.PlayersResponse,
+            {
+                'response_type': 0x44,
+                'player_count': 1,
+                'players': [messages.PlayerEntry(index=0, name='player', score=10, duration=1.5)],
+            },
+        ),
+    ],
+)
+def test_encode_same_as_reference(cls, values):
+    expected = codec.reference_encode(cls, values)
+
+    assert codec.get_codec(cls).encode(values) == expected
+    if issubclass(cls, messages.Packet):
+        assert cls(**values).encode()[HEADER_SIZE:] == expected
+
+
+@pytest.mark.parametrize(
+    ('cls', 'values', 'exc_type'),
+    [
+        (messages.PlayersRequest, {}, ValueError),
+        (messages.PlayersRequest, {'challenge': 1 << 40}, messages.BrokenMessageError),
+        (messages.PlayersRequest, {'request_type': 0, 'challenge': 1}, messages.BrokenMessageError),
+    ],
+)
+def test_encode_errors(cls, values, exc_type):
+    with pytest.raises(exc_type):
+        codec.reference_encode(cls, values)
+    with pytest.raises(exc_type):
+        cls(**values).encode()
+
+
+def test_fixed_width_fields_merged():
+    steps = codec.get_codec(messages.Fragment)._decode_steps
+    assert len(steps) == 1
+
+    # byte+byte, 4 strings, short+byte*6, string
+    assert len(codec.get_codec(messages.InfoResponse)._decode_steps) == 7
+
+
+def test_codec_not_inherited():
+    assert codec.get_codec(messages.InfoRequestV2) is not codec.get_codec(messages.InfoRequest)
+    message = messages.InfoRequestV2.decode(messages.InfoRequestV2(challenge=1).encode()[HEADER_SIZE:])
+    assert message['challenge'] == 1
+
+
+def test_split_header():
+    assert messages.Fragment(message_id=1, fragment_count=1, fragment_id=0, mtu=1).encode(split_header=True)[
+        :HEADER_SIZE
+    ] == struct.pack('<l', messages.SPLIT)
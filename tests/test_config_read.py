@@ -107,3 +107,26 @@ def test_missing_bind_port_chosen_automatically_random(config, dummy1_bind_port,
     assert config.settings.servers[0][1].network.bind_port == 8888
     assert is_port_available_mock.called
     assert get_available_port_mock.called
+
+
+def test_scheduler_defaults(config):
+    assert config.settings.scheduler == sqproxy_config.SchedulerModel()
+
+
+def test_scheduler_configured(config_manager, conf_d_globals):
+    config_manager.add_config(
+        '01-scheduler.yaml',
+        '''
+scheduler:
+  jitter: 0.3
+  max_in_flight: 8
+''',
+    )
+    with config_manager.setup() as config:
+        assert config.settings.scheduler.jitter == 0.3
+        assert config.settings.scheduler.max_in_flight == 8
+
+
+def test_overload_disabled_by_default(config):
+    assert not config.settings.overload.enabled
+    assert not sqproxy_config.OverloadModel().enabled
@@ -0,0 +1,89 @@
+import bz2
+import os
+import struct
+import zlib
+
+import pytest
+
+from source_query_proxy.decompress import Decompressor
+from source_query_proxy.source import messages
+from source_query_proxy.transport import SourceDatagramStream
+from tests.fixtures.responses import CSS_RULES_RESPONSE_FRAGMENT_COMPRESSED
+
+pytestmark = [pytest.mark.asyncio]
+
+PAYLOAD = b'\xff\xff\xff\xffE' + b'rule\x00value\x00' * 1000
+
+
+def compressed_fragments(payload, message_id=7, mtu=1000):
+    data = bz2.compress(payload)
+    chunks = [data[offset : offset + mtu] for offset in range(0, len(data), mtu)]
+    fragments = []
+    for fragment_id, chunk in enumerate(chunks):
+        header = struct.pack('<lLBB', messages.SPLIT, message_id | 1 << 31, len(chunks), fragment_id)
+        if fragment_id == 0:
+            header += struct.pack('<lL', len(payload), zlib.crc32(payload))
+        fragments.append(header + chunk)
+    return fragments
+
+
+def test_decompress_fixture():
+    fragment = messages.CompressedFragment.decode(CSS_RULES_RESPONSE_FRAGMENT_COMPRESSED, messages.HEADER_SIZE)
+    response = messages.RulesResponse.decode(fragment.content, messages.HEADER_SIZE)
+    assert len(response['rules']) == response['rule_count']
+
+
+@pytest.mark.parametrize(
+    ('size', 'crc', 'max_size'),
+    [
+        (len(PAYLOAD) - 1, zlib.crc32(PAYLOAD), messages.MAX_DECOMPRESSED_SIZE),
+        (len(PAYLOAD) + 1, zlib.crc32(PAYLOAD), messages.MAX_DECOMPRESSED_SIZE),
+        (len(PAYLOAD), zlib.crc32(PAYLOAD) + 1, messages.MAX_DECOMPRESSED_SIZE),
+        (len(PAYLOAD), zlib.crc32(PAYLOAD), len(PAYLOAD) - 1),
+        (-1, zlib.crc32(PAYLOAD), messages.MAX_DECOMPRESSED_SIZE),
+    ],
+    ids=['declared-smaller', 'declared-larger', 'crc', 'limit', 'negative'],
+)
+def test_decompress_mismatch(size, crc, max_size):
+    with pytest.raises(messages.BrokenMessageError):
+        messages.decompress(bz2.compress(PAYLOAD), size, crc, max_size)
+
+
+def test_decompress_bomb_not_expanded():
+    bomb = bz2.compress(bytes(100 * 1024 * 1024))
+    assert len(bomb) < 1024
+
+    with pytest.raises(messages.BrokenMessageError, match='size mismatch'):
+        messages.decompress(bomb, 100, 0)
+
+
+def test_decompress_broken_data():
+    with pytest.raises(messages.BrokenMessageError):
+        messages.decompress(b'BZh9garbage', 10, 0)
+
+
+@pytest.mark.parametrize('offload_threshold', [0, 1024 * 1024], ids=['offloaded', 'in-loop'])
+async def test_decompressor_stats(offload_threshold):
+    decompressor = Decompressor(offload_threshold=offload_threshold)
+    data = bz2.compress(PAYLOAD)
+
+    assert await decompressor.decompress_async(data, len(PAYLOAD), zlib.crc32(PAYLOAD)) == PAYLOAD
+    with pytest.raises(messages.BrokenMessageError):
+        await decompressor.decompress_async(data, len(PAYLOAD), 0)
+
+    assert decompressor.stats['decompressed'] == 2
+    assert decompressor.stats['errors'] == 1
+    assert decompressor.stats['offloaded'] == (2 if offload_threshold == 0 else 0)
+    assert 0 < decompressor.time_max <= decompressor.time_total
+
+
+async def test_reassemble_compressed(mocker):
+    payload = os.urandom(5000)  # not compressible
+    fragments = compressed_fragments(payload)
+    assert len(fragments) > 2
+
+    stream = SourceDatagramStream(mocker.Mock(), None, None, None)
+    results = [stream.handle_fragments(fragment, ('127.0.0.1', 27015)) for fragment in reversed(fragments)]
+
+    assert results[:-1] == [None] * (len(fragments) - 1)
+    assert results[-1] == payload
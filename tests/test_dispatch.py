@@ -0,0 +1,51 @@
+import struct
+
+import pytest
+
+from source_query_proxy import dispatch
+from source_query_proxy.source import messages
+from source_query_proxy.transport import SourceDatagramServer
+from source_query_proxy.transport import decode_packet
+
+
+@pytest.fixture()
+def classifier():
+    return dispatch.RequestClassifier()
+
+
+@pytest.mark.parametrize(
+    ('packet', 'expected_kind', 'expected_cls'),
+    [
+        (messages.InfoRequest().encode(), dispatch.A2S_INFO, messages.InfoRequest),
+        (messages.InfoRequestV2(challenge=0xBEEF).encode(), dispatch.A2S_INFO, messages.InfoRequestV2),
+        (messages.PlayersRequest(challenge=0xBEEF).encode(), dispatch.A2S_PLAYERS, messages.PlayersRequest),
+        (messages.RulesRequest(challenge=0xBEEF).encode(), dispatch.A2S_RULES, messages.RulesRequest),
+        (messages.RulesRequest(challenge=-1).encode(), dispatch.A2S_RULES, messages.RulesRequest),
+    ],
+)
+def test_classify_same_as_decode(classifier, packet, expected_kind, expected_cls):
+    kind, challenge = classifier.classify(packet)
+
+    message = decode_packet(packet, msg_classes=SourceDatagramServer.request_message_classes)
+    assert isinstance(message, expected_cls)
+    assert kind == expected_kind
+
+    if challenge is None:
+        assert message.get('challenge') is None
+    else:
+        assert struct.unpack('<l', challenge)[0] == message['challenge']
+
+
+@pytest.mark.parametrize(
+    'packet',
+    [
+        b'',
+        b'\xFF\xFF\xFF\xFF',
+        b'\xFF\xFF\xFF\xFF\0\0\0\0',
+        messages.InfoRequest(payload='Other Query').encode(),
+        messages.PlayersRequest(challenge=0xBEEF).encode() + b'\0',
+        messages.PlayersRequest(challenge=0xBEEF).encode(split_header=True),
+    ],
+)
+def test_classify_unknown_layout(classifier, packet):
+    assert classifier.classify(packet) is None
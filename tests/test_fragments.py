@@ -0,0 +1,91 @@
+import pytest
+
+from source_query_proxy.fragments import FragmentReassembler
+
+SOURCE = ('127.0.0.1', 27015)
+OTHER_SOURCE = ('127.0.0.2', 27015)
+
+
+@pytest.fixture()
+def reassembler():
+    return FragmentReassembler(timeout=1, max_packets=4, max_packets_per_source=2, max_bytes=100, max_fragments=10)
+
+
+def test_reassemble_any_order(reassembler):
+    assert reassembler.add(SOURCE, 1, 2, 3, b'c', now=0) is None
+    assert reassembler.add(SOURCE, 1, 0, 3, b'a', now=0) is None
+    assert reassembler.add(SOURCE, 1, 0, 3, b'a', now=0) is None
+    assert reassembler.add(SOURCE, 1, 1, 3, b'b', now=0) == b'abc'
+
+    assert len(reassembler) == 0
+    assert reassembler.size == 0
+    assert reassembler.stats == {'completed': 1, 'duplicates': 1}
+
+
+def test_sources_not_mixed(reassembler):
+    assert reassembler.add(SOURCE, 1, 0, 2, b'a', now=0) is None
+    assert reassembler.add(OTHER_SOURCE, 1, 1, 2, b'y', now=0) is None
+    assert reassembler.add(OTHER_SOURCE, 1, 0, 2, b'x', now=0) == b'xy'
+    assert reassembler.add(SOURCE, 1, 1, 2, b'b', now=0) == b'ab'
+
+
+@pytest.mark.parametrize(('fragment_id', 'fragment_count'), [(0, 0), (0, 11), (5, 2)])
+def test_broken_fragment_numbers(reassembler, fragment_id, fragment_count):
+    assert reassembler.add(SOURCE, 1, 0, 2, b'a', now=0) is None
+    assert reassembler.add(SOURCE, 2, fragment_id, fragment_count, b'b', now=0) is None
+    assert len(reassembler) == 1
+    if fragment_id:
+        assert reassembler.add(SOURCE, 1, fragment_id, 2, b'b', now=0) is None
+
+    assert reassembler.stats['dropped'] == (2 if fragment_id else 1)
+
+
+def test_expired(reassembler):
+    reassembler.add(SOURCE, 1, 0, 2, b'a', now=0)
+    reassembler.add(SOURCE, 2, 0, 2, b'a', now=0.5)
+
+    assert reassembler.add(SOURCE, 1, 1, 2, b'b', now=1) is None
+    assert reassembler.stats['expired'] == 1
+    assert reassembler.add(SOURCE, 2, 1, 2, b'b', now=1) == b'ab'
+
+
+def test_limited_per_source(reassembler):
+    for message_id in range(3):
+        reassembler.add(SOURCE, message_id, 0, 2, b'a', now=0)
+    reassembler.add(OTHER_SOURCE, 0, 0, 2, b'a', now=0)
+
+    assert len(reassembler) == 3
+    assert reassembler.stats['evicted_per_source'] == 1
+    # the oldest one evicted
+    assert reassembler.add(SOURCE, 0, 1, 2, b'b', now=0) is None
+    assert reassembler.add(SOURCE, 2, 1, 2, b'b', now=0) == b'ab'
+
+
+def test_limited_count(reassembler):
+    sources = [(f'127.0.0.{index}', 27015) for index in range(1, 7)]
+    for source in sources:
+        reassembler.add(source, 1, 0, 2, b'a', now=0)
+
+    assert len(reassembler) == 4
+    assert reassembler.stats['evicted'] == 2
+    assert reassembler.add(sources[0], 1, 1, 2, b'b', now=0) is None
+
+
+def test_limited_bytes(reassembler):
+    for message_id in range(2):
+        reassembler.add((f'127.0.0.{message_id}', 27015), message_id, 0, 5, b'x' * 40, now=0)
+    assert reassembler.size == 80
+
+    reassembler.add(SOURCE, 9, 0, 5, b'x' * 40, now=0)
+    assert reassembler.size == 80
+    assert len(reassembler) == 2
+    assert reassembler.stats['evicted'] == 1
+
+
+def test_memory_flat_under_flood(reassembler):
+    for index in range(10000):
+        source = (f'10.0.{index // 256 % 256}.{index % 256}', 27015)
+        reassembler.add(source, index, 0, 10, b'x' * 30, now=index / 1000)
+
+    assert len(reassembler) <= 4
+    assert reassembler.size <= 100
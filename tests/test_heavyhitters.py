@@ -0,0 +1,96 @@
+import collections
+import random
+
+import pytest
+
+from source_query_proxy.heavyhitters import BanFeed
+from source_query_proxy.heavyhitters import HeavyHitterDetector
+from source_query_proxy.heavyhitters import SpaceSaving
+
+
+def test_space_saving_exact_under_capacity():
+    sketch = SpaceSaving(capacity=10)
+    for key, count in [('a', 5), ('b', 3), ('c', 1)]:
+        for _ in range(count):
+            sketch.add(key)
+
+    assert sketch.top(2) == [('a', 5, 0), ('b', 3, 0)]
+
+
+def test_space_saving_finds_heavy_hitters():
+    sketch = SpaceSaving(capacity=50)
+    rnd = random.Random(0)
+    stream = [f'10.0.{index // 256}.{index % 256}' for index in range(5000)]
+    stream += ['1.1.1.1'] * 500 + ['2.2.2.2'] * 300
+    rnd.shuffle(stream)
+
+    for key in stream:
+        sketch.add(key)
+
+    assert len(sketch) == 50
+    top = sketch.top(2)
+    assert [key for key, _count, _error in top] == ['1.1.1.1', '2.2.2.2']
+    for key, count, error in top:
+        # overestimated at most by error
+        assert count - error <= stream.count(key) <= count
+
+    # counts are consistent with buckets
+    counts = collections.Counter(count for _key, count, _error in sketch.top(100))
+    assert sum(counts.values()) == 50
+
+
+@pytest.fixture()
+def detector():
+    return HeavyHitterDetector(threshold=5, window=10, ban_time=60, capacity=16)
+
+
+def test_banned_on_threshold(detector):
+    assert [detector.add('1.1.1.1', now=100) for _ in range(6)] == [False] * 4 + [True, True]
+    assert not detector.add('2.2.2.2', now=100)
+
+    assert detector.get_bans(now=159) == ['1.1.1.1']
+    assert detector.get_bans(now=160) == []
+    assert not detector.add('1.1.1.1', now=160)
+    assert detector.stats['banned'] == 1
+
+
+def test_expired_bans_purged(detector, mocker):
+    mocker.patch('source_query_proxy.heavyhitters.MAX_BANS', 4)
+    detector.threshold = 1
+    for index in range(4):
+        assert detector.add(f'1.1.1.{index}', now=100)
+    assert not detector.add('2.2.2.2', now=100)  # too many bans
+
+    # expired bans purged on the next window without `get_bans()` calls
+    assert detector.add('2.2.2.2', now=200)
+    assert list(detector.bans) == ['2.2.2.2']
+
+
+def test_counts_reset_every_window(detector):
+    for now in range(0, 40, 3):
+        assert not detector.add('1.1.1.1', now=now)
+
+
+def test_flood_of_unique_sources_not_banned(detector):
+    for index in range(1000):
+        assert not detector.add(f'10.0.{index // 256}.{index % 256}', now=100)
+    assert not detector.bans
+
+
+def test_ban_feed(tmp_path, detector):
+    other = HeavyHitterDetector(threshold=1, window=10, ban_time=10)
+    path = tmp_path / 'bans.txt'
+    feed = BanFeed(path, [detector, other])
+
+    assert feed.update(now=0)
+    assert path.read_text() == ''
+
+    for _ in range(5):
+        detector.add('2.2.2.2', now=0)
+    other.add('1.1.1.1', now=0)
+    assert feed.update(now=1)
+    assert path.read_text() == '1.1.1.1\n2.2.2.2\n'
+    assert not feed.update(now=2)
+
+    assert feed.update(now=20)
+    assert path.read_text() == '2.2.2.2\n'
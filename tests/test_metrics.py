@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+
+from source_query_proxy.config import ServerModel
+from source_query_proxy.metrics import COUNTER
+from source_query_proxy.metrics import GAUGE
+from source_query_proxy.metrics import Metric
+from source_query_proxy.metrics import MetricsRegistry
+from source_query_proxy.metrics import MetricsServer
+from source_query_proxy.metrics import collect_poller
+from source_query_proxy.metrics import collect_proxy
+from source_query_proxy.metrics import collect_scheduler
+from source_query_proxy.overload import LEVEL_RULES
+from source_query_proxy.overload import LoadShedder
+from source_query_proxy.poller import BackendPoller
+from source_query_proxy.proxy import QueryProxy
+from source_query_proxy.scheduler import PollScheduler
+from source_query_proxy.source import messages
+from source_query_proxy.transport import AnsweringProtocol
+
+CLIENT_ADDR = ('127.0.0.1', 27005)
+
+
+@pytest.fixture()
+def proxy(rust_info_response_bytes, rust_players_response_bytes, rust_rules_response_bytes):
+    proxy = QueryProxy(
+        ServerModel(
+            meta={},
+            network={'server_ip': '127.0.0.1', 'server_port': 27015, 'bind_ip': '127.0.0.1', 'bind_port': 27915},
+        ),
+        name='test',
+    )
+    proxy._store_response('a2s_info', rust_info_response_bytes)
+    proxy._store_response('a2s_players', rust_players_response_bytes)
+    proxy.resp_cache['a2s_rules'] = rust_rules_response_bytes
+    return proxy
+
+
+def _samples(text: str) -> dict:
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if line and not line.startswith('#'))
+
+
+def test_render():
+    metric = Metric('test_total', COUNTER, 'Test "counter"\nsecond line')
+    metric.add(1, server='a"b\\c')
+    metric.add(0.5)
+
+    assert metric.render() == [
+        '# HELP test_total Test "counter"\\nsecond line',
+        '# TYPE test_total counter',
+        'test_total{server="a\\"b\\\\c"} 1',
+        'test_total 0.5',
+    ]
+
+
+def test_registry_merges_metrics():
+    registry = MetricsRegistry()
+    registry.register(lambda: [Metric('test', GAUGE, 'Test').add(1, server='a')])
+    registry.register(lambda: [Metric('test', GAUGE, 'Test').add(2, server='b')])
+
+    assert registry.render() == '# HELP test Test\n# TYPE test gauge\ntest{server="a"} 1\ntest{server="b"} 2\n'
+
+
+def test_registry_failed_collector(caplog):
+    def broken():
+        raise ValueError
+
+    registry = MetricsRegistry()
+    registry.register(broken)
+    registry.register(lambda: [Metric('test', GAUGE, 'Test').add(1)])
+
+    with caplog.at_level('CRITICAL', logger='sqproxy.metrics'):
+        assert _samples(registry.render()) == {'test': '1'}
+
+
+@pytest.mark.asyncio
+async def test_collect_proxy(proxy, mocker):
+    proxy.online = True
+    proxy.use_load_shedder(LoadShedder())
+    proxy.shedder.level = LEVEL_RULES
+    challenge = proxy.challenge_for(CLIENT_ADDR[0])
+    protocol = AnsweringProtocol(proxy.handle_request, sent_stats=proxy.response_stats)
+    protocol.connection_made(mocker.Mock())
+
+    players_request = messages.PlayersRequest(challenge=challenge).encode()
+    protocol.datagram_received(players_request, CLIENT_ADDR)
+    protocol.pause_writing()
+    protocol.datagram_received(players_request, CLIENT_ADDR)  # not sent, so not answered
+    protocol.resume_writing()
+    protocol.datagram_received(messages.RulesRequest(challenge=challenge).encode(), CLIENT_ADDR)
+    protocol.datagram_received(b'\xff\xff\xff\xffbroken', CLIENT_ADDR)
+    proxy.online = False
+    protocol.datagram_received(messages.InfoRequest().encode(), CLIENT_ADDR)
+    proxy.recv_stats = protocol.stats
+    protocol.stats['dropped'] = 3  # as receive queue of listening socket
+
+    registry = MetricsRegistry()
+    registry.register(lambda: collect_proxy(proxy))
+    samples = _samples(registry.render())
+
+    assert samples['sqproxy_server_online{server="test"}'] == '0'
+    assert samples['sqproxy_requests_total{kind="a2s_players",server="test"}'] == '2'
+    assert samples['sqproxy_requests_total{kind="a2s_rules",server="test"}'] == '1'
+    assert samples['sqproxy_answers_total{server="test"}'] == '1'
+    assert samples['sqproxy_sent_bytes_total{server="test"}'] == str(len(proxy.resp_cache['a2s_players']))
+    assert samples['sqproxy_dropped_requests_total{reason="send_paused",server="test"}'] == '1'
+    assert samples['sqproxy_dropped_requests_total{reason="malformed",server="test"}'] == '1'
+    assert samples['sqproxy_dropped_requests_total{reason="offline",server="test"}'] == '1'
+    assert samples['sqproxy_dropped_requests_total{reason="recv_queue_full",server="test"}'] == '3'
+    assert samples['sqproxy_shed_requests_total{kind="a2s_rules",server="test"}'] == '1'
+    assert samples['sqproxy_overload_level{server="test"}'] == '1'
+    assert samples['sqproxy_backend_polls_total{server="test",result="ok"}'] == '0'
+    assert samples['sqproxy_challenges_total{result="accepted",server="test"}'] == '2'
+    # stored by poll only
+    assert 0 <= float(samples['sqproxy_cache_age_seconds{kind="a2s_info",server="test"}']) < 1
+    assert 'sqproxy_cache_age_seconds{kind="a2s_rules",server="test"}' not in samples
+
+
+def test_collect_scheduler():
+    scheduler = PollScheduler()
+    scheduler.stats.update(polls=5, late_polls=1)
+    scheduler.in_flight = 2
+    scheduler.lateness_total = 1.5
+    scheduler.lateness_max = 0.5
+
+    samples = {metric.name: metric.samples for metric in collect_scheduler(scheduler)}
+    assert samples == {
+        'sqproxy_scheduler_events_total': [({'event': 'late_polls'}, 1), ({'event': 'polls'}, 5)],
+        'sqproxy_scheduler_queue_depth': [({}, 0)],
+        'sqproxy_scheduler_in_flight': [({}, 2)],
+        'sqproxy_scheduler_lateness_seconds_total': [({}, 1.5)],
+        'sqproxy_scheduler_lateness_seconds_max': [({}, 0.5)],
+    }
+
+
+@pytest.mark.asyncio
+async def test_collect_poller():
+    poller = BackendPoller(('127.0.0.1', 0))
+    await poller.start()
+    try:
+        poller.stream.fragments.stats['completed'] += 1
+        poller.stream.decompressor.stats['decompressed'] += 1
+        poller.stream.decompressor.time_max = 0.25
+
+        registry = MetricsRegistry()
+        registry.register(lambda: collect_poller(poller))
+        samples = _samples(registry.render())
+    finally:
+        poller.close()
+
+    assert samples['sqproxy_fragments_total{event="completed",socket="poller"}'] == '1'
+    assert samples['sqproxy_decompressions_total{event="decompressed",socket="poller"}'] == '1'
+    assert samples['sqproxy_decompression_seconds_max{socket="poller"}'] == '0.25'
+
+
+async def _http_request(port: int, request: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    response = await asyncio.wait_for(reader.read(), timeout=1)
+    writer.close()
+    return response
+
+
+@pytest.mark.asyncio
+async def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.register(lambda: [Metric('test', GAUGE, 'Test').add(1)])
+    server = MetricsServer(registry)
+    await server.start()
+    try:
+        response = await _http_request(server.port, b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        headers, _, body = response.partition(b'\r\n\r\n')
+        assert headers.startswith(b'HTTP/1.0 200 OK\r\n')
+        assert b'Content-Type: text/plain; version=0.0.4' in headers
+        assert body == b'# HELP test Test\n# TYPE test gauge\ntest 1\n'
+
+        response = await _http_request(server.port, b'HEAD /metrics HTTP/1.1\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+        assert response.endswith(b'\r\n\r\n')
+
+        response = await _http_request(server.port, b'GET / HTTP/1.1\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 404 Not Found\r\n')
+
+        response = await _http_request(server.port, b'POST /metrics HTTP/1.1\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 405 Method Not Allowed\r\n')
+
+        response = await _http_request(server.port, b'GET /' + b'x' * 100000 + b' HTTP/1.1\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 400 Bad Request\r\n')
+
+        response = await _http_request(server.port, b'GET /metrics HTTP/1.1\r\nX: ' + b'x' * 100000 + b'\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 400 Bad Request\r\n')
+    finally:
+        server.close()
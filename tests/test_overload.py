@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+from source_query_proxy.overload import LEVEL_INFO
+from source_query_proxy.overload import LEVEL_NONE
+from source_query_proxy.overload import LEVEL_PLAYERS
+from source_query_proxy.overload import LEVEL_RULES
+from source_query_proxy.overload import LoadShedder
+from source_query_proxy.overload import LoopLagMonitor
+
+
+@pytest.mark.parametrize(
+    ('lag', 'level'),
+    [(0, LEVEL_NONE), (0.05, LEVEL_RULES), (0.2, LEVEL_PLAYERS), (1, LEVEL_INFO)],
+)
+def test_lag_level(lag, level):
+    shedder = LoadShedder(lag_thresholds=(0.05, 0.1, 0.5))
+    shedder.update(lag)
+    assert shedder.level == level
+
+
+def test_queue_fill_level():
+    shedder = LoadShedder()
+    shedder.queue_fill = lambda: 0.8
+    shedder.update(0)
+    assert shedder.level == LEVEL_PLAYERS
+
+    shedder.queue_fill = lambda: 0
+    shedder.update(0)
+    assert shedder.level == LEVEL_NONE
+
+
+def test_should_shed():
+    shedder = LoadShedder()
+    shedder.level = LEVEL_PLAYERS
+
+    assert shedder.should_shed('a2s_rules')
+    assert shedder.should_shed('a2s_players')
+    assert not shedder.should_shed('a2s_info')
+    assert shedder.stats == {'a2s_rules': 1, 'a2s_players': 1}
+
+
+def test_lag_decays():
+    monitor = LoopLagMonitor()
+    shedder = LoadShedder(lag_thresholds=(0.05, 0.1, 0.5))
+    monitor.add(shedder)
+
+    monitor.measured(0.2)
+    assert shedder.level == LEVEL_PLAYERS
+
+    monitor.measured(0)
+    assert shedder.level == LEVEL_PLAYERS  # doesn't flap
+
+    for _ in range(20):
+        monitor.measured(0)
+    assert shedder.level == LEVEL_NONE
+
+
+@pytest.mark.asyncio
+async def test_monitor_blocked_loop():
+    monitor = LoopLagMonitor(interval=0.01)
+    shedder = LoadShedder(lag_thresholds=(0.05, 0.1, 0.5))
+    monitor.add(shedder)
+    task = asyncio.ensure_future(monitor.run())
+
+    await asyncio.sleep(0.02)
+    time.sleep(0.15)  # block event loop
+    await asyncio.sleep(0.02)
+
+    assert monitor.lag >= 0.1
+    assert shedder.level == LEVEL_PLAYERS
+    task.cancel()
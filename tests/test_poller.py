@@ -0,0 +1,185 @@
+import asyncio
+
+import async_timeout
+import pytest
+
+from source_query_proxy.poller import BackendPoller
+from source_query_proxy.poller import normalize_addr
+from source_query_proxy.source import messages
+from source_query_proxy.transport import bind
+
+pytestmark = [pytest.mark.asyncio]
+
+
+@pytest.fixture()
+async def poller():
+    poller = BackendPoller(('127.0.0.1', 0))
+    await poller.start()
+    yield poller
+    poller.close()
+
+
+@pytest.fixture()
+async def servers():
+    servers = [await bind(('127.0.0.1', 0)) for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.close()
+
+
+async def recv(channel):
+    with async_timeout.timeout(1):
+        return await channel.recv_packet()
+
+
+def rules_response(name, rule_count=1):
+    rules = b''.join(f'{name}-{i}\0{"x" * 50}\0'.encode() for i in range(rule_count))
+    return b'\xFF\xFF\xFF\xFFE' + rule_count.to_bytes(2, 'little') + rules
+
+
+PLAYERS_RESPONSE = b'\xFF\xFF\xFF\xFFD\0'
+
+
+def test_normalize_addr():
+    assert normalize_addr(('0.0.0.0', 27015)) == ('127.0.0.1', 27015)
+    assert normalize_addr(('10.0.0.1', 27015)) == ('10.0.0.1', 27015)
+
+
+async def test_demultiplex_by_address_and_type(poller, servers):
+    rules_channels = [poller.subscribe(server.sockname, messages.RulesResponse) for server in servers]
+    players_channel = poller.subscribe(servers[0].sockname, messages.PlayersResponse)
+
+    for index, (server, channel) in enumerate(zip(servers, rules_channels)):
+        await channel.send_packet(messages.RulesRequest(challenge=0xBEEF).encode())
+        _, _, addr = await server.recv_packet()
+        assert addr == poller.sockname
+
+        if index == 0:
+            # response of other type goes to other channel
+            await server.send_bytes(PLAYERS_RESPONSE, addr=addr)
+        await server.send_bytes(rules_response(index), addr=addr)
+
+    for index, channel in enumerate(rules_channels):
+        message, data, addr = await recv(channel)
+        assert isinstance(message, messages.RulesResponse)
+        assert data == rules_response(index)
+        assert addr == servers[index].sockname
+        assert not channel.pending
+
+    message, data, _ = await recv(players_channel)
+    assert data == PLAYERS_RESPONSE
+
+
+async def test_challenge_delivered_to_pending_channels(poller, servers):
+    server = servers[0]
+    players_channel = poller.subscribe(server.sockname, messages.PlayersResponse)
+    rules_channel = poller.subscribe(server.sockname, messages.RulesResponse)
+    info_channel = poller.subscribe(server.sockname, messages.InfoResponse)
+
+    await players_channel.send_packet(messages.PlayersRequest(challenge=-1).encode())
+    await rules_channel.send_packet(messages.RulesRequest(challenge=-1).encode())
+    for _ in range(2):
+        await server.recv_packet()
+
+    await server.send_packet(messages.GetChallengeResponse(challenge=0xBEEF).encode(), addr=poller.sockname)
+
+    for channel in (players_channel, rules_channel):
+        message, _, _ = await recv(channel)
+        assert message['challenge'] == 0xBEEF
+        assert channel.pending
+
+    assert not info_channel.pending
+    assert info_channel._recvq.empty()
+
+
+async def test_unsubscribed_dropped(poller, servers):
+    server = servers[0]
+    channel = poller.subscribe(server.sockname, messages.InfoResponse)
+    channel.close()
+
+    await server.send_bytes(rules_response('a'), addr=poller.sockname)
+    with async_timeout.timeout(1):
+        while not poller.stats['dropped']:
+            await asyncio.sleep(0.01)
+
+
+async def test_split_packets_reassembled_per_source(poller, servers):
+    channels = [poller.subscribe(server.sockname, messages.RulesResponse) for server in servers]
+    responses = [rules_response(index, rule_count=50) for index in range(len(servers))]
+
+    mtu = 1000
+    fragment_count = 3
+    # fragments of both servers interleaved and have the same message id
+    for fragment_id in range(fragment_count):
+        for server, response in zip(servers, responses):
+            header = messages.Fragment().encode(
+                message_id=1,
+                fragment_count=fragment_count,
+                fragment_id=fragment_id,
+                mtu=mtu,
+                split_header=True,
+            )
+            content = response[fragment_id * mtu : (fragment_id + 1) * mtu]
+            await server.send_bytes(header + content, addr=poller.sockname)
+
+    for channel, response in zip(channels, responses):
+        message, data, _ = await recv(channel)
+        assert isinstance(message, messages.RulesResponse)
+        assert data == response
+
+
+async def test_broken_packet_skipped(poller, servers):
+    server = servers[0]
+    channel = poller.subscribe(server.sockname, messages.RulesResponse)
+
+    # single fragment with too short payload
+    fragment = messages.Fragment().encode(message_id=1, fragment_count=1, fragment_id=0, mtu=1000, split_header=True)
+    await server.send_bytes(fragment + b'\xff\xff', addr=poller.sockname)
+    await server.send_bytes(b'\xff\xff', addr=poller.sockname)
+    await server.send_bytes(rules_response('a'), addr=poller.sockname)
+
+    _, data, _ = await recv(channel)
+    assert data == rules_response('a')
+    assert poller.stats['broken'] == 2
+
+
+async def test_unsubscribed_not_decoded(poller, servers, mocker):
+    decode = mocker.spy(poller.stream, 'decode_response')
+    await servers[0].send_bytes(rules_response('a'), addr=poller.sockname)
+    with async_timeout.timeout(1):
+        while not poller.stats['dropped']:
+            await asyncio.sleep(0.01)
+    assert not decode.called
+
+
+async def test_reader_restarted(poller, servers, mocker, caplog):
+    mocker.patch('source_query_proxy.poller.READER_RESTART_DELAY', 0)
+    server = servers[0]
+    channel = poller.subscribe(server.sockname, messages.RulesResponse)
+    mocker.patch.object(poller, 'dispatch', side_effect=[RuntimeError, mocker.DEFAULT], wraps=poller.dispatch)
+
+    with caplog.at_level('CRITICAL', logger='sqproxy.poller'):
+        await server.send_bytes(rules_response('a'), addr=poller.sockname)
+        with async_timeout.timeout(1):
+            while not poller.stats['reader_errors']:
+                await asyncio.sleep(0.01)
+
+    await server.send_bytes(rules_response('b'), addr=poller.sockname)
+    _, data, _ = await recv(channel)
+    assert data == rules_response('b')
+
+
+async def test_shared_subscription(poller, servers):
+    server = servers[0]
+    channels = [poller.subscribe(server.sockname, messages.RulesResponse) for _ in range(2)]
+
+    await server.send_bytes(rules_response('a'), addr=poller.sockname)
+    for channel in channels:
+        _, data, _ = await recv(channel)
+        assert data == rules_response('a')
+
+    channels[0].close()
+    await server.send_bytes(rules_response('b'), addr=poller.sockname)
+    _, data, _ = await recv(channels[1])
+    assert data == rules_response('b')
+    assert channels[0]._recvq.empty()
@@ -1,17 +1,31 @@
 import asyncio
 import collections
 import contextlib
+import os
 import typing
+from unittest import mock
 
 import async_timeout
 import pytest
 
+from source_query_proxy.acl import AccessListSource
 from source_query_proxy.config import ServerModel
 from source_query_proxy.dict_merge import dict_merge
+from source_query_proxy.overload import LEVEL_INFO
+from source_query_proxy.overload import LEVEL_RULES
+from source_query_proxy.overload import LoadShedder
+from source_query_proxy.poller import BackendPoller
+from source_query_proxy.proxy import NO_RESPONSE
 from source_query_proxy.proxy import QueryProxy
+from source_query_proxy.scheduler import PollScheduler
+from source_query_proxy.shm import SharedResponseStore
 from source_query_proxy.source import messages
+from source_query_proxy.transport import FRAGMENT_MAX_SIZE
+from source_query_proxy.transport import SourceDatagramClient
+from source_query_proxy.transport import SourceDatagramStream
 from source_query_proxy.transport import bind
 from source_query_proxy.transport import connect
+from source_query_proxy.transport import decode_packet
 
 pytestmark = [pytest.mark.asyncio]
 
@@ -48,26 +62,6 @@ def a2s_players_cache_lifetime(request) -> int:
     return request.param
 
 
-@pytest.fixture()
-def rust_info_response_bytes():
-    return b'\xff\xff\xff\xffI\x11ZOZO.GG | X2/X5 | INSTA | REM | TP | KITS | WIPE 6.02\x00Procedural Map\x00rust\x00Rust\x00\x00\x00\x00<\x00dl\x00\x012215\x00\xb1om\x07\xcc\xf6ra7@\x01mp60,cp0,qp0,v2215,h986958cf,stok,born1581024860,gmrust,oxide,modded\x00J\xda\x03\x00\x00\x00\x00\x00'  # noqa: E501
-
-
-@pytest.fixture()
-def rust_rules_response_bytes():
-    return b'\xff\xff\xff\xffE"\x00build\x0046638\x00description_0\x00\x00description_00\x00\xd0\xa1\xd0\xb5\xd1\x80\xd0\xb2\xd0\xb5\xd1\x80 \xd1\x81\xd0\xbe\xd0\xbe\xd0\xb1\xd1\x89\xd0\xb5\xd1\x81\xd1\x82\xd0\xb2\xd0\xb0 ZOZO.GG\\n\\n- \xd0\x9c\xd0\xb3\xd0\xbd\xd0\xbe\xd0\xb2\xd0\xb5\xd0\xbd\xd0\xbd\xd1\x8b\xd0\xb9 \xd0\xba\xd1\x80\xd0\xb0\xd1\x84\xd1\x82\\n- \xd0\xa0\xd0\xb5\xd0\xb9\xd1\x82\xd1\x8b: \xd1\x852 (\xd0\xb4\xd0\xb5\xd0\xbd\xd1\x8c) / \xd1\x855 (\xd0\xbd\xd0\xbe\xd1\x87\xd1\x8c)                     \x00description_01\x00           \\n- \xd0\xa0\xd0\xb5\xd0\xbc\xd1\x83\xd0\xb2 \xd1\x82\xd0\xbe\xd0\xbb\xd1\x8c\xd0\xba\xd0\xbe \xd0\xbd\xd0\xb0 \xd1\x81\xd0\xb2\xd0\xbe\xd0\xb8 \xd0\xbf\xd0\xbe\xd1\x81\xd1\x82\xd1\x80\xd0\xbe\xd0\xb9\xd0\xba\xd0\xb8\\n- \xd0\xa1\xd1\x82\xd0\xb0\xd1\x80\xd1\x82\xd0\xbe\xd0\xb2\xd1\x8b\xd0\xb5 \xd0\xbd\xd0\xb0\xd0\xb1\xd0\xbe\xd1\x80\xd1\x8b \xd0\xb4\xd0\xbb\xd1\x8f \xd0\xb2\xd1\x81\xd0\xb5\xd1\x85\x00description_02\x00\x00description_03\x00\x00description_04\x00\x00description_05\x00\x00description_06\x00\x00description_07\x00\x00description_08\x00\x00description_09\x00\x00description_10\x00\x00description_11\x00\x00description_12\x00\x00description_13\x00\x00description_14\x00\x00description_15\x00\x00ent_cnt\x0071167\x00fps\x00226\x00fps_avg\x00227.28\x00gc_cl\x00150\x00gc_mb\x001119\x00gmd\x00The default Rust survival gamemode\x00gmn\x00rust\x00gmt\x00Rust: Survival Mode\x00gmu\x00https://rust.facepunch.com\x00hash\x00986958cf\x00headerimage\x00http://i.imgur.com/1SHlsXX.jpg\x00pve\x00False\x00uptime\x0023944\x00url\x00http://zozo.gg/\x00world.seed\x004218819\x00world.size\x004000\x00'  # noqa: E501
-
-
-@pytest.fixture()
-def rust_players_response_bytes():
-    return b'\xff\xff\xff\xffD\x01\x00MyHangryLord\x00\x00\x00\x00\x00\x17\\LD'
-
-
-@pytest.fixture()
-def css_rules_response_bytes__fragmented__compressed():
-    return b'\xfe\xff\xff\xffL\x80\x00\x80\x01\x00"\x06\x00\x00\xbc\x06[\x18BZh91AY&SY\x06\x82\x1b\x00\x00\x03\x11_\x80\xc0\x00@\x0f\x7f\xe0oS\xc9\x10\xbf\xef\xff\xf0\x00\x00\xd0\x038\xa9oS\xab\xb2\xd8\xc3\x12jh\x02`A\r\x00\xd1\xea\x004\xf5\x00i\x06\x9a\nz\x8d\x01\xa0\x00\x00\x00\x000\x84HOH\x03 h\x00\x00\x00\x0c\x00\x00\x00\x00\xd0h\x03@4\x02H\x814\x9e\x9a#F\xa2~\x94h\x00\x00\x00\xf5;\xfa\xbd}\xdf\xe7\xc3K\xba\x18p\xfd\xe0W\xa7\xb7\xa4\xda\xf3\x84B\xb4\xd2\x8c)\x08 ZF\x02\x9c\xd89y&D|\x05\x7f\xea\xea\xb6M\xdf\xb44b\xf4g\xc8\x9e\xd2\x12R\x0b\x81\x1f\x05\x01\x00\x96\xaeH\xe4\xcdZ\xa42\x96U\x91J\x12\x90\x80\xcbz\x84\x08\xfbdc\xe3\xf5\xc1\xfb\xf3?\xe6Q\x11\\y\xad\xd7\xddg\xea\xc9^\xc8\x00\xd8I\x94\x1c$P\x82\xf9\xb2s\x04\x04\x99\x93\x08j\xfb,\x89J\x834\x9b-\'\x15\xbf\x02\xd3B\xc8\x10\xa50;P\x10\x8aF\x08\x9c\xd8\xe6\xefm\r:\xb1\x0c\xd4P\x99}\xc5\xaeA\xeeD1\xea\x95\xa1N\x86\x8c7\x8c\x88\x84\xaa\x03A\x13\xef\x1e\x1ai7B\xdd52\xd7\xde\x92T\x0f2w\x88$\x12])\xf7/\xcbQf\x85\x90i\xa4\xd9m\x10\xb9S0\xc32\xc0f\x0b\xd37\xf0~o\x0bS\xb4\xc0\xa0\xb0t\x811\x8a\xbb\xa8\x13\x94\x83\x11\\\xd3\xdc\x1au\x0cJ1\n\x0e\xf0D\xb1\x99g\x8c2]\xcaZY\r\xcc\xc0\xc0)bnP\xac\x99?4IL\xa1\x04d7\xed\x04\x16 \x96j\xbd\x06\xaaCIN\x96H\xb1\xa6k\'\xbcw\x99\xbc\x94D\x84\x12\xb4\x18\xc2\xf6\x90\xa5\xb2Of\x8d\xf4\xd3\xa5\x87h\x7f\xb3\x99\xd9\x82s\xa4\xf7\x926\x8c6v&\xb5C\xa3\x1a\xf6O\x1f\xc7cx\xcd\x19\xb6\x08\xa6\x89\xfe\xfb\xa2+\x8f\x15UW\xba1~\x96\x05\x7f,\x1ei\xb1\xbcQY9\x0b96s\x8cw-H\xc5\x01=l%4\x1ci\x83\xedlov\xe5\xa5\xf0\x91\xcd\x97\x18\xd7%[\xae\x896$\xc1\xd6\x18V,!\x98\x8a\xb1\xfdZ\xf3\x8c\xf6]\xd7;Q\xaaT,j\x95;\x8b\xc3\xaa\xd5*.Es9\xbe2`\xe7TE\xe8%\x950B\x1e\x0f\x85^\xa3a\x04D \\\x0cq\xcc#H\x1a\x11t\x16w\xbf\x02\x89\x01\x13\x9bU\x99\x15\x19\xd0Gw\x18\x9dc#\xad\xe2Bm@\xads\xf4tZ\xc1g\xcc^\xbe\xbd\xfdL\xb4\xb2I\xb0\x93\xbbnJ\x0e]J\x9bJ\xafB\xf2?>-\'<\xb36\xd5:A\x0e\xfd\x95B$\x8aQ\x19\xef\xaf\xbdZ09s2\xd6\x92[\xdc\x96G\x0c\x9c\x04\xe0\x8cXG\x10w\x08\xd0\x1cl\xe2\xd2\x12f\xaf\x85Ov\xfb\xa9\xfeM\x1dlv\xa9\xaf\xc7"\xdc\x1a\xca\xad\x9c\x83V\xb2,b\x16\xd7Y\x9bAs\xe0\xa0^\x18#\xc3\xc3\x91\x03!\n\xfa-\xd6#\x96\xab\xca\xca\xb1\x8ds\xd2\x02\x98\r\x94\x8aAD\x8b{\xa7\xca\x9f\xbb\x1c5\x19r\xc5\xf8B\xf6\x8b\x04\x8fN\x9c\x8e/N\xd0\x9a\x86.a|\xdc\xd0\x9c\xc1ra\x99#\x124\x056\x8e\x91EX)4(\xd9\x8a\n\xea\xef,$*\xbf\x8e?\xe2\xeeH\xa7\n\x12\x00\xd0C`\x00'  # noqa: E501
-
-
 class GameServerMock:
     challenge = 0xBEEF
     server = None
@@ -163,7 +157,10 @@ async def game_server_mock(
         await asyncio.gather(task, return_exceptions=True)
 
 
-@pytest.fixture(params=[{}])
+@pytest.fixture(
+    params=[{}, {'batched_udp_io': True}, {'answer_in_protocol': False}],
+    ids=['default-io', 'batched-io', 'queued-io'],
+)
 def override_server_proxy_settings(request):
     """Allow set settings before QueryProxy run
 
@@ -173,6 +170,39 @@ def override_server_proxy_settings(request):
     return request.param
 
 
+@pytest.fixture(params=[False])
+async def backend_poller(request):
+    """Poll game server through shared `BackendPoller` (instead of own socket)
+
+    Use indirect=True option for parametrize this fixture
+    """
+    if not request.param:
+        yield None
+        return
+
+    poller = BackendPoller()
+    await poller.start()
+    yield poller
+    poller.close()
+
+
+@pytest.fixture(params=[False])
+async def poll_scheduler(request):
+    """Poll game server by shared `PollScheduler` (instead of own tasks)
+
+    Use indirect=True option for parametrize this fixture
+    """
+    if not request.param:
+        yield None
+        return
+
+    scheduler = PollScheduler()
+    task = asyncio.ensure_future(scheduler.run())
+    yield scheduler
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
 @pytest.fixture()
 async def game_server_proxy(
     event_loop,
@@ -182,6 +212,8 @@ async def game_server_proxy(
     a2s_players_cache_lifetime,
     a2s_rules_cache_lifetime,
     override_server_proxy_settings,
+    backend_poller,
+    poll_scheduler,
 ):
     server_ip, server_port = server.sockname
     proxy = QueryProxy(
@@ -203,6 +235,10 @@ async def game_server_proxy(
             )
         )
     )
+    if backend_poller is not None:
+        proxy.use_poller(backend_poller)
+    if poll_scheduler is not None:
+        proxy.use_scheduler(poll_scheduler)
     task = event_loop.create_task(proxy.run())
     task.add_done_callback(lambda fut: not fut.cancelled() and fut.result())
     yield proxy
@@ -230,7 +266,8 @@ async def test_proxy_info(game_server_proxy, game_server_mock, a2s_info_cache_li
     cache_misses = a2s_info_cache_lifetime == CACHE_MISS_LIFETIME
 
     for _ in range(2):
-        await client.send_packet(messages.InfoRequest().encode())
+        challenge = game_server_proxy.challenge_for('127.0.0.1')
+        await client.send_packet(messages.InfoRequestV2(challenge=challenge).encode())
         with async_timeout.timeout(1):
             message, data, addr = await client.recv_packet()
 
@@ -241,12 +278,18 @@ async def test_proxy_info(game_server_proxy, game_server_mock, a2s_info_cache_li
             # wait cache updated
             await asyncio.sleep(CACHE_MISS_LIFETIME * 2)
 
+    # after challenge demanded, known challenge sent with every A2S_INFO request
+    info_requests = (
+        game_server_mock.received_counter[messages.InfoRequest]
+        + game_server_mock.received_counter[messages.InfoRequestV2]
+    )
     if cache_misses:
-        assert game_server_mock.received_counter[messages.InfoRequest] > 1
+        assert info_requests > 1 + info_challenge_required
     else:
-        assert game_server_mock.received_counter[messages.InfoRequest] == 1
+        assert info_requests == 1 + info_challenge_required
 
 
+@pytest.mark.parametrize('backend_poller', [False, True], ids=['own-socket', 'shared-poller'], indirect=True)
 @pytest.mark.parametrize(
     'a2s_rules_cache_lifetime',
     ['default', CACHE_MISS_LIFETIME],
@@ -264,7 +307,7 @@ async def test_proxy_rules(game_server_proxy, game_server_mock, a2s_rules_cache_
     cache_misses = a2s_rules_cache_lifetime == CACHE_MISS_LIFETIME
 
     for _ in range(2):
-        await client.send_packet(messages.RulesRequest(challenge=game_server_proxy.our_a2s_challenge).encode())
+        await client.send_packet(messages.RulesRequest(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
         with async_timeout.timeout(1):
             message, data, addr = await client.recv_packet()
 
@@ -278,10 +321,38 @@ async def test_proxy_rules(game_server_proxy, game_server_mock, a2s_rules_cache_
     if cache_misses:
         assert game_server_mock.received_counter[messages.RulesRequest] > 2
     else:
-        # Challenge request + Real request
-        assert game_server_mock.received_counter[messages.RulesRequest] == 2
+        # Challenge got by A2S_PLAYERS poll reused, so only real request
+        assert game_server_mock.received_counter[messages.RulesRequest] == 1
+
+
+@pytest.mark.parametrize('backend_poller', [False, True], ids=['own-socket', 'shared-poller'], indirect=True)
+@pytest.mark.parametrize('a2s_players_cache_lifetime', [CACHE_MISS_LIFETIME], indirect=True)
+async def test_proxy_upstream_reused(game_server_proxy, game_server_mock, a2s_players_cache_lifetime):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    await asyncio.sleep(CACHE_MISS_LIFETIME * 5)
+
+    stats = game_server_proxy.upstream_stats
+    assert stats['sockets_opened'] == (0 if game_server_proxy.poller else 1)
+    # only first A2S_PLAYERS request got GetChallengeResponse
+    assert stats['challenge_requests'] == 1
+    assert stats['round_trips'] == stats['polls'] + 1
+    assert stats['round_trips_saved'] > 1
 
 
+@pytest.mark.parametrize('poll_scheduler', [True], ids=['scheduler'], indirect=True)
+async def test_proxy_scheduled_polls(game_server_proxy, poll_scheduler):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+
+    assert list(game_server_proxy._poll_jobs) == [
+        'a2s_info',
+        'a2s_players',
+        'a2s_rules',
+    ]
+    assert poll_scheduler.stats['polls'] >= 3
+    assert poll_scheduler.stats['poll_errors'] == 0
+
+
+@pytest.mark.parametrize('backend_poller', [False, True], ids=['own-socket', 'shared-poller'], indirect=True)
 async def test_proxy_compressed_rules(
     game_server_proxy,
     game_server_mock,
@@ -296,7 +367,7 @@ async def test_proxy_compressed_rules(
 
     client = await connect(('127.0.0.1', 27915))
 
-    await client.send_packet(messages.RulesRequest(challenge=game_server_proxy.our_a2s_challenge).encode())
+    await client.send_packet(messages.RulesRequest(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
     with async_timeout.timeout(1):
         message, data, addr = await client.recv_packet()
 
@@ -305,6 +376,8 @@ async def test_proxy_compressed_rules(
     assert message.values['rule_count'] == 77
 
 
+@pytest.mark.parametrize('poll_scheduler', [False, True], ids=['own-tasks', 'scheduler'], indirect=True)
+@pytest.mark.parametrize('backend_poller', [False, True], ids=['own-socket', 'shared-poller'], indirect=True)
 @pytest.mark.parametrize(
     'a2s_players_cache_lifetime',
     ['default', CACHE_MISS_LIFETIME],
@@ -322,7 +395,8 @@ async def test_proxy_players(game_server_proxy, game_server_mock, a2s_players_ca
     cache_misses = a2s_players_cache_lifetime == CACHE_MISS_LIFETIME
 
     for _ in range(2):
-        await client.send_packet(messages.PlayersRequest(challenge=game_server_proxy.our_a2s_challenge).encode())
+        challenge = game_server_proxy.challenge_for('127.0.0.1')
+        await client.send_packet(messages.PlayersRequest(challenge=challenge).encode())
         with async_timeout.timeout(1):
             message, data, addr = await client.recv_packet()
 
@@ -367,7 +441,7 @@ async def test_gameserver_offline2online__response_on_online_only(game_server_pr
 
     # proxy is ready, but not online, any request will fail
     assert not game_server_proxy.online
-    await client.send_packet(messages.InfoRequest().encode())
+    await client.send_packet(messages.InfoRequestV2(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
     with pytest.raises(asyncio.TimeoutError):
         await asyncio.wait_for(client.recv_packet(), 0.1)
 
@@ -380,7 +454,8 @@ async def test_gameserver_offline2online__response_on_online_only(game_server_pr
         assert game_server_proxy.online
         assert game_server_mock.received_counter[messages.InfoRequest] > 0
 
-        await client.send_packet(messages.InfoRequest().encode())
+        challenge = game_server_proxy.challenge_for('127.0.0.1')
+        await client.send_packet(messages.InfoRequestV2(challenge=challenge).encode())
         message, data, addr = await asyncio.wait_for(client.recv_packet(), 1)
         assert isinstance(message, messages.InfoResponse)
 
@@ -407,7 +482,7 @@ async def test_gameserver_online2offline__response_on_online_only(
 
     client = await connect(('127.0.0.1', 27915))
 
-    await client.send_packet(messages.InfoRequest().encode())
+    await client.send_packet(messages.InfoRequestV2(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
     message, data, addr = await asyncio.wait_for(client.recv_packet(), 1)
     assert isinstance(message, messages.InfoResponse)
 
@@ -419,6 +494,510 @@ async def test_gameserver_online2offline__response_on_online_only(
 
     assert not game_server_proxy.online
 
+    await client.send_packet(messages.InfoRequestV2(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(client.recv_packet(), 0.1)
+
+
+CLIENT_ADDR = ('127.0.0.1', 27005)
+
+
+def _make_proxy(cls=QueryProxy):
+    return cls(
+        ServerModel(
+            meta={},
+            network={'server_ip': '127.0.0.1', 'server_port': 27015, 'bind_ip': '127.0.0.1', 'bind_port': 27915},
+        )
+    )
+
+
+@pytest.fixture()
+def cached_proxy(rust_info_response_bytes, rust_players_response_bytes, rust_rules_response_bytes):
+    proxy = _make_proxy()
+    proxy.resp_cache.update(
+        a2s_info=rust_info_response_bytes,
+        a2s_players=rust_players_response_bytes,
+        a2s_rules=rust_rules_response_bytes,
+    )
+    return proxy
+
+
+@pytest.mark.parametrize('request_cls', [messages.PlayersRequest, messages.RulesRequest])
+async def test_get_response_for_data__wrong_challenge(cached_proxy, request_cls):
+    response = cached_proxy.get_response_for_data(request_cls(challenge=cached_proxy.our_a2s_challenge + 1).encode())
+    assert response == messages.GetChallengeResponse(challenge=cached_proxy.our_a2s_challenge).encode()
+
+
+@pytest.mark.parametrize(
+    ('request_cls', 'cache_key'),
+    [(messages.PlayersRequest, 'a2s_players'), (messages.RulesRequest, 'a2s_rules')],
+)
+async def test_get_response_for_data__right_challenge(cached_proxy, request_cls, cache_key):
+    response = cached_proxy.get_response_for_data(request_cls(challenge=cached_proxy.our_a2s_challenge).encode())
+    assert response == cached_proxy.resp_cache[cache_key]
+
+
+async def test_get_response_for_data__challenge_changed(cached_proxy):
+    cached_proxy.our_a2s_challenge = 0xBEEF
+
+    response = cached_proxy.get_response_for_data(messages.PlayersRequest(challenge=0xBEEF).encode())
+    assert response == cached_proxy.resp_cache['a2s_players']
+
+    response = cached_proxy.get_response_for_data(messages.PlayersRequest(challenge=1).encode())
+    assert response == messages.GetChallengeResponse(challenge=0xBEEF).encode()
+
+
+async def test_get_response_for_data__info(cached_proxy):
+    response = cached_proxy.get_response_for_data(messages.InfoRequest().encode())
+    assert response == messages.GetChallengeResponse(challenge=cached_proxy.our_a2s_challenge).encode()
+
+    response = cached_proxy.get_response_for_data(
+        messages.InfoRequestV2(challenge=cached_proxy.our_a2s_challenge).encode()
+    )
+    assert response == cached_proxy.resp_cache['a2s_info']
+
+
+async def test_get_response_for_data__info_legacy(cached_proxy):
+    cached_proxy.settings.a2s_info_challenge = False
+
+    response = cached_proxy.get_response_for_data(messages.InfoRequest().encode(), CLIENT_ADDR)
+    assert response == cached_proxy.resp_cache['a2s_info']
+
+
+@pytest.mark.parametrize(
+    ('request_cls', 'cache_key'),
+    [
+        (messages.InfoRequestV2, 'a2s_info'),
+        (messages.PlayersRequest, 'a2s_players'),
+        (messages.RulesRequest, 'a2s_rules'),
+    ],
+)
+async def test_get_response_for_data__per_client_challenge(cached_proxy, request_cls, cache_key):
+    response = cached_proxy.get_response_for_data(request_cls(challenge=-1).encode(), CLIENT_ADDR)
+    challenge = messages.GetChallengeResponse.decode(response, messages.HEADER_SIZE)['challenge']
+    assert challenge == cached_proxy.challenge_for(CLIENT_ADDR[0])
+    assert challenge != cached_proxy.challenge_for('127.0.0.2')
+    assert challenge != cached_proxy.our_a2s_challenge
+
+    response = cached_proxy.get_response_for_data(request_cls(challenge=challenge).encode(), CLIENT_ADDR)
+    assert response == cached_proxy.resp_cache[cache_key]
+
+    # spoofed source address
+    response = cached_proxy.get_response_for_data(request_cls(challenge=challenge).encode(), ('127.0.0.2', 27005))
+    assert response == messages.GetChallengeResponse(challenge=cached_proxy.challenge_for('127.0.0.2')).encode()
+
+
+async def test_get_response_for_data__static_challenge(cached_proxy):
+    cached_proxy.settings.a2s_per_client_challenge = False
+
+    assert cached_proxy.challenge_for(CLIENT_ADDR[0]) == cached_proxy.our_a2s_challenge
+    response = cached_proxy.get_response_for_data(
+        messages.PlayersRequest(challenge=cached_proxy.our_a2s_challenge).encode(), CLIENT_ADDR
+    )
+    assert response == cached_proxy.resp_cache['a2s_players']
+
+
+async def test_get_response_for_data__decoded_request_challenge(cached_proxy):
+    # not standard payload, so decoded
+    data = messages.InfoRequestV2(payload='Other Query', challenge=cached_proxy.challenge_for(CLIENT_ADDR[0])).encode()
+    assert cached_proxy.get_response_for_data(data, CLIENT_ADDR) == cached_proxy.resp_cache['a2s_info']
+
+    data = messages.InfoRequest(payload='Other Query').encode()
+    response = cached_proxy.get_response_for_data(data, CLIENT_ADDR)
+    assert messages.GetChallengeResponse.decode(response, messages.HEADER_SIZE)
+
+
+async def test_get_response_for_data__rules_shed(cached_proxy):
+    cached_proxy.use_load_shedder(LoadShedder())
+    cached_proxy.shedder.level = LEVEL_RULES
+    challenge = cached_proxy.challenge_for(CLIENT_ADDR[0])
+
+    response = cached_proxy.get_response_for_data(messages.RulesRequest(challenge=challenge).encode(), CLIENT_ADDR)
+    assert response is NO_RESPONSE
+    response = cached_proxy.get_response_for_data(messages.PlayersRequest(challenge=challenge).encode(), CLIENT_ADDR)
+    assert response == cached_proxy.resp_cache['a2s_players']
+    assert cached_proxy.shedder.stats == {'a2s_rules': 1}
+
+
+async def test_get_response_for_data__info_shed(cached_proxy):
+    cached_proxy.use_load_shedder(LoadShedder())
+    cached_proxy.shedder.level = LEVEL_INFO
+
+    # challenge not issued, only clients already passed handshake are answered
+    response = cached_proxy.get_response_for_data(messages.InfoRequest().encode(), CLIENT_ADDR)
+    assert response is NO_RESPONSE
+    challenge = cached_proxy.challenge_for(CLIENT_ADDR[0])
+    response = cached_proxy.get_response_for_data(messages.InfoRequestV2(challenge=challenge).encode(), CLIENT_ADDR)
+    assert response == cached_proxy.resp_cache['a2s_info']
+    response = cached_proxy.get_response_for_data(messages.PlayersRequest(challenge=challenge).encode(), CLIENT_ADDR)
+    assert response is NO_RESPONSE
+
+    cached_proxy.settings.a2s_info_challenge = False
+    response = cached_proxy.get_response_for_data(messages.InfoRequest().encode(), CLIENT_ADDR)
+    assert response is NO_RESPONSE
+    assert cached_proxy.shedder.stats == {'a2s_info': 2, 'a2s_players': 1}
+
+
+async def test_proxy_info_challenge_handshake(game_server_proxy):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    client = await connect(('127.0.0.1', 27915))
+
     await client.send_packet(messages.InfoRequest().encode())
+    with async_timeout.timeout(1):
+        message, data, addr = await client.recv_packet()
+    assert isinstance(message, messages.GetChallengeResponse)
+
+    await client.send_packet(messages.InfoRequestV2(challenge=message['challenge']).encode())
+    with async_timeout.timeout(1):
+        message, data, addr = await client.recv_packet()
+    assert data == game_server_proxy.resp_cache['a2s_info']
+    client.close()
+
+
+@pytest.mark.parametrize('data', [b'\xFF\xFF\xFF\xFF\0\0\0\0', b'\xFF\xFF\xFF\xFFU'])
+async def test_get_response_for_data__undecodable(cached_proxy, data):
+    assert cached_proxy.get_response_for_data(data) is NO_RESPONSE
+
+
+async def test_get_response_for_data__overridden_get_response_for(rust_players_response_bytes):
+    class CustomProxy(QueryProxy):
+        def get_response_for(self, message, default):
+            self.requests.append(message)
+            return b'custom'
+
+    proxy = _make_proxy(CustomProxy)
+    proxy.requests = []
+    proxy.resp_cache['a2s_players'] = rust_players_response_bytes
+
+    assert not proxy._fast_dispatch
+    response = proxy.get_response_for_data(messages.PlayersRequest(challenge=proxy.our_a2s_challenge).encode())
+    assert response == b'custom'
+    assert isinstance(proxy.requests[0], messages.PlayersRequest)
+
+
+async def test_get_response_for_data__shared_cache(rust_players_response_bytes):
+    response_store = SharedResponseStore(['Server'])
+
+    polling_proxy = _make_proxy()
+    polling_proxy.use_shared_cache(response_store.get_cache('Server'))
+    polling_proxy._store_response('a2s_players', rust_players_response_bytes)
+
+    proxy = _make_proxy()
+    proxy.polling = False
+    proxy.use_shared_cache(response_store.get_cache('Server'))
+
+    response = proxy.get_response_for_data(messages.PlayersRequest(challenge=proxy.our_a2s_challenge).encode())
+    assert response == rust_players_response_bytes
+
+
+async def test_overridden_update_loop_not_scheduled(mocker):
+    started = asyncio.Event()
+
+    class CustomProxy(QueryProxy):
+        async def _update_rules(self):
+            started.set()
+
+    async def listen():
+        pass
+
+    proxy = _make_proxy(CustomProxy)
+    mocker.patch.object(proxy, '_listen_client_requests', listen)
+    scheduler = mocker.Mock()
+    proxy.use_scheduler(scheduler)
+    tasks = proxy.get_tasks()
+    try:
+        await asyncio.wait_for(started.wait(), timeout=1)
+        scheduled = [args[0] for args, _kwargs in scheduler.add.call_args_list]
+        assert scheduled == [f'{proxy.name}:a2s_info', f'{proxy.name}:a2s_players']
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def test_adaptive_poll_interval(cached_proxy):
+    settings = cached_proxy.settings
+    settings.adaptive_polling = True
+    settings.a2s_players_cache_lifetime = 1
+    settings.a2s_idle_cache_lifetime = 8
+
+    intervals = [cached_proxy.get_poll_interval('a2s_players') for _ in range(5)]
+    assert intervals == [1, 2, 4, 8, 8]
+    assert 'a2s_players' in cached_proxy._stretched
+
+    # demand returned
+    cached_proxy.get_response_for_data(messages.PlayersRequest(challenge=cached_proxy.our_a2s_challenge).encode())
+    assert 'a2s_players' not in cached_proxy._stretched
+    assert cached_proxy.get_poll_interval('a2s_players') == 1
+    assert cached_proxy.get_poll_interval('a2s_players') == 2
+
+    # other kinds of requests don't affect
+    cached_proxy.get_response_for_data(messages.InfoRequest().encode())
+    assert cached_proxy.get_poll_interval('a2s_players') == 4
+
+
+async def test_adaptive_poll_interval_disabled(cached_proxy):
+    cached_proxy.settings.a2s_players_cache_lifetime = 1
+    assert [cached_proxy.get_poll_interval('a2s_players') for _ in range(3)] == [1, 1, 1]
+    assert not cached_proxy._stretched
+
+
+@pytest.mark.parametrize('poll_scheduler', [False, True], ids=['own-tasks', 'scheduler'], indirect=True)
+@pytest.mark.parametrize(
+    'override_server_proxy_settings',
+    [{'adaptive_polling': True, 'a2s_idle_cache_lifetime': 10}],
+    ids=['adaptive'],
+    indirect=True,
+)
+@pytest.mark.parametrize('a2s_players_cache_lifetime', [0.05], indirect=True)
+async def test_proxy_adaptive_polling(game_server_proxy, game_server_mock, a2s_players_cache_lifetime):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    # intervals: 0.05, 0.1, 0.2, 0.4, 0.8 ...
+    await asyncio.sleep(0.5)
+
+    polls = game_server_mock.received_counter[messages.PlayersRequest]
+    assert 'a2s_players' in game_server_proxy._stretched
+    await asyncio.sleep(0.1)
+    assert game_server_mock.received_counter[messages.PlayersRequest] == polls
+
+    client = await connect(('127.0.0.1', 27915))
+    await client.send_packet(messages.PlayersRequest(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
+    with async_timeout.timeout(1):
+        message, data, addr = await client.recv_packet()
+    assert isinstance(message, messages.PlayersResponse)
+
+    # polled immediately
+    await asyncio.sleep(0.02)
+    assert game_server_mock.received_counter[messages.PlayersRequest] == polls + 1
+    assert 'a2s_players' not in game_server_proxy._stretched
+
+
+def _change_info(info_response: bytes, player_count: int = None, map_name: bytes = None) -> bytes:
+    # player_count placed just before max_players (60, '<') and bot_count
+    offset = info_response.index(b'<\x00dl') - 1
+    if player_count is not None:
+        info_response = info_response[:offset] + bytes([player_count]) + info_response[offset + 1 :]
+    if map_name is not None:
+        info_response = info_response.replace(b'Procedural Map', map_name)
+    return info_response
+
+
+async def test_change_aware_poll_interval(cached_proxy):
+    settings = cached_proxy.settings
+    settings.change_aware_polling = True
+    settings.a2s_players_cache_lifetime = 1
+    settings.a2s_unchanged_cache_lifetime = 30
+
+    assert cached_proxy.get_poll_interval('a2s_players') == 30
+    assert cached_proxy.get_poll_interval('a2s_rules') == 30
+    assert cached_proxy.get_poll_interval('a2s_info') == settings.a2s_info_cache_lifetime
+
+
+@pytest.mark.parametrize(
+    ('changes', 'polled'),
+    [
+        ({}, []),
+        ({'player_count': 5}, ['a2s_players']),
+        ({'map_name': b'de_dust2'}, ['a2s_rules']),
+        ({'player_count': 5, 'map_name': b'de_dust2'}, ['a2s_players', 'a2s_rules']),
+    ],
+)
+async def test_change_aware_poll_triggered(cached_proxy, mocker, rust_info_response_bytes, changes, polled):
+    poll_soon = mocker.patch.object(cached_proxy, 'poll_soon')
+
+    def info(data):
+        return decode_packet(data, msg_classes=SourceDatagramClient.response_message_classes)
+
+    cached_proxy._check_info_changes(info(rust_info_response_bytes))
+    cached_proxy._check_info_changes(info(_change_info(rust_info_response_bytes, **changes)))
+
+    assert [args[0] for args, _ in poll_soon.call_args_list] == polled
+
+
+@pytest.mark.parametrize('poll_scheduler', [False, True], ids=['own-tasks', 'scheduler'], indirect=True)
+@pytest.mark.parametrize(
+    'override_server_proxy_settings',
+    [{'change_aware_polling': True}],
+    ids=['change-aware'],
+    indirect=True,
+)
+@pytest.mark.parametrize('a2s_info_cache_lifetime', [0.05], indirect=True)
+async def test_proxy_change_aware_polling(game_server_proxy, game_server_mock, a2s_info_cache_lifetime):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    await asyncio.sleep(0.2)
+    polls = game_server_mock.received_counter[messages.PlayersRequest]
+
+    game_server_mock.info_response = _change_info(game_server_mock.info_response, player_count=10)
+    await asyncio.sleep(0.2)
+
+    # challenge reused, so only one request
+    assert game_server_mock.received_counter[messages.PlayersRequest] == polls + 1
+    assert game_server_proxy.resp_cache['a2s_info'] == game_server_mock.info_response
+
+
+@pytest.fixture()
+def large_rules_response_bytes(rust_rules_response_bytes):
+    response = rust_rules_response_bytes * 4
+    assert len(response) > FRAGMENT_MAX_SIZE
+    return response
+
+
+async def test_large_response_split_once(cached_proxy, large_rules_response_bytes):
+    cached_proxy._store_response('a2s_rules', large_rules_response_bytes)
+
+    response = cached_proxy.get_response_for_data(
+        messages.RulesRequest(challenge=cached_proxy.our_a2s_challenge).encode()
+    )
+    fragments = cached_proxy.get_fragments(response)
+    assert cached_proxy.get_fragments(response) is fragments
+
+    stream = SourceDatagramStream(mock.Mock(), None, None, None)
+    assert [stream.handle_fragments(fragment) for fragment in fragments][-1] == large_rules_response_bytes
+
+    # new version of response has new message id
+    new_response = bytes(bytearray(large_rules_response_bytes))
+    cached_proxy._store_response('a2s_rules', new_response)
+    new_fragments = cached_proxy.get_fragments(new_response)
+    assert new_fragments is not fragments
+    assert new_fragments[0][4:8] != fragments[0][4:8]
+    assert new_fragments[0][8:] == fragments[0][8:]
+
+
+async def test_large_response_split_on_first_send(large_rules_response_bytes):
+    store = SharedResponseStore(['Server1'])
+    shared_cache = store.get_cache('Server1')
+    shared_cache['a2s_rules'] = large_rules_response_bytes
+
+    proxy = _make_proxy()
+    proxy.polling = False
+    proxy.use_shared_cache(store.get_cache('Server1'))
+
+    response = proxy.resp_cache['a2s_rules']
+    fragments = proxy.get_fragments(response)
+    assert proxy.get_fragments(proxy.resp_cache['a2s_rules']) is fragments
+
+    shared_cache['a2s_rules'] = large_rules_response_bytes
+    assert proxy.get_fragments(proxy.resp_cache['a2s_rules']) is not fragments
+
+
+async def test_proxy_large_rules(game_server_proxy, game_server_mock, large_rules_response_bytes):
+    game_server_mock.rules_response = large_rules_response_bytes
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+
+    client = await connect(('127.0.0.1', 27915))
+    for _ in range(2):
+        await client.send_packet(messages.RulesRequest(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
+        with async_timeout.timeout(1):
+            message, data, addr = await client.recv_packet()
+
+        assert data == large_rules_response_bytes
+
+
+@pytest.mark.parametrize('override_server_proxy_settings', [{'compress_responses': True}], indirect=True)
+async def test_proxy_large_rules_compressed(
+    game_server_proxy, game_server_mock, large_rules_response_bytes, override_server_proxy_settings
+):
+    game_server_mock.rules_response = large_rules_response_bytes
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+
+    fragments = game_server_proxy.get_fragments(game_server_proxy.resp_cache['a2s_rules'])
+    assert len(fragments) == 1
+    assert messages.Fragment.decode(fragments[0], messages.HEADER_SIZE).is_compressed
+
+    client = await connect(('127.0.0.1', 27915))
+    await client.send_packet(messages.RulesRequest(challenge=game_server_proxy.challenge_for('127.0.0.1')).encode())
+    with async_timeout.timeout(1):
+        message, data, addr = await client.recv_packet()
+
+    assert data == large_rules_response_bytes
+    client.close()
+
+
+async def test_not_compressible_response_not_compressed():
+    proxy = _make_proxy()
+    proxy.settings.compress_responses = True
+    response = b'\xff\xff\xff\xffE' + os.urandom(5000)
+    proxy._store_response('a2s_rules', response)
+
+    fragments = proxy.get_fragments(response)
+    assert not messages.Fragment.decode(fragments[0], messages.HEADER_SIZE).is_compressed
+
+
+@pytest.mark.parametrize(
+    'override_server_proxy_settings', [{'client_rate_limit': 0.1, 'client_rate_burst': 2}], indirect=True
+)
+async def test_proxy_rate_limited(game_server_proxy, override_server_proxy_settings):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    client = await connect(('127.0.0.1', 27915))
+
+    for _ in range(3):
+        await client.send_packet(messages.PlayersRequest(challenge=-1).encode())
+
+    for _ in range(2):
+        with async_timeout.timeout(1):
+            message, data, addr = await client.recv_packet()
+        assert isinstance(message, messages.GetChallengeResponse)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(client.recv_packet(), 0.1)
+
+    assert game_server_proxy.client_stats['rate_limited'] == 1
+    client.close()
+
+
+@pytest.mark.parametrize('override_server_proxy_settings', [{'heavy_hitter_threshold': 3}], indirect=True)
+async def test_proxy_heavy_hitter_banned(game_server_proxy, override_server_proxy_settings):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    client = await connect(('127.0.0.1', 27915))
+
+    for _ in range(4):
+        await client.send_packet(messages.PlayersRequest(challenge=-1).encode())
+
+    for _ in range(2):
+        with async_timeout.timeout(1):
+            message, data, addr = await client.recv_packet()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(client.recv_packet(), 0.1)
+
+    assert game_server_proxy.client_stats['banned'] == 2
+    assert game_server_proxy.heavy_hitters.get_bans() == ['127.0.0.1']
+    client.close()
+
+
+@pytest.mark.parametrize('override_server_proxy_settings', [{'acl': {'deny': ['127.0.0.2']}}], indirect=True)
+@pytest.mark.parametrize('server_deny', [False, True], ids=['global', 'server'])
+async def test_proxy_acl_denied(game_server_proxy, override_server_proxy_settings, server_deny):
+    if server_deny:
+        game_server_proxy.acl = AccessListSource(deny=['127.0.0.0/8'])
+    else:
+        game_server_proxy.global_acl = AccessListSource(deny=['127.0.0.0/8'])
+
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    client = await connect(('127.0.0.1', 27915))
+
+    await client.send_packet(messages.PlayersRequest(challenge=-1).encode())
     with pytest.raises(asyncio.TimeoutError):
         await asyncio.wait_for(client.recv_packet(), 0.1)
+
+    assert game_server_proxy.client_stats['denied'] == 1
+    client.close()
+
+
+@pytest.mark.parametrize(
+    'override_server_proxy_settings',
+    [{'client_rate_limit': 0.1, 'client_rate_burst': 1, 'acl': {'allow': ['127.0.0.1'], 'deny': ['127.0.0.0/8']}}],
+    indirect=True,
+)
+async def test_proxy_acl_allowed_not_limited(game_server_proxy, override_server_proxy_settings):
+    await asyncio.wait_for(game_server_proxy.wait_ready(), timeout=1)
+    client = await connect(('127.0.0.1', 27915))
+
+    for _ in range(3):
+        await client.send_packet(messages.PlayersRequest(challenge=-1).encode())
+    for _ in range(3):
+        with async_timeout.timeout(1):
+            await client.recv_packet()
+
+    assert not game_server_proxy.client_stats
+    client.close()
@@ -0,0 +1,49 @@
+import pytest
+
+from source_query_proxy.ratelimit import RateLimiter
+
+HOST = '10.0.0.1'
+
+
+@pytest.fixture()
+def limiter():
+    return RateLimiter(rate=10, burst=3, table_size=1024)
+
+
+def test_burst_then_rate(limiter):
+    assert [limiter.allow(HOST, now=100) for _ in range(4)] == [True, True, True, False]
+    assert not limiter.allow(HOST, now=100.05)
+    assert limiter.allow(HOST, now=100.1)
+    assert not limiter.allow(HOST, now=100.1)
+    assert limiter.stats == {'allowed': 4, 'dropped': 3}
+
+
+def test_refilled_after_idle(limiter):
+    for _ in range(10):
+        limiter.allow(HOST, now=100)
+    assert [limiter.allow(HOST, now=200) for _ in range(4)] == [True, True, True, False]
+
+
+def test_sources_independent(limiter):
+    for _ in range(10):
+        limiter.allow(HOST, now=100)
+    assert limiter.allow('10.0.0.2', now=100)
+
+
+def test_subnet_aggregated():
+    limiter = RateLimiter(rate=10, burst=2, aggregate_subnet=True)
+    assert limiter.allow('10.0.0.1', now=100)
+    assert limiter.allow('10.0.0.2', now=100)
+    assert not limiter.allow('10.0.0.3', now=100)
+    assert limiter.allow('10.0.1.1', now=100)
+
+
+def test_memory_bounded_under_flood(limiter):
+    size = limiter._rows[0].buffer_info()[1]
+    for index in range(100000):
+        limiter.allow(f'10.{index // 65536}.{index // 256 % 256}.{index % 256}', now=100)
+    assert limiter._rows[0].buffer_info()[1] == size == 1024
+
+    # flood of unique sources doesn't block everyone
+    allowed = sum(limiter.allow(f'192.168.0.{index}', now=101) for index in range(100))
+    assert allowed > 90
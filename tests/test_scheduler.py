@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from source_query_proxy.scheduler import PollScheduler
+
+pytestmark = [pytest.mark.asyncio]
+
+
+@pytest.fixture()
+async def run_scheduler():
+    tasks = []
+
+    def run(scheduler):
+        tasks.append(asyncio.ensure_future(scheduler.run()))
+        return scheduler
+
+    yield run
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class FakeLoop:
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture()
+def fake_loop(mocker):
+    loop = FakeLoop()
+    mocker.patch.object(PollScheduler, '_loop', mocker.PropertyMock(return_value=loop))
+    return loop
+
+
+@pytest.mark.parametrize('jitter', [0, 0.1, 0.5])
+def test_next_delay_jitter(mocker, jitter):
+    uniform = mocker.patch('source_query_proxy.scheduler.random.uniform', side_effect=lambda low, high: high)
+    scheduler = PollScheduler(jitter=jitter)
+    job = scheduler.add('job', None, lambda: 10)
+
+    assert scheduler._next_delay(job) == pytest.approx(10 * (1 + jitter))
+    uniform.assert_called_once_with(pytest.approx(1 - jitter), pytest.approx(1 + jitter))
+
+
+async def test_polls_spread_by_jitter(fake_loop, mocker):
+    mocker.patch('source_query_proxy.scheduler.random.uniform', side_effect=[1.5, 0.5, 1.0])
+    scheduler = PollScheduler(jitter=0.5)
+    polls = []
+
+    async def poll():
+        polls.append(fake_loop.time())
+
+    first = scheduler.add('first', poll, lambda: 10)
+    second = scheduler.add('second', poll, lambda: 10, delay=1)
+    third = scheduler.add('third', poll, lambda: 10, delay=2)
+    slots = asyncio.Semaphore()
+
+    # each poll rescheduled with own jittered interval
+    for job in (first, second, third):
+        fake_loop.now = job.deadline
+        scheduler._start(job, slots)
+        await asyncio.gather(*scheduler._running)
+
+    assert polls == [100, 101, 102]
+    assert (first.deadline, second.deadline, third.deadline) == (115, 106, 112)
+    # polls ordered by jittered deadlines, stale entries of heap are skipped by `run()`
+    live = sorted((deadline, job.name) for deadline, _, job in scheduler._heap if deadline == job.deadline)
+    assert live == [(106, 'second'), (112, 'third'), (115, 'first')]
+    assert scheduler.lateness_max == 0
+    assert scheduler.stats['polls'] == 3
+
+
+async def test_max_in_flight(run_scheduler):
+    scheduler = run_scheduler(PollScheduler(jitter=0, max_in_flight=2))
+    running = 0
+    max_running = 0
+
+    async def poll():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    for index in range(5):
+        scheduler.add(f'job-{index}', poll, lambda: 10)
+
+    await asyncio.sleep(0.01)
+    assert scheduler.in_flight == 2
+    assert scheduler.queue_depth == 3
+
+    await asyncio.sleep(0.2)
+    assert max_running == 2
+    assert scheduler.stats['polls'] == 5
+    assert scheduler.queue_depth == 0
+    # last polls waited two previous rounds
+    assert scheduler.lateness_max >= 0.09
+
+
+async def test_removed_job_not_polled(run_scheduler):
+    scheduler = run_scheduler(PollScheduler())
+    polls = 0
+
+    async def poll():
+        nonlocal polls
+        polls += 1
+
+    job = scheduler.add('job', poll, lambda: 0.01)
+    await asyncio.sleep(0.05)
+    scheduler.remove(job)
+    polls_before = polls
+    await asyncio.sleep(0.05)
+
+    assert polls_before > 1
+    assert polls == polls_before
+
+
+async def test_failed_poll_rescheduled(run_scheduler):
+    scheduler = run_scheduler(PollScheduler())
+
+    async def poll():
+        raise ConnectionRefusedError
+
+    scheduler.add('job', poll, lambda: 0.01)
+    await asyncio.sleep(0.05)
+
+    assert scheduler.stats['poll_errors'] > 1
+    assert scheduler.stats['poll_errors'] == scheduler.stats['polls']
+
+
+async def test_group_polls_deferred_without_slot(run_scheduler):
+    scheduler = run_scheduler(PollScheduler(jitter=0, max_in_flight=2))
+    log = []
+
+    def make_poll(name, duration):
+        async def poll():
+            log.append(('start', name))
+            await asyncio.sleep(duration)
+            log.append(('end', name))
+
+        return poll
+
+    for index in range(3):
+        scheduler.add(f'slow-{index}', make_poll(f'slow-{index}', 0.05), lambda: 10, group='slow')
+    scheduler.add('other', make_poll('other', 0), lambda: 10)
+
+    await asyncio.sleep(0.01)
+    # polls of busy group deferred, slot is free for other server
+    assert ('end', 'other') in log
+    assert scheduler.in_flight == 1
+    assert scheduler.queue_depth == 2
+
+    await asyncio.sleep(0.2)
+    slow = [event for event in log if 'slow' in event[1]]
+    assert slow == [(event, f'slow-{index}') for index in range(3) for event in ('start', 'end')]
+    assert scheduler.queue_depth == 0
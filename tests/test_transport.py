@@ -1,10 +1,24 @@
+import asyncio
+import os
+import socket
+
 import pytest
 
+from source_query_proxy import mmsg
 from source_query_proxy.source import messages
+from source_query_proxy.transport import DROP_NEWEST
+from source_query_proxy.transport import DROP_OLDEST
+from source_query_proxy.transport import FRAGMENT_HEADER_SIZE
+from source_query_proxy.transport import FRAGMENT_MAX_SIZE
+from source_query_proxy.transport import BoundedRecvQueue
 from source_query_proxy.transport import SourceDatagramClient
 from source_query_proxy.transport import SourceDatagramServer
+from source_query_proxy.transport import SourceDatagramStream
 from source_query_proxy.transport import bind
+from source_query_proxy.transport import bind_answering
 from source_query_proxy.transport import connect
+from source_query_proxy.transport import split_compressed_packet
+from source_query_proxy.transport import split_packet
 
 pytestmark = [pytest.mark.asyncio]
 
@@ -91,3 +105,228 @@ async def test_source_client_send_request(client_socket, client, addr_family):
     await client.send_bytes(b'hi')
     got, client_addr = client_socket.recvfrom(4)
     assert got == b'hi'
+
+
+@pytest.fixture()
+async def batched_server(addr_family) -> SourceDatagramServer:
+    addr, _ = addr_family
+    server = await bind(addr, batched=True)
+    yield server
+    server.close()
+
+
+@pytest.mark.skipif(not mmsg.is_available(), reason='recvmmsg/sendmmsg not supported')
+@pytest.mark.parametrize('addr_family', ['INET', 'INET6'], indirect=True)
+async def test_batched_server_recv_send(udp_socket, batched_server, challenge, addr_family):
+    udp_socket.settimeout(1)
+    udp_socket.connect(batched_server.sockname)
+    for _ in range(3):
+        udp_socket.send(messages.PlayersRequest(challenge=challenge).encode())
+
+    for _ in range(3):
+        request, data, addr = await batched_server.recv_packet()
+        assert isinstance(request, messages.PlayersRequest), request
+        assert addr == udp_socket.getsockname()
+
+        await batched_server.send_packet(b'x' * 3000, addr=addr)
+
+    split_size = SourceDatagramServer.FRAGMENT_MAX_SIZE
+    fragment_header_size = len(
+        messages.Fragment().encode(message_id=1, fragment_count=1, fragment_id=0, mtu=0, split_header=True)
+    )
+    payload_size = split_size - fragment_header_size
+    last_fragment_size = 3000 - 2 * payload_size + fragment_header_size
+
+    # replies are flushed on next loop iteration
+    await asyncio.sleep(0)
+    fragment_sizes = [len(udp_socket.recv(4096)) for _ in range(3 * 3)]
+    assert fragment_sizes == [split_size, split_size, last_fragment_size] * 3
+
+
+class _CollectingProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.received = []
+
+    def datagram_received(self, data, addr):
+        self.received.append(data)
+
+
+@pytest.mark.skipif(not mmsg.is_available(), reason='recvmmsg/sendmmsg not supported')
+async def test_batched_truncated_dropped(udp_socket):
+    transport, protocol = await mmsg.create_batched_endpoint(_CollectingProtocol, ('127.0.0.1', 0))
+    udp_socket.connect(transport.get_extra_info('sockname'))
+
+    udp_socket.send(b'x' * (mmsg.DEFAULT_RECV_BUFFER_SIZE + 1))
+    udp_socket.send(b'x' * mmsg.DEFAULT_RECV_BUFFER_SIZE)
+    await asyncio.sleep(0.05)
+
+    assert [len(data) for data in protocol.received] == [mmsg.DEFAULT_RECV_BUFFER_SIZE]
+    assert transport.stats['truncated'] == 1
+    transport.close()
+
+
+@pytest.mark.skipif(not mmsg.is_available(), reason='recvmmsg/sendmmsg not supported')
+async def test_batched_closed_before_reader_added():
+    loop = asyncio.get_event_loop()
+    sock = mmsg.create_bound_socket(('127.0.0.1', 0))
+    fileno = sock.fileno()
+    transport = mmsg.BatchedDatagramTransport(loop, sock, _CollectingProtocol())
+    transport.close()
+    await asyncio.sleep(0)
+
+    assert not loop.remove_reader(fileno)
+    assert sock.fileno() == -1
+
+
+@pytest.mark.parametrize('size', [1201, 2376, 2390, 3000, 20000])
+def test_split_packet(size, mocker):
+    packet = bytes(range(256)) * (size // 256) + b'x' * (size % 256)
+    fragments = split_packet(packet, message_id=42)
+
+    assert all(len(fragment) <= FRAGMENT_MAX_SIZE for fragment in fragments)
+    assert len(fragments) == -(-size // (FRAGMENT_MAX_SIZE - FRAGMENT_HEADER_SIZE))
+
+    stream = SourceDatagramStream(mocker.Mock(), None, None, None)
+    results = [stream.handle_fragments(fragment) for fragment in reversed(fragments)]
+    assert results[:-1] == [None] * (len(fragments) - 1)
+    assert results[-1] == packet
+
+    header = messages.Fragment.decode(messages.Header.decode(fragments[0]).raw_tail)
+    assert header['message_id'] == 42
+    assert not header.is_compressed
+
+
+@pytest.mark.parametrize('size', [100, 3000, 20000])
+def test_split_compressed_packet(size, mocker):
+    packet = os.urandom(size)
+    fragments = split_compressed_packet(packet, message_id=42)
+
+    assert all(len(fragment) <= FRAGMENT_MAX_SIZE for fragment in fragments)
+
+    stream = SourceDatagramStream(mocker.Mock(), None, None, None)
+    results = [stream.handle_fragments(fragment) for fragment in reversed(fragments)]
+    assert results[:-1] == [None] * (len(fragments) - 1)
+    assert results[-1] == packet
+
+    header = messages.CompressedFragment.decode(fragments[0], messages.HEADER_SIZE)
+    assert header['message_id'] & 0x7FFFFFFF == 42
+    assert header['fragment_count'] == len(fragments)
+    assert header['size'] == size
+
+
+@pytest.mark.parametrize(('policy', 'kept'), [(DROP_OLDEST, [3, 4]), (DROP_NEWEST, [0, 1])])
+async def test_bounded_recv_queue(policy, kept):
+    queue = BoundedRecvQueue(2, policy)
+    for index in range(5):
+        queue.put_nowait((index, None))
+
+    assert [queue.get_nowait()[0] for _ in range(queue.qsize())] == kept
+    assert queue.stats['dropped'] == 3
+
+
+@pytest.mark.parametrize('policy', [DROP_OLDEST, DROP_NEWEST])
+async def test_bounded_recv_queue_end_of_stream_not_dropped(policy):
+    queue = BoundedRecvQueue(1, policy)
+    queue.put_nowait((b'data', None))
+    queue.put_nowait((None, None))
+
+    assert queue.get_nowait() == (None, None)
+
+
+@pytest.mark.parametrize('policy', [DROP_OLDEST, DROP_NEWEST])
+async def test_bind_recv_queue_bounded(udp_socket, addr_family, policy):
+    addr, _ = addr_family
+    server = await bind(addr, recv_queue_size=4, recv_queue_policy=policy)
+    udp_socket.connect(server.sockname)
+
+    for index in range(10):
+        udp_socket.send(b'\xff\xff\xff\xff' + bytes([index]))
+    await asyncio.sleep(0.1)
+
+    received = [(await server.recv_raw_packet())[0][-1] for _ in range(4)]
+    assert received == ([6, 7, 8, 9] if policy == DROP_OLDEST else [0, 1, 2, 3])
+    assert server.recv_stats['dropped'] == 6
+    server.close()
+
+
+@pytest.fixture(params=[False, True], ids=['default-io', 'batched-io'])
+async def answering(request, addr_family):
+    addr, _ = addr_family
+    requests = []
+
+    def handler(data, addr):
+        requests.append(data)
+        if data.endswith(b'ignore'):
+            return None
+        return data * 2
+
+    transport, protocol = await bind_answering(addr, handler, batched=request.param)
+    yield transport, protocol, requests
+    transport.close()
+
+
+def _local_addr(transport, addr_family):
+    _, family = addr_family
+    port = transport.get_extra_info('sockname')[1]
+    return ('127.0.0.1' if family == socket.AF_INET else '::1'), port
+
+
+async def _recv(sock):
+    return await asyncio.get_event_loop().run_in_executor(None, sock.recv, 2048)
+
+
+async def test_answering_protocol(answering, udp_socket, addr_family, mocker):
+    transport, protocol, requests = answering
+    udp_socket.settimeout(1)
+    udp_socket.connect(_local_addr(transport, addr_family))
+
+    udp_socket.send(b'\xff\xff\xff\xffignore')
+    udp_socket.send(b'\xff\xff\xff\xffhello')
+    assert await _recv(udp_socket) == b'\xff\xff\xff\xffhello' * 2
+
+    # split request reassembled, large response split
+    request = b'\xff\xff\xff\xff' + os.urandom(2000)
+    for fragment in split_packet(request):
+        udp_socket.send(fragment)
+    fragments = [await _recv(udp_socket) for _ in range(len(split_packet(request * 2)))]
+
+    stream = SourceDatagramStream(mocker.Mock(), None, None, None)
+    assert [stream.handle_fragments(fragment) for fragment in fragments][-1] == request * 2
+    assert requests == [b'\xff\xff\xff\xffignore', b'\xff\xff\xff\xffhello', request]
+
+
+async def test_answering_protocol_closed(answering):
+    transport, protocol, requests = answering
+    transport.close()
+    await asyncio.wait_for(protocol.closed, 1)
+
+
+async def test_answering_protocol_write_paused(answering, udp_socket, addr_family):
+    transport, protocol, requests = answering
+    udp_socket.connect(_local_addr(transport, addr_family))
+
+    protocol.pause_writing()
+    udp_socket.send(b'\xff\xff\xff\xffhello')
+    await asyncio.sleep(0.1)
+    assert protocol.stats['send_paused'] == 1
+
+
+async def test_answering_protocol_compressed_rejected(answering, udp_socket, addr_family):
+    transport, protocol, requests = answering
+    udp_socket.connect(_local_addr(transport, addr_family))
+
+    for fragment in split_compressed_packet(b'\xff\xff\xff\xff' + os.urandom(20000)):
+        udp_socket.send(fragment)
+    udp_socket.send(b'\xff\xff\xff\xffhello')
+    await asyncio.sleep(0.1)
+
+    assert requests == [b'\xff\xff\xff\xffhello']
+    assert protocol.stats['broken'] > 0
+    assert not protocol.decompressor.stats
+
+
+def test_server_compressed_rejected(mocker):
+    server = SourceDatagramServer(mocker.Mock(), None, None, None)
+    fragment = split_compressed_packet(os.urandom(100))[0]
+    with pytest.raises(messages.BrokenMessageError):
+        server.handle_fragments(fragment)
@@ -0,0 +1,105 @@
+import os
+import signal
+
+import pytest
+
+from source_query_proxy import workers
+from source_query_proxy.shm import SharedResponseStore
+
+
+@pytest.fixture()
+def response_store():
+    return SharedResponseStore(['Server1', 'Server2'], slot_capacity=1024)
+
+
+def test_shared_cache_read_write(response_store):
+    writer = response_store.get_cache('Server1')
+    reader = response_store.get_cache('Server1')
+
+    assert 'a2s_info' not in reader
+    assert reader.get('a2s_info') is None
+    assert not reader.online
+
+    writer['a2s_info'] = b'info-1'
+    writer.online = True
+    assert reader['a2s_info'] == b'info-1'
+    assert dict(reader) == {'a2s_info': b'info-1'}
+    assert reader.online
+
+    # other servers are not affected
+    assert not response_store.get_cache('Server2')
+
+
+def test_shared_cache_view_intact_after_next_write(response_store):
+    cache = response_store.get_cache('Server1')
+    cache['a2s_rules'] = b'first'
+    view = cache['a2s_rules']
+
+    cache['a2s_rules'] = b'second-longer'
+    assert view == b'first'
+    assert cache['a2s_rules'] == b'second-longer'
+    assert cache.get_bytes('a2s_rules') == b'second-longer'
+
+
+def test_shared_cache_demand(response_store):
+    cache = response_store.get_cache('Server1')
+    assert cache.get_demand('a2s_players') == 0
+
+    cache.add_demand('a2s_players', 3)
+    cache.add_demand('a2s_players', 2)
+    assert cache.get_demand('a2s_players') == 5
+    assert cache.get_demand('a2s_rules') == 0
+    assert not cache.online
+    assert response_store.get_cache('Server2').get_demand('a2s_players') == 0
+
+
+def test_shared_cache_ignores_too_large_response(response_store):
+    cache = response_store.get_cache('Server1')
+    cache['a2s_rules'] = b'small'
+    cache['a2s_rules'] = b'x' * 1025
+    assert cache['a2s_rules'] == b'small'
+
+
+def test_shared_cache_between_processes(response_store):
+    cache = response_store.get_cache('Server2')
+
+    pid = os.fork()
+    if pid == 0:
+        cache['a2s_players'] = b'from child'
+        cache.online = True
+        os._exit(0)
+
+    os.waitpid(pid, 0)
+    assert cache['a2s_players'] == b'from child'
+    assert cache.online
+
+
+@pytest.fixture()
+def _restore_signals():
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1)}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+@pytest.mark.usefixtures('_restore_signals')
+def test_supervisor_restarts_crashed_worker(tmp_path, mocker):
+    logger_error_mock = mocker.patch.object(workers.logger, 'error')
+    runs_file = tmp_path.joinpath('runs')
+
+    def target(worker):
+        with runs_file.open('a') as fp:
+            fp.write(f'{worker.index}\n')
+
+        if len(runs_file.read_text().split()) == 1:
+            raise RuntimeError('crash')
+
+        # second run: stop all
+        os.kill(os.getppid(), signal.SIGTERM)
+
+    supervisor = workers.Supervisor(1, target=target)
+    supervisor.restart_delay = 0
+    supervisor.run()
+
+    assert runs_file.read_text().split() == ['0', '0']
+    assert logger_error_mock.call_count == 1